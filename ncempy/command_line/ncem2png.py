@@ -6,6 +6,8 @@ from ncempy.io.ser import fileSER
 import ntpath
 import os
 
+import numpy as np
+
 from matplotlib import cm
 from matplotlib.image import imsave
 
@@ -29,7 +31,9 @@ def extract_dimension(img, fixed_dimensions=None):
 
     dimension=len(img.shape)
     if fixed_dimensions is None:
-        if dimension == 3:
+        if dimension <= 2:
+            return out_img
+        elif dimension == 3:
             fixed_dimensions=[int(img.shape[0]/2),
                               '','']
         elif dimension == 4:
@@ -66,15 +70,20 @@ def extract_dimension(img, fixed_dimensions=None):
     out_img = img[d_tuple] 
     return out_img
 
-def dm_to_png(source_file, dest_file, fixed_dimensions=None):
+def dm_to_png(source_file, dest_file, fixed_dimensions=None, max_size=None):
     """ Saves the DM3 or DM4 source_file as PNG dest_file. If the data has three
     of four dimensions. The image taken is from the middle image in those
-    dimensions."""
+    dimensions. Only the selected image is read from the file. If max_size is
+    set, a preview of at most max_size pixels is saved instead (the thumbnail if
+    it exists)."""
     f = fileDM(source_file, on_memory=True)
-    f.parseHeader()
-    ds = f.getDataset(0)
-    img = ds['data']
-    img = extract_dimension(img, fixed_dimensions)
+    if max_size:
+        img = f.getPreview(max_size)
+    else:
+        img = f.getMemmap(0)
+        if img.ndim == 1:
+            img = img.reshape((1, img.shape[0]))  # spectra
+        img = np.array(extract_dimension(img, fixed_dimensions))
     imsave(dest_file, img, format="png", cmap=cm.gray)
     return f
 
@@ -112,6 +121,12 @@ def main():
                         " an png with the values y,z of x=2. ',m,,2' will "
                         " extract all the values x,z for y=1/2shapeY, and w=2.",
                         default=None)
+
+    parser.add_argument('--max_size', dest='max_size', action='store',
+                        type=int, default=None,
+                        help='Save a fast preview of DM3 and DM4 files with at'
+                        ' most max_size pixels along each axis. The embedded'
+                        ' thumbnail is used if it exists.')
     
     args = parser.parse_args()
     
@@ -137,7 +152,8 @@ def main():
         print("Extracting from {}, saving image as {}".format(source_file,
                                                       dest_file ))
         if extension in ["dm3","dm4"]:
-            dm_to_png(source_file, dest_file, fixed_dimensions=fixed_dimensions)
+            dm_to_png(source_file, dest_file, fixed_dimensions=fixed_dimensions,
+                      max_size=args.max_size)
         
         if extension in ["ser"]:
             ser_to_png(source_file, dest_file)
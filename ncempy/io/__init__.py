@@ -7,6 +7,7 @@ from . import mrc
 from . import emdVelox
 from . import smv
 from . import dectris
+from . import cache
 
 def read(filename, dsetNum=0):
     """
@@ -0,0 +1,313 @@
+"""
+A persistent on-disk cache of parsed file headers for the DM, SER and MRC readers.
+
+Parsing the header of a large DM4 file or the offset arrays of a SER file with many elements can take
+a significant amount of time. Files that are opened many times can store the parsed header in a small
+index file. Reopening the file then only needs to read this index instead of parsing the header again.
+
+Note
+----
+The cache is opt-in. Enable it for all readers with cache.enable() or for a single file with the
+cache keyword of the fileDM, fileSER and fileMRC classes.
+
+Each index file is keyed by the resolved file path and stores the file size and modification time. Readers
+that also parse other files (i.e. the EMI file of a SER file) store their size and modification time as well. An
+index is ignored and replaced if any of these files has changed. Index files are JSON documents with a fixed
+layout. Only dictionaries, lists, tuples, numbers, strings and numpy scalars, arrays and types are stored, so
+loading an index never executes code.
+
+Examples
+--------
+Enable the cache for all readers and store the index files in a custom directory
+>> import ncempy.io as nio
+>> nio.cache.enable('/path/to/cache')
+>> dm0 = nio.dm.dmReader('filename.dm4')  # the header is parsed and saved
+>> dm0 = nio.dm.dmReader('filename.dm4')  # the header is loaded from the cache
+
+"""
+
+from pathlib import Path
+import base64
+import hashlib
+import json
+import os
+
+import numpy as np
+
+# Increment this if the content of the cached headers change to invalidate old index files
+CACHE_VERSION = 3
+
+# The reader names used in the index keys
+_READERS = ('dm-full', 'dm-lazy', 'ser', 'mrc')
+
+_enabled = False
+_cache_dir = None
+
+
+def default_cache_dir():
+    """ The default cache directory. This is the NCEMPY_CACHE_DIR environment variable
+    if it is set or ~/.cache/ncempy otherwise.
+
+    Returns
+    -------
+        : pathlib.Path
+            The default cache directory.
+    """
+    env = os.environ.get('NCEMPY_CACHE_DIR')
+    if env:
+        return Path(env)
+    return Path.home() / '.cache' / 'ncempy'
+
+
+def enable(cache_dir=None):
+    """ Enable the header cache for all readers.
+
+    Parameters
+    ----------
+        cache_dir : str or pathlib.Path, optional
+            The directory to store the index files in. See default_cache_dir() for the default location.
+
+    """
+    global _enabled
+    _enabled = True
+    if cache_dir is not None:
+        set_cache_dir(cache_dir)
+
+
+def disable():
+    """ Disable the header cache for all readers. Existing index files are kept.
+
+    """
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    """ Return True if the header cache is enabled for all readers.
+
+    """
+    return _enabled
+
+
+def set_cache_dir(cache_dir):
+    """ Set the directory to store the index files in.
+
+    Parameters
+    ----------
+        cache_dir : str or pathlib.Path or None
+            The new cache directory. None resets to the default location.
+
+    """
+    global _cache_dir
+    if cache_dir is None:
+        _cache_dir = None
+    else:
+        _cache_dir = Path(cache_dir)
+
+
+def get_cache_dir():
+    """ Return the directory used to store the index files.
+
+    Returns
+    -------
+        : pathlib.Path
+            The current cache directory.
+    """
+    if _cache_dir is None:
+        return default_cache_dir()
+    return _cache_dir
+
+
+def use_cache(cache=None):
+    """ Determine if a reader should use the cache.
+
+    Parameters
+    ----------
+        cache : bool or None
+            The cache keyword passed to the reader. None uses the global setting.
+
+    Returns
+    -------
+        : bool
+            True if the cache should be used.
+    """
+    if cache is None:
+        return _enabled
+    return bool(cache)
+
+
+def _index_path(file_path, reader):
+    """ The index file for a data file and reader.
+
+    """
+    key = '{}|{}'.format(reader, Path(file_path).resolve())
+    return get_cache_dir() / (hashlib.sha1(key.encode('utf-8')).hexdigest() + '.idx')
+
+
+def _file_key(file_path, depends=()):
+    """ The size and modification time used to check if an index file is still valid. Each dependency adds
+    its size and modification time or None if it does not exist.
+
+    """
+    stats = os.stat(file_path)
+    key = (stats.st_size, stats.st_mtime_ns)
+    for depend in depends:
+        try:
+            stats = os.stat(depend)
+            key += ((stats.st_size, stats.st_mtime_ns),)
+        except FileNotFoundError:
+            key += (None,)
+    return key
+
+
+def _encode(value):
+    """ Convert a header value to plain JSON types. Dictionaries, tuples and numpy values are stored as objects
+    with a single key naming their type. Lists and JSON scalars are stored as they are.
+
+    Raises
+    ------
+        TypeError
+            If the value contains a type that can not be stored.
+    """
+    if isinstance(value, np.generic):
+        # before the python types since numpy.float64 is a float
+        if value.dtype.kind in 'biuf':
+            return {'scalar': [value.dtype.str, value.item()]}
+    elif value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    elif isinstance(value, list):
+        return [_encode(item) for item in value]
+    elif isinstance(value, tuple):
+        return {'tuple': [_encode(item) for item in value]}
+    elif isinstance(value, dict):
+        return {'dict': [[_encode(key), _encode(item)] for key, item in value.items()]}
+    elif isinstance(value, np.ndarray) and value.dtype.kind in 'biufc':
+        return {'ndarray': [value.dtype.str, list(value.shape),
+                            base64.b64encode(np.ascontiguousarray(value).tobytes()).decode('ascii')]}
+    elif isinstance(value, type) and issubclass(value, np.generic):
+        return {'type': np.dtype(value).str}
+    raise TypeError('Can not store values of type {} in the header cache.'.format(type(value)))
+
+
+def _decode(value):
+    """ Convert the plain JSON types written by _encode back to the header values.
+
+    """
+    if isinstance(value, list):
+        return [_decode(item) for item in value]
+    elif not isinstance(value, dict):
+        return value
+    (kind, item), = value.items()
+    if kind == 'tuple':
+        return tuple(_decode(ii) for ii in item)
+    elif kind == 'dict':
+        return {_decode(key): _decode(ii) for key, ii in item}
+    elif kind == 'ndarray':
+        dtype, shape, data = item
+        return np.frombuffer(base64.b64decode(data), dtype=np.dtype(dtype)).reshape(shape).copy()
+    elif kind == 'scalar':
+        return np.dtype(item[0]).type(item[1])
+    elif kind == 'type':
+        return np.dtype(item).type
+    raise ValueError('Unknown value type {} in index file.'.format(kind))
+
+
+def load(file_path, reader, depends=()):
+    """ Load a cached header.
+
+    Parameters
+    ----------
+        file_path : str or pathlib.Path
+            The data file the header belongs to.
+        reader : str
+            The name of the reader that parsed the header (i.e. 'dm-full', 'ser', 'mrc').
+        depends : sequence of str or pathlib.Path, optional
+            Other files the header was parsed from. The index is only valid if these are unchanged, too.
+
+    Returns
+    -------
+        : dict or None
+            The cached header or None if there is no valid index for this file.
+    """
+    index_path = _index_path(file_path, reader)
+    try:
+        with open(index_path, 'r', encoding='utf-8') as fid:
+            index = _decode(json.load(fid))
+        if index['version'] == CACHE_VERSION and index['key'] == _file_key(file_path, depends):
+            return index['header']
+    except FileNotFoundError:
+        return None
+    except Exception:
+        pass
+    # The index is stale or unreadable
+    try:
+        index_path.unlink()
+    except OSError:
+        pass
+    return None
+
+
+def save(file_path, reader, header, depends=()):
+    """ Save a parsed header to the cache. Errors writing the index and headers with values that can not be
+    stored are ignored.
+
+    Parameters
+    ----------
+        file_path : str or pathlib.Path
+            The data file the header belongs to.
+        reader : str
+            The name of the reader that parsed the header (i.e. 'dm-full', 'ser', 'mrc').
+        header : dict
+            The parsed header.
+        depends : sequence of str or pathlib.Path, optional
+            Other files the header was parsed from. See load().
+
+    """
+    index_path = _index_path(file_path, reader)
+    index = {'version': CACHE_VERSION, 'key': _file_key(file_path, depends), 'header': header}
+    try:
+        text = json.dumps(_encode(index), separators=(',', ':'))
+    except (TypeError, ValueError):
+        return  # the header contains values that can not be stored
+    temp_path = index_path.with_suffix('.{}.tmp'.format(os.getpid()))
+    try:
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(temp_path, 'w', encoding='utf-8') as fid:
+            fid.write(text)
+        os.replace(temp_path, index_path)
+    except OSError:
+        try:
+            temp_path.unlink()
+        except OSError:
+            pass
+
+
+def invalidate(file_path):
+    """ Remove the index files of all readers for a data file.
+
+    Parameters
+    ----------
+        file_path : str or pathlib.Path
+            The data file to remove from the cache.
+
+    """
+    for reader in _READERS:
+        try:
+            _index_path(file_path, reader).unlink()
+        except OSError:
+            pass
+
+
+def clear():
+    """ Remove all index files from the cache directory.
+
+    """
+    cache_dir = get_cache_dir()
+    if not cache_dir.exists():
+        return
+    for index_path in cache_dir.glob('*.idx'):
+        try:
+            index_path.unlink()
+        except OSError:
+            pass
+
@@ -16,18 +16,75 @@ On Memory mode:
   and read operations during header parsing are performed against memory. This
   can significantly improve performance when the file resides in a parallel file
   system (PFS) because latency of seek operations PFSs is very high.
+
+Tag parser:
+  The tag tree is decoded by default with precompiled struct.Struct unpackers
+  (parser='struct'). The original numpy based parser is still available with
+  parser='numpy' for comparison and debugging.
+
+In-situ series:
+  Gatan in-situ acquisitions write each frame to a separate DM file in a tree of
+  Hour_XX/Minute_XX/Second_XX directories. Use dm.fileDMSeries() to access all
+  frames as one lazily loaded 3D array.
   
 """
 
 from pathlib import Path
 import mmap
 import copy
+import itertools
 import os
+import re
+import struct
 from os import stat as filestats
 from os.path import basename as os_basename
 
 import numpy as np
 
+from . import cache as header_cache
+
+# Precompiled big endian unpackers for the tag tree structure. Keys are the DM version (3 or 4)
+_TAG_ENTRY_STRUCT = struct.Struct('>BH')  # tag or group indicator, label length
+_TAG_GROUP_STRUCTS = {3: struct.Struct('>2bI'), 4: struct.Struct('>2bQ')}  # sorted, open, number of tags
+_TAG_TYPE_STRUCTS = {3: struct.Struct('>4sII'), 4: struct.Struct('>Q4sQQ')}  # (DM4 unknown), %%%%, nInTag, type
+_SPECIAL_STRUCTS = {3: struct.Struct('>I'), 4: struct.Struct('>Q')}
+_SPECIAL_FORMATS = {3: 'I', 4: 'Q'}
+_STRING_SIZE_STRUCT = struct.Struct('>I')
+
+# Little endian unpackers and numpy types for the encoded tag data types
+_NATIVE_FORMATS = {2: 'h', 3: 'i', 4: 'H', 5: 'I', 6: 'f', 7: 'd', 8: 'B', 9: 'b', 10: 'b', 11: 'Q', 12: 'Q'}
+_NATIVE_STRUCTS = {2: (struct.Struct('<h'), np.int16), 3: (struct.Struct('<i'), np.int32),
+                   4: (struct.Struct('<H'), np.uint16), 5: (struct.Struct('<I'), np.uint32),
+                   6: (struct.Struct('<f'), np.float32), 7: (struct.Struct('<d'), np.float64),
+                   8: (struct.Struct('<B'), np.uint8), 9: (struct.Struct('<b'), np.int8),
+                   10: (struct.Struct('<b'), np.int8), 11: (struct.Struct('<Q'), np.uint64),
+                   12: (struct.Struct('<Q'), np.uint64)}
+# Formats used to read small arrays (i.e. strings). Matches fileDM._EncodedTypeDTypes
+_ARRAY_FORMATS = {2: 'h', 3: 'i', 4: 'H', 5: 'I', 6: 'f', 7: 'd', 8: 'B', 9: 'B', 10: 'B', 12: 'Q'}
+
+
+# Target size of the HDF5 chunks written by fileDM.writeEMD()
+_EMD_CHUNK_BYTES = 2 ** 20
+
+# Order in which the output axes of 4D data are filled when choosing chunks for fileDM.writeEMD(). The output
+# is [scanY, scanX, kY, kX]. 'diffraction' keeps whole diffraction patterns in a chunk and 'realspace' keeps
+# whole (virtual) images in a chunk.
+_EMD_LAYOUTS = {'diffraction': (3, 2, 1, 0), 'realspace': (1, 0, 3, 2)}
+
+
+def _fillShape(shape, start, order, itemsize, limit):
+    """Grow a block shape along the axes in order until it reaches limit bytes. The block
+    is a multiple of start along each axis.
+
+    """
+    out = list(start)
+    for axis in order:
+        other = itemsize * int(np.prod(out, dtype=np.int64)) // out[axis]
+        out[axis] = min(shape[axis], max(1, limit // (other * start[axis])) * start[axis])
+        if out[axis] < shape[axis]:
+            break
+    return tuple(out)
+
 
 class fileDM:
     """Opens the file and reads in the header. Data is loaded using the getDataset method.
@@ -68,7 +125,8 @@ class fileDM:
         meant to be *scaled* by the scale before being used. See ncempy.io.dmReader() for proper handling of this
         especially for spectroscopy data.
     allTags : dictionary
-        Contains *all* tags in the DM file as key value pairs.
+        Contains *all* tags in the DM file as key value pairs. With tags='lazy' the tag groups not needed to
+        read the data are decoded the first time this attribute is accessed.
 
     Examples
     --------
@@ -88,13 +146,19 @@ class fileDM:
                  '_maxDepth', '_curGroupAtLevelX', '_curGroupNameAtLevelX',
                  '_curTagAtLevelX', '_curTagName', 'scale', 'scaleUnit',
                  'scaleOrigin', '_scale_temp', '_origin_temp',
-                 'allTags', '_dmType', '_specialType', 'fileSize',
+                 '_allTags', '_dmType', '_specialType', 'fileSize',
                  '_endianType', 'origin', '_encodedTypeSizes',
                  '_buffer_offset', '_buffer_size', '_DM2NPDataTypes',
                  '_TagType2NPDataTypes', 'on_memory', 'verbose',
-                 '_EncodedTypeDTypes','metadata')
+                 '_EncodedTypeDTypes','metadata', '_parser', '_tags',
+                 '_deferredGroups', '_catchTags', '_tagIndex', '_groupIndex')
+
+    # Attributes set by parseHeader which are saved in the header cache
+    _headerAttributes = ('xSize', 'ySize', 'zSize', 'zSize2', 'dataType', 'dataSize', 'dataOffset',
+                         'dataShape', 'scale', 'scaleUnit', 'origin', 'numObjects', 'thumbnail',
+                         '_allTags', '_deferredGroups', '_tagIndex')
 
-    def __init__(self, filename, verbose=False, on_memory=True):
+    def __init__(self, filename, verbose=False, on_memory=True, parser='struct', tags='full', cache=None):
         """
 
         Parameters
@@ -111,15 +175,44 @@ class fileDM:
             for network based or parallel file systems but seems to
             improve reading in all cases.
 
+        parser : str, optional, default 'struct'
+            The engine used to parse the tag tree. 'struct' decodes the tags
+            with precompiled struct unpackers and is much faster for files
+            with many tags. 'numpy' uses the original parser based on numpy
+            reads for every value.
+
+        tags : str, optional, default 'full'
+            If 'full', all tags are decoded when the file is opened. If 'lazy',
+            only the image geometry, data types, calibrations and data offsets
+            in the ImageList are decoded up front. All other tag groups are skipped
+            and decoded on demand by getMetadata() or when allTags is accessed.
+            This requires parser='struct'.
+
+        cache : bool or None, optional, default None
+            If True, the parsed header is loaded from and saved to the header cache.
+            None uses the global setting. See ncempy.io.cache.
+
         """
 
         # Add a top level variable to indicate verbose output for debugging
         self._v = verbose
 
+        if parser not in ('struct', 'numpy'):
+            raise ValueError('Unknown tag parser: {}. Use struct or numpy.'.format(parser))
+        self._parser = parser
+
+        if tags not in ('full', 'lazy'):
+            raise ValueError('Unknown tags mode: {}. Use full or lazy.'.format(tags))
+        if tags == 'lazy' and parser != 'struct':
+            raise ValueError("tags='lazy' requires parser='struct'")
+        self._tags = tags
+
         # Check for read() to determine if this is a file object
         if hasattr(filename, 'read'):
+            cache = False  # only files opened by path can be cached
             self.fid = filename
             self._on_memory = False
+            self.file_path = None
             try:
                 self.file_name = self.fid.name
             except AttributeError:
@@ -172,9 +265,18 @@ class fileDM:
         self.dataSize = []  # like numpy.shape
         self.dataOffset = []
         self.dataShape = []  # 1,2,3, or 4. The total number of dimensions in a data set (like numpy.ndim)
-        self.allTags = {}
+        self._allTags = {}
         self.metadata = {}
 
+        # Tags in the ImageTags and ImageData groups of each image keyed by the ImageList index
+        # and the name of the group directly below ImageTags or ImageData.
+        self._tagIndex = {}
+        self._groupIndex = {}  # the _tagIndex entry of each full group name
+
+        # Offsets of tag groups skipped in lazy mode keyed by their full tag name
+        self._deferredGroups = {}
+        self._catchTags = True  # set to False to decode tags without updating the dataset information
+
         # lists that will contain scale information (pixel size)
         self.scale = []
         self.scaleUnit = []
@@ -224,7 +326,19 @@ class fileDM:
                                    6: np.float32, 7: np.float64,
                                    8: np.uint8, 9: np.uint8,
                                    10: np.uint8, 12: np.uint64}
-        self.parseHeader()
+
+        if header_cache.use_cache(cache):
+            reader = 'dm-' + self._tags
+            header = header_cache.load(self.file_path, reader)
+            if header is None:
+                self.parseHeader()
+                header_cache.save(self.file_path, reader,
+                                  {name: getattr(self, name) for name in self._headerAttributes})
+            else:
+                for name, value in header.items():
+                    setattr(self, name, value)
+        else:
+            self.parseHeader()
 
     def __del__(self):
         """Destructor which also closes the file
@@ -233,7 +347,12 @@ class fileDM:
         if not self.fid.closed:
             if self._v:
                 print('Closing input file: {}'.format(self.file_path))
-            self.fid.close()
+            try:
+                self.fid.close()
+            except BufferError:
+                # Arrays returned by getMemmap() or getSlices() still reference the memory map.
+                # It is released when the last of these arrays is deleted.
+                pass
 
     def __enter__(self):
         """Implement python's with statement
@@ -241,6 +360,16 @@ class fileDM:
         """
         return self
 
+    @property
+    def allTags(self):
+        """All tags in the DM file as key value pairs. Tag groups skipped in lazy mode are decoded on the first
+        access.
+
+        """
+        if self._deferredGroups:
+            self._parseDeferredGroups()
+        return self._allTags
+
     def __exit__(self, exception_type, exception_value, traceback):
         """Implement python's with statement
         and close the file via __del__()
@@ -332,6 +461,47 @@ class fileDM:
         else:
             return fid.seek(offset, from_what)
 
+    def _unpack(self, st):
+        """ Unpack values at the current position with a precompiled struct and
+        advance the position. Works for files and memory maps.
+
+        Parameters
+        ----------
+            st : struct.Struct
+                The precompiled struct to unpack with.
+
+        Returns
+        -------
+            : tuple
+                The unpacked values.
+        """
+        if self._on_memory:
+            vals = st.unpack_from(self.fid, self._buffer_offset)
+            self._buffer_offset += st.size
+            return vals
+        else:
+            return st.unpack(self.fid.read(st.size))
+
+    def _readBytes(self, count):
+        """ Read raw bytes at the current position and advance the position.
+
+        Parameters
+        ----------
+            count : int
+                The number of bytes to read.
+
+        Returns
+        -------
+            : bytes
+                The bytes read from the file or memory map.
+        """
+        if self._on_memory:
+            start = self._buffer_offset
+            self._buffer_offset += count
+            return self.fid[start:self._buffer_offset]
+        else:
+            return self.fid.read(count)
+
     def _validDM(self):
         """ Test whether a file is a valid DM3 or DM4 file and written
         in little endian format.
@@ -375,7 +545,10 @@ class fileDM:
         elif self._dmType == 4:
             self.seek(self.fid, 16, 0)
         # Read the first root tag the same as any other group
-        self._readTagGroup()
+        if self._parser == 'struct':
+            self._parseTagGroup()
+        else:
+            self._readTagGroup()
 
         # Check for thumbnail
         if len(self.dataType) > 0:  # check that any data set was found
@@ -423,6 +596,9 @@ class fileDM:
         except:
             raise
         
+        # Decode the tags for this dataset if they were skipped in lazy mode
+        self._parseDeferredGroups('.ImageList.{}.'.format(index))
+
         # Most of the useful keys. Two other keys Tecnai.Microscope Info is treated specially below
         good_keys = ['Calibrations', 'Acquisition', 'DataBar', 'EELS', 'Meta Data', 'Microscope Info', '4Dcamera Parameters', 'Session Info']
 
@@ -431,37 +607,38 @@ class fileDM:
             assert isinstance(metadata_keys, (list, tuple))
             good_keys.extend(metadata_keys)
         
-        # Determine useful meta data
+        # Determine useful meta data. Only look at the groups of interest for this image.
         prefix1 = '.ImageList.{}.ImageTags.'.format(index)
-        prefix2 = '.ImageList.{}.ImageData.'.format(index)
         metadata = {}
-        for kk, ii in self.allTags.items():
-            if prefix1 in kk or prefix2 in kk:
+        for group, tags in self._tagIndex.get(index, {}).items():
+            if group not in good_keys:
+                continue
+            for kk, ii in tags.items():
                 kk_split = kk.split('.')
-                if kk_split[4] in good_keys:
-                    if 'Session Info' in kk:
-                        if not '.Items.' in kk:
-                            new_key = ' '.join(kk_split[-2:])
-                            metadata[new_key] = ii
-                    else:
-                        new_key = ' '.join(kk_split[4:])
+                if group == 'Session Info':
+                    if not '.Items.' in kk:
+                        new_key = ' '.join(kk_split[-2:])
                         metadata[new_key] = ii
-            
-            # Tecnai info contains useful information but is encoded as a binary array
-            # We need to read is as binary and convert to text
-            if 'Tecnai.Microscope Info.arrayOffset' in kk:
-                try:
-                    offset = self.allTags[prefix1 + 'Tecnai.Microscope Info.arrayOffset']
-                    size = self.allTags[prefix1 + 'Tecnai.Microscope Info.arraySize']
-                    dtype = self.allTags[prefix1 + 'Tecnai.Microscope Info.arrayType']
-                    cur_offset = self.fid.tell()
-                    self.seek(self.fid, offset)
-                    string_data = self.fromfile(self.fid, count=size, dtype=np.uint16)
-                    tecnai = ''.join([chr(ii) for ii in string_data]).replace('\u2028', ';')  # replace new line with ;
-                    metadata['Tecnai Microscope Info'] = tecnai
-                except KeyError:
-                    print('Tecnai info tag parse error')
-            
+                else:
+                    new_key = ' '.join(kk_split[4:])
+                    metadata[new_key] = ii
+
+        # Tecnai info contains useful information but is encoded as a binary array
+        # of UTF-16 characters. We need to read is as binary and convert to text
+        tecnai_key = prefix1 + 'Tecnai.Microscope Info.'
+        if tecnai_key + 'arrayOffset' in self._allTags:
+            try:
+                offset = self._allTags[tecnai_key + 'arrayOffset']
+                size = self._allTags[tecnai_key + 'arraySize']
+                cur_offset = self.tell()
+                self.seek(self.fid, offset, 0)
+                string_data = self._readBytes(int(size))  # size is in bytes
+                self.seek(self.fid, cur_offset, 0)
+                tecnai = string_data.decode('utf-16-le', errors='surrogatepass').replace('\u2028', ';')  # replace new line with ;
+                metadata['Tecnai Microscope Info'] = tecnai
+            except KeyError:
+                print('Tecnai info tag parse error')
+
         return metadata
 
     def _readTagGroup(self):
@@ -583,6 +760,291 @@ class fileDM:
             arrInfo = self._readArrayData(arrayTypes)  # only info of the array is read. It is read later if needed
             self._storeTag(self._curTagName, arrInfo)
 
+    def _parseTagGroup(self):
+        """Read a tag group in a DM file using precompiled struct unpackers.
+        This is the default (parser='struct') version of _readTagGroup.
+
+        """
+        self._curGroupLevel += 1
+        # Check to see if the maximum group level is reached.
+        if self._curGroupLevel > self._maxDepth:
+            raise IOError(
+                'Maximum tag group depth of {} reached. This file is most likely corrupt.'.format(self._maxDepth))
+
+        _, _, nTags = self._unpack(_TAG_GROUP_STRUCTS[self._dmType])
+
+        if self._v:
+            print('Total number of root tags = {}'.format(nTags))
+
+        # Iterate of the number of tag entries. Unlabeled tags are named by their number in the group.
+        oldTotalTag = self._curGroupNameAtLevelX
+        for ii in range(1, nTags + 1):
+            self._parseTagEntry(ii)
+
+        # Go back down a level after reading all entries
+        self._curGroupLevel -= 1
+        self._curGroupNameAtLevelX = oldTotalTag
+
+    def _parseTagEntry(self, tagNumber):
+        """Read one entry in a tag group using precompiled struct unpackers.
+
+        Parameters
+        ----------
+            tagNumber : int
+                The number of this entry in its group. Used as the label for unlabeled tags.
+
+        """
+        dataType, lenTagLabel = self._unpack(_TAG_ENTRY_STRUCT)
+
+        if lenTagLabel > 0:
+            tagLabel = self._readBytes(lenTagLabel).decode('latin-1')
+        else:
+            tagLabel = str(tagNumber)  # unlabeled tag.
+
+        # Save the current group name in case this is needed
+        oldGroupName = self._curGroupNameAtLevelX
+
+        if dataType == 21:
+            # This tag entry contains data
+            self._curTagName = tagLabel  # save its name
+            self._parseTagType()
+        else:
+            # This is a nested tag group
+            self._curGroupNameAtLevelX += '.' + tagLabel  # add to group names
+
+            # DM4 tags store the size of the group in bytes
+            if self._dmType == 4:
+                groupSize, = self._unpack(_SPECIAL_STRUCTS[4])
+
+            if self._tags == 'lazy' and self._catchTags and not self._isImageDataGroup(self._curGroupNameAtLevelX):
+                # Record where the group starts and skip it. Deferred groups are decoded fully later.
+                self._deferredGroups[self._curGroupNameAtLevelX] = self.tell()
+                if self._dmType == 4:
+                    self.seek(self.fid, groupSize, 1)
+                else:
+                    self._skipTagGroup()
+            else:
+                self._parseTagGroup()
+
+        self._curGroupNameAtLevelX = oldGroupName
+
+    @staticmethod
+    def _isImageDataGroup(groupName):
+        """Test whether a tag group is needed to read the data sets. These are the ImageList
+        entries and their ImageData groups (dimensions, data type, calibrations and data offset).
+
+        Parameters
+        ----------
+            groupName : str
+                The full name of the tag group.
+
+        Returns
+        -------
+            : bool
+                True if the group is decoded when the file is opened in lazy mode.
+        """
+        names = groupName.split('.', 4)
+        if names[1] != 'ImageList':
+            return False
+        return len(names) < 4 or names[3] == 'ImageData'
+
+    def _skipTagGroup(self):
+        """Skip over a tag group without decoding its tags. DM3 files do not store the size of the group so
+        the structure has to be walked.
+
+        """
+        _, _, nTags = self._unpack(_TAG_GROUP_STRUCTS[self._dmType])
+        for ii in range(nTags):
+            dataType, lenTagLabel = self._unpack(_TAG_ENTRY_STRUCT)
+            self.seek(self.fid, lenTagLabel, 1)
+            if self._dmType == 4:
+                self.seek(self.fid, 8, 1)
+            if dataType == 21:
+                self._skipTagType()
+            else:
+                self._skipTagGroup()
+
+    def _skipTagType(self):
+        """Skip over the data in one tag without decoding it.
+
+        """
+        delim, _, encodedType = self._unpack(_TAG_TYPE_STRUCTS[self._dmType])[-3:]
+        if delim != b'%%%%':
+            raise IOError('Tag delimiter not found. This file is most likely corrupt.')
+
+        if encodedType in _NATIVE_STRUCTS:
+            self.seek(self.fid, self._encodedTypeSize(encodedType), 1)
+        elif encodedType == 18:  # string
+            stringSize, = self._unpack(_STRING_SIZE_STRUCT)
+            self.seek(self.fid, stringSize, 1)
+        elif encodedType == 15:  # struct
+            structTypes = self._parseStructTypes()
+            self.seek(self.fid, sum([self._encodedTypeSize(tt) for tt in structTypes]), 1)
+        elif encodedType == 20:  # array
+            arrayTypes = self._parseArrayTypes()
+            arraySize, = self._unpack(_SPECIAL_STRUCTS[self._dmType])
+            self.seek(self.fid, arraySize * sum([self._encodedTypeSize(tt) for tt in arrayTypes]), 1)
+
+    def _parseDeferredGroups(self, prefix=''):
+        """Decode tag groups skipped when the file was opened in lazy mode. The tags are added to
+        allTags. Information about the data sets is not changed.
+
+        Parameters
+        ----------
+            prefix : str, optional
+                Only decode the groups whose full name starts with prefix. Decode all by default.
+
+        """
+        names = [nn for nn in self._deferredGroups if nn.startswith(prefix)]
+        if not names:
+            return
+        if self.fid.closed:
+            raise IOError('The file is closed. Tags skipped in lazy mode can not be decoded.')
+
+        curOffset = self.tell()
+        self._catchTags = False
+        try:
+            for name in names:
+                self.seek(self.fid, self._deferredGroups.pop(name), 0)
+                self._curGroupNameAtLevelX = name
+                self._curGroupLevel = name.count('.')
+                self._parseTagGroup()
+        finally:
+            self._catchTags = True
+            self._curGroupNameAtLevelX = ''
+            self._curGroupLevel = 0
+            self.seek(self.fid, curOffset, 0)
+
+    def _parseTagType(self):
+        """Determine the type of tag and read it using precompiled struct unpackers.
+
+        """
+        # The DM4 header has an extra unknown value before the %%%% delimiter
+        delim, _, encodedType = self._unpack(_TAG_TYPE_STRUCTS[self._dmType])[-3:]
+        if delim != b'%%%%':
+            raise IOError('Tag delimiter not found for tag {}. This file is most likely corrupt.'.format(
+                self._curTagName))
+
+        native = _NATIVE_STRUCTS.get(encodedType)
+        if native is not None:
+            # regular data. Read it and store it with the tag name
+            st, npType = native
+            self._storeTag(self._curTagName, npType(self._unpack(st)[0]))
+        elif encodedType == 18:  # string
+            stringSize, = self._unpack(_STRING_SIZE_STRUCT)
+            self._storeTag(self._curTagName, self._readBytes(stringSize).decode('latin-1'))
+        elif encodedType == 15:  # struct
+            structTypes = self._parseStructTypes()
+            self._storeTag(self._curTagName, self._parseStructData(structTypes))
+        elif encodedType == 20:  # array
+            arrayTypes = self._parseArrayTypes()  # could be recursive if array contains array(s)
+            arrInfo = self._parseArrayData(arrayTypes)  # only info of the array is read. It is read later if needed
+            self._storeTag(self._curTagName, arrInfo)
+
+    def _parseStructTypes(self):
+        """Analyze the types of data in a struct.
+
+        Returns
+        -------
+            : tuple
+                The encoded types of the fields.
+        """
+        special = _SPECIAL_FORMATS[self._dmType]
+        _, nFields = self._unpack(struct.Struct('>2' + special))
+
+        if nFields > 100:
+            raise RuntimeError('Too many fields in a struct.')
+
+        # nameLength, fieldType for each field
+        fields = self._unpack(struct.Struct('>{}{}'.format(2 * nFields, special)))
+        return fields[1::2]
+
+    def _parseStructData(self, structTypes):
+        """Read the data in a struct with one unpack.
+
+        Parameters
+        ----------
+            structTypes : tuple
+                The encoded types of the fields.
+
+        Returns
+        -------
+            struct : ndarray
+                1D array of data
+        """
+        fmt = '<' + ''.join([_NATIVE_FORMATS[encodedType] for encodedType in structTypes])
+        return np.array(self._unpack(struct.Struct(fmt)), dtype=np.float64)
+
+    def _parseArrayTypes(self):
+        """Analyze the types of data in an array.
+
+        """
+        arrayType, = self._unpack(_SPECIAL_STRUCTS[self._dmType])
+
+        if arrayType == 15:
+            # nested Struct
+            return self._parseStructTypes()
+        elif arrayType == 20:
+            # Nested array
+            return self._parseArrayTypes()
+        else:
+            return (arrayType,)
+
+    def _parseArrayData(self, arrayTypes):
+        """Read information in an array based on the types provided.
+        Binary data (i.e. image/spectra data) is skipped. See _readArrayData.
+
+        Parameters
+        ----------
+            arrayTypes : tuple
+                The type of array data to read
+
+        Returns
+        -------
+            arrOut : str
+                A string containing the key value pair of this tag
+
+        """
+        arrOut = None
+        encodedType = None
+
+        # The number of elements in the array
+        arraySize, = self._unpack(_SPECIAL_STRUCTS[self._dmType])
+
+        itemSize = 0
+        for encodedType in arrayTypes:
+            itemSize += self._encodedTypeSize(encodedType)
+        bufSize = np.uint64(arraySize * itemSize)
+
+        if self._curTagName == 'Data' or bufSize >= 1e3:
+            # This is a binary array. Save its location to read later if needed
+            self._storeTag(self._curTagName + '.arraySize', bufSize)
+            self._storeTag(self._curTagName + '.arrayOffset', self.tell())
+            self._storeTag(self._curTagName + '.arrayType', encodedType)
+            self.seek(self.fid, bufSize, 1)  # advance the pointer by bufsize from current position
+            if self._curTagName == 'Data':
+                arrOut = 'Data unread. Encoded type = {}'.format(encodedType)
+            else:
+                arrOut = 'Array unread. Encoded type = {}'.format(encodedType)
+        else:
+            # treat as a string
+            for encodedType in arrayTypes:
+                fmt = _ARRAY_FORMATS.get(encodedType)
+                if fmt is None:
+                    self.seek(self.fid, arraySize * self._encodedTypeSize(encodedType), 1)
+                    arrOut = '(Not displayable)'
+                else:
+                    arrOut = self._bin2str(self._unpack(struct.Struct('<{}{}'.format(arraySize, fmt))))
+
+            # Catch useful tags for images and spectra (nm, eV, etc.)
+            fullTagName = self._curGroupNameAtLevelX + '.' + self._curTagName
+            if self._catchTags and (fullTagName.find('Dimension') > -1) & (fullTagName.find('Units') > -1):
+                self.scale.append(self._scale_temp)
+                self.scaleUnit.append(arrOut)
+                self.origin.append(self._origin_temp)
+
+        return arrOut
+
     @staticmethod
     def _bin2str(bin0):
         """Utility function to convert a numpy array of binary values to a python string.
@@ -839,12 +1301,53 @@ class fileDM:
             print('_storeTag: curTagName, curTagValue = {}, {}'.format(curTagName, curTagValue))
         totalTag = self._curGroupNameAtLevelX + '.' + '{}'.format(curTagName)  # + '= {}'.format(curTagValue)
 
-        self._catchUsefulTags(totalTag, curTagName, curTagValue)
+        if self._catchTags:
+            self._catchUsefulTags(totalTag, curTagName, curTagValue)
 
-        self.allTags[totalTag] = curTagValue  # this needs to be done better.
+        self._allTags[totalTag] = curTagValue  # this needs to be done better.
+
+        # Add the tag to the hierarchical index used by getMetadata
+        try:
+            entry = self._groupIndex[self._curGroupNameAtLevelX]
+        except KeyError:
+            entry = self._indexGroup(self._curGroupNameAtLevelX)
+        if entry is not None:
+            if entry is True:
+                # Tag directly in the ImageTags or ImageData group
+                imageTags = self._tagIndex.setdefault(
+                    int(self._curGroupNameAtLevelX.split('.')[2]), {})
+                imageTags.setdefault(curTagName, {})[totalTag] = curTagValue
+            else:
+                entry[totalTag] = curTagValue
 
         return totalTag
 
+    def _indexGroup(self, groupName):
+        """Find the entry in the tag index for all tags in a tag group. Groups below
+        .ImageList.N.ImageTags and .ImageList.N.ImageData are indexed by N and the name of the group
+        directly below ImageTags or ImageData.
+
+        Parameters
+        ----------
+            groupName : str
+                The full name of the tag group.
+
+        Returns
+        -------
+            : dict or bool or None
+                The dictionary to add the tags to. True if the tags are directly in ImageTags or ImageData
+                and each tag is indexed by its own name. None if the tags are not indexed.
+        """
+        parts = groupName.split('.', 5)
+        entry = None
+        if len(parts) > 3 and parts[1] == 'ImageList' and parts[3] in ('ImageTags', 'ImageData'):
+            if len(parts) == 4:
+                entry = True
+            else:
+                entry = self._tagIndex.setdefault(int(parts[2]), {}).setdefault(parts[4], {})
+        self._groupIndex[groupName] = entry
+        return entry
+
     def _catchUsefulTags(self, totalTag, curTagName, curTagValue):
         """Find interesting keys and keep their values for later. This is separate from _storeTag
         so that it is easy to find and modify.
@@ -1011,6 +1514,69 @@ class fileDM:
         except:
             raise
 
+        jj = 0  # counter to determine where the first scale value starts
+        for nn in self.dataShape[0:ii]:
+            jj += nn  # sum up all number of dimensions for previous datasets
+
+        return self._readDataset(ii, jj)
+
+    def getDatasets(self, copy=True):
+        """Retrieve all datasets from the DM file. The datasets are read in the order they are stored in the
+        file in one pass through the file and the calibrations of all datasets are determined once.
+
+        Notes
+        -----
+            The thumbnail is ignored as in getDataset(). The dictionary for each dataset is the same as
+            returned by getDataset().
+
+        Parameters
+        ----------
+            copy : bool, default True
+                If False and the file is opened in on_memory mode, the data are returned as views
+                of the memory map without copying. The memory map is kept open until all views are deleted.
+
+        Returns
+        -------
+            : list of dict
+                The data and meta data of each dataset. The list is ordered by the dataset number as used
+                by getDataset().
+
+        """
+        # The first dataset is usually a thumbnail. Test for this and skip the thumbnail automatically
+        if self.numObjects == 1:
+            first = 0
+        else:
+            first = 1
+
+        # the index of the first scale value of each dataset
+        scaleStart = [0]
+        for nn in self.dataShape:
+            scaleStart.append(scaleStart[-1] + nn)
+
+        datasets = [None] * (self.numObjects - first)
+        for ii in sorted(range(first, self.numObjects), key=lambda x: self.dataOffset[x]):
+            datasets[ii - first] = self._readDataset(ii, scaleStart[ii], copy=copy)
+
+        return datasets
+
+    def _readDataset(self, ii, jj, copy=True):
+        """Read a full dataset and its calibrations.
+
+        Parameters
+        ----------
+            ii : int
+                The internal number of the dataset (including the thumbnail).
+            jj : int
+                The index of the first scale value of this dataset.
+            copy : bool, default True
+                If False and the file is opened in on_memory mode the data is a view of the memory map.
+
+        Returns
+        -------
+            : dict
+                A dictionary of the data and meta data.
+
+        """
         self.seek(self.fid, self.dataOffset[ii], 0)  # Seek to start of dataset from beginning of the file
 
         outputDict = {}
@@ -1020,9 +1586,6 @@ class fileDM:
         # Parse the dataset to see what type it is (image, image series, spectra, etc.)
         if self.xSize[ii] > 0:
             pixelCount = int(self.xSize[ii]) * int(self.ySize[ii]) * int(self.zSize[ii]) * int(self.zSize2[ii])
-            jj = 0  # counter to determine where the first scale value starts
-            for nn in self.dataShape[0:ii]:
-                jj += nn  # sum up all number of dimensions for previous datasets
             # if self.dataType == 23: #RGB image(s)
             #    temp = self.fromfile(self.fid,count=pixelCount,dtype=np.uint8).reshape(self.ysize[ii],self.xsize[ii])
             if self.zSize[ii] == 1:
@@ -1063,7 +1626,7 @@ class fileDM:
             #outputDict['intensityOrigin'] = self.brightnessOrigin
 
         # Ensure the data is loaded into memory from the buffer
-        if self._on_memory:
+        if self._on_memory and copy and 'data' in outputDict:
             outputDict['data'] = np.array(outputDict['data'])
 
         # Remove singular dimensions if needed
@@ -1079,7 +1642,7 @@ class fileDM:
 
         Warning: DM4 files with 4D data sets are written as [X,Y,Z1,Z2]. This code currently gets the [X,Y] slice.
         Getting the [Z1,Z2] slice is not yet implemented. Use the getMemmap() function to retrieve arbitrary slices of
-        large data sets.
+        large data sets. Use getSlices() to retrieve a block of slices with one read.
 
         Parameters
         ----------
@@ -1111,10 +1674,11 @@ class fileDM:
         # Check sliceZ and sliceZ2 are within the data array size bounds
         if sliceZ > (self.zSize[ii] - 1):
             raise IndexError(
-                'Index out of range, trying to access element {} of {} valid elements'.format(sliceZ, self.zSize))
+                'Index out of range, trying to access element {} of {} valid elements'.format(sliceZ, self.zSize[ii]))
         if sliceZ2 > (self.zSize2[ii] - 1):
             raise IndexError(
-                'Index out of range, trying to access element {} of {} valid elements'.format(sliceZ2, self.zSize2))
+                'Index out of range, trying to access element {} of {} valid elements'.format(sliceZ2,
+                                                                                               self.zSize2[ii]))
 
         self.seek(self.fid, self.dataOffset[ii], 0)  # Seek to start of dataset from beginning of the file
 
@@ -1133,7 +1697,8 @@ class fileDM:
                                                    dtype=self._DM2NPDataType(self.dataType[ii])).reshape(
                                                    (self.ySize[ii], self.xSize[ii]))
             elif self.zSize2[ii] > 1:  # 4D data
-                self.seek(self.fid, sliceZ * sliceZ2 * byteCount, 1)  # skip ahead from current position
+                # skip ahead from current position. The data is ordered as [Z2, Z, Y, X]
+                self.seek(self.fid, (sliceZ2 * int(self.zSize[ii]) + sliceZ) * byteCount, 1)
                 outputDict['data'] = self.fromfile(self.fid, count=pixelCount,
                                                    dtype=self._DM2NPDataType(self.dataType[ii])).reshape(
                                                    (self.ySize[ii], self.xSize[ii]))
@@ -1155,6 +1720,150 @@ class fileDM:
 
         return outputDict
 
+    def getSlices(self, index, zrange=None, z2range=None, copy=True):
+        """Retrieve a block of slices of a 3D or 4D dataset from the DM file. Contiguous blocks are read with
+        a single read (or returned as a view of the memory map). The data set will have a shape according to
+        3D = [Z,Y,X] or 4D: [Z2,Z,Y,X] where Z and Z2 are the number of requested slices.
+
+        Note: Most DM3 and DM4 files contain a small "thumbnail" as the first dataset written as RGB data. This function
+        ignores that dataset if it exists.
+
+        Parameters
+        ----------
+            index : int
+                The number of the dataset in the DM file.
+            zrange : slice or range or tuple or int, optional
+                The slices to get along the Z dimension. A tuple is interpreted as (start, stop[, step]).
+                Default is all slices.
+            z2range : slice or range or tuple or int, optional
+                The slices to get along the Z2 dimension of 4D datasets. Default is all slices.
+            copy : bool, default True
+                If False and the file is opened in on_memory mode, contiguous blocks are returned as views
+                of the memory map without copying. The views are only valid until the file is closed.
+
+        Returns
+        -------
+            : dict
+                A dictionary containing meta data and the data.
+        """
+        # The first dataset is usually a thumbnail. Test for this and skip the thumbnail automatically
+        if self.numObjects == 1:
+            ii = index
+        else:
+            ii = index + 1
+
+        # Check that the dataset exists.
+        try:
+            self._checkIndex(ii)
+        except:
+            raise
+
+        zSize = int(self.zSize[ii])
+        zSize2 = int(self.zSize2[ii])
+        zs = self._rangeIndices(zrange, zSize)
+        z2s = self._rangeIndices(z2range, zSize2)
+
+        # frame numbers in file order for each requested [Z2, Z] pair
+        frameIndex = z2s[:, None] * zSize + zs[None, :]
+        firstFrame = int(frameIndex.min())
+        lastFrame = int(frameIndex.max()) + 1
+        frameShape = (int(self.ySize[ii]), int(self.xSize[ii]))
+
+        isView = False
+        if np.array_equal(frameIndex.ravel(), np.arange(firstFrame, lastFrame)):
+            # contiguous block
+            data = self._readFrames(ii, firstFrame, lastFrame - firstFrame)
+            isView = self._on_memory
+        elif self._on_memory:
+            # gather from a view of the memory map
+            data = self._readFrames(ii, firstFrame, lastFrame - firstFrame)[frameIndex.ravel() - firstFrame]
+        else:
+            # one read per contiguous row of Z slices
+            data = np.empty((frameIndex.size,) + frameShape, dtype=self._DM2NPDataType(self.dataType[ii]))
+            for jj, row in enumerate(frameIndex):
+                block = self._readFrames(ii, int(row.min()), int(row.max() - row.min()) + 1)
+                data[jj * len(zs):(jj + 1) * len(zs)] = block[row - row.min()]
+
+        if zSize2 > 1:
+            data = data.reshape((len(z2s), len(zs)) + frameShape)
+        else:
+            data = data.reshape((len(zs),) + frameShape)
+
+        # Ensure the data is loaded into memory from the buffer
+        if isView and copy:
+            data = np.array(data)
+
+        jj = 0  # counter to determine where the first scale value starts
+        for nn in self.dataShape[0:ii]:
+            jj += nn  # sum up all number of dimensions for previous datasets
+
+        # Reverse the order to match the C-ordering of the data
+        outputDict = {'filename': self.file_name, 'data': data,
+                      'pixelUnit': self.scaleUnit[jj:jj + self.dataShape[ii]][::-1],
+                      'pixelSize': self.scale[jj:jj + self.dataShape[ii]][::-1],
+                      'pixelOrigin': self.origin[jj:jj + self.dataShape[ii]][::-1]}
+
+        return outputDict
+
+    @staticmethod
+    def _rangeIndices(requested, size):
+        """Convert a requested range of slices to an array of indices and check the bounds.
+
+        Parameters
+        ----------
+            requested : slice or range or tuple or int or None
+                The requested slices. None requests all slices.
+            size : int
+                The number of slices along this dimension.
+
+        Returns
+        -------
+            : ndarray
+                The slice indices.
+        """
+        if requested is None:
+            requested = slice(None)
+        elif isinstance(requested, (int, np.integer)):
+            if requested < 0 or requested >= size:
+                raise IndexError('Index out of range, '
+                                 'trying to access element {} of {} valid elements'.format(requested, size))
+            requested = slice(requested, requested + 1)
+        elif isinstance(requested, range):
+            requested = slice(requested.start, requested.stop, requested.step)
+        elif isinstance(requested, tuple):
+            requested = slice(*requested)
+        elif not isinstance(requested, slice):
+            raise TypeError('Slice range must be a slice, range, tuple or int')
+
+        indices = np.arange(size)[requested]
+        if indices.size == 0:
+            raise IndexError('Slice range {} selects no elements of {} valid elements'.format(requested, size))
+        return indices
+
+    def _readFrames(self, ii, firstFrame, numFrames):
+        """Read contiguous frames of a dataset with one read. In on_memory mode this is a view of the
+        memory map.
+
+        Parameters
+        ----------
+            ii : int
+                The internal number of the dataset (including the thumbnail).
+            firstFrame : int
+                The first frame to read in file order.
+            numFrames : int
+                The number of frames to read.
+
+        Returns
+        -------
+            : ndarray
+                The frames with shape [numFrames, Y, X].
+        """
+        dtype = np.dtype(self._DM2NPDataType(self.dataType[ii]))
+        pixelCount = int(self.xSize[ii]) * int(self.ySize[ii])
+        self.seek(self.fid, int(self.dataOffset[ii]) + firstFrame * pixelCount * dtype.itemsize, 0)
+        data = self.fromfile(self.fid, count=numFrames * pixelCount, dtype=dtype)
+        return data.reshape((numFrames, int(self.ySize[ii]), int(self.xSize[ii])))
+
     def _readRGB(self, xSizeRGB, ySizeRGB):
         """Read in a uint8 type array with [Red,green,blue,alpha] channels.
 
@@ -1168,16 +1877,72 @@ class fileDM:
         Returns
         -------
             : ndarray
-                Numpy array of size [3,Y,X] which is an RGB thumbnail.
+                Numpy array of size [Y,X,4] which is an RGB thumbnail with an unused fourth channel.
         """
+        if not self.thumbnail:
+            raise ValueError('This file does not contain a thumbnail')
         self.seek(self.fid, self.dataOffset[0], 0)
         return self._readRGB(self.ySize[0], self.xSize[0])
 
+    def getPreview(self, max_size=256, index=0, use_thumbnail=True):
+        """Get a small preview image of a dataset without reading the full dataset. The thumbnail is used if
+        it exists. Otherwise a single frame (the middle frame for 3D and 4D datasets) is read with a stride
+        so that it fits in max_size. Only the required part of the file is read.
+
+        Parameters
+        ----------
+            max_size : int or None, default 256
+                The maximum number of pixels along each axis of the preview. None returns the full resolution
+                of the thumbnail or the frame.
+            index : int, default 0
+                The number of the dataset in the DM file. The thumbnail is only used for the first dataset.
+            use_thumbnail : bool, default True
+                Use the thumbnail if it exists.
+
+        Returns
+        -------
+            : ndarray
+                The preview as [Y,X,3] uint8 RGB array for the thumbnail or in the data type of the dataset
+                for a frame. 1D spectra are returned as a 1D array.
+        """
+        if use_thumbnail and self.thumbnail and index == 0:
+            thumbShape = (int(self.ySize[0]), int(self.xSize[0]), 4)
+            if self._on_memory:
+                count = int(np.prod(thumbShape))
+                frame = np.frombuffer(self.fid, dtype='<u1', count=count,
+                                      offset=self.dataOffset[0]).reshape(thumbShape)[:, :, :3]
+            else:
+                frame = self.getThumbnail()[:, :, :3]
+        else:
+            mm = self.getMemmap(index)
+            if mm.ndim > 2:
+                # The middle frame
+                frame = mm[tuple(nn // 2 for nn in mm.shape[:-2])]
+            else:
+                frame = mm
+
+        if max_size:
+            step = max(1, -(-max(frame.shape[:2]) // int(max_size)))  # ceil
+            if frame.ndim == 1:
+                frame = frame[::step]
+            else:
+                frame = frame[::step, ::step]
+
+        # Ensure the data is loaded into memory from the buffer
+        return np.array(frame)
+
     def getMemmap(self, index):
-        """Return a numpy memmap object (read-only) for the dataset requested. This is very useful
-        for very large datasets to avoid loading the entire data set into memory. No meta data is
+        """Return a read-only array with access to the data on disk for the dataset requested. This is very
+        useful for very large datasets to avoid loading the entire data set into memory. No meta data is
         returned.
 
+        The type of the array depends on how the file was opened:
+            - on_memory=True: a numpy.ndarray view of the memory map already used to read the file.
+              No additional file handle or memory map is opened.
+            - on_memory=False: a numpy.memmap of the file.
+            - file object: a SeekableArray that reads the requested part of the data from the file object
+              when it is sliced.
+
         Parameters
         ----------
             index : int
@@ -1185,9 +1950,10 @@ class fileDM:
 
         Returns
         -------
-            : numpy.memmap
-                A read-only numpy memmap object with access to the data. The file will continue to be open as long
-                as the memmap is open. Delete the memmap to close the file.
+            : numpy.ndarray or numpy.memmap or SeekableArray
+                A read-only array with access to the data. For the ndarray and memmap the data is accessible
+                as long as the array exists, even if the fileDM is closed. A SeekableArray requires the file
+                object to be open.
         """
         # The first dataset is usually a thumbnail. Test for this and skip the thumbnail automatically
         if self.numObjects == 1:
@@ -1201,16 +1967,472 @@ class fileDM:
         except:
             raise
 
-        # Create a memmap
         # Remove singular dimensions
         sh0 = (self.zSize2[ii], self.zSize[ii], self.ySize[ii], self.xSize[ii])
         sh1 = tuple([ii for ii in sh0 if ii > 1])  # shape must be a tuple
+        dtype = np.dtype(self._DM2NPDataType(self.dataType[ii]))
 
-        mm = np.memmap(self.file_path, dtype=self._DM2NPDataType(self.dataType[ii]), mode='r',
-                       offset=self.dataOffset[ii], shape=sh1)
+        if self._on_memory:
+            # View the existing memory map
+            count = int(np.prod(sh1, dtype=np.int64))
+            mm = np.frombuffer(self.fid, dtype=dtype, count=count, offset=self.dataOffset[ii]).reshape(sh1)
+        elif self.file_path is not None:
+            mm = np.memmap(self.file_path, dtype=dtype, mode='r', offset=self.dataOffset[ii], shape=sh1)
+        else:
+            mm = SeekableArray(self.fid, self.dataOffset[ii], dtype, sh1)
 
         return mm
 
+    def writeEMD(self, filename, index=0, layout='diffraction', axes=None, label=None, max_memory=2 ** 28,
+                 overwrite=False, **kwargs):
+        """Write a dataset to a Berkeley EMD file without loading it into memory. The data is transposed in
+        blocks of bounded size and written with a chunk layout suited to the expected access pattern. This
+        is mostly useful for 4D-STEM datasets.
+
+        Notes
+        -----
+            DM4 4D-STEM datasets are stored with the scan position changing fastest. getMemmap() returns these
+            in the order [kY, kX, scanY, scanX] so each diffraction pattern is spread over the whole file.
+            By default the output is transposed to [scanY, scanX, kY, kX].
+
+            If this fileDM was opened from a file object, each block reads whole slabs along the first axis of the
+            dataset and max_memory is not strictly followed.
+
+        Parameters
+        ----------
+            filename : str or pathlib.Path
+                The EMD file to write to. The file is created if it does not exist.
+            index : int, default 0
+                The number of the dataset in the DM file.
+            layout : str or tuple, default 'diffraction'
+                The HDF5 chunk layout. 'diffraction' stores whole diffraction patterns in each chunk for fast access
+                to single patterns. 'realspace' stores whole scan images of a few detector pixels in each chunk
+                for fast virtual imaging. These require 4D data. A tuple is used as the chunk shape directly.
+            axes : tuple, optional
+                The order of the axes of getMemmap() in the output as for numpy.transpose. The default is
+                (2, 3, 0, 1) for 4D data and no transpose otherwise.
+            label : str, optional
+                The name of the EMD group. Default is the name of the DM file without the suffix.
+            max_memory : int, default 256 MB
+                The approximate maximum number of bytes of data held in memory at any time.
+            overwrite : bool, default False
+                Overwrite an EMD group with the same label.
+            **kwargs : various
+                Keyword arguments passed to h5py.create_dataset(), e.g. for compression.
+
+        Returns
+        -------
+            : tuple
+                The shape of the data written to the EMD file.
+
+        Example
+        -------
+            Convert a 4D-STEM DM4 file for fast access to diffraction patterns
+            >> with dm.fileDM('filename.dm4') as dm0:
+            >>     dm0.writeEMD('filename.emd')
+        """
+        from ncempy.io import emd
+
+        mm = self.getMemmap(index)
+
+        if axes is None:
+            axes = (2, 3, 0, 1) if mm.ndim == 4 else tuple(range(mm.ndim))
+        if sorted(axes) != list(range(mm.ndim)):
+            raise ValueError('axes {} do not match the {} dimensions of the data'.format(axes, mm.ndim))
+        outShape = tuple(mm.shape[aa] for aa in axes)
+        itemsize = mm.dtype.itemsize
+
+        if isinstance(layout, str):
+            if layout not in _EMD_LAYOUTS:
+                raise ValueError('Unknown layout: {}. Use diffraction, realspace or a chunk shape.'.format(layout))
+            if mm.ndim != 4:
+                raise ValueError('The {} layout requires 4D data'.format(layout))
+            order = _EMD_LAYOUTS[layout]
+            chunks = _fillShape(outShape, (1,) * mm.ndim, order, itemsize, _EMD_CHUNK_BYTES)
+        else:
+            chunks = tuple(int(cc) for cc in layout)
+            if len(chunks) != mm.ndim:
+                raise ValueError('The chunk shape {} does not match the {} dimensions of the data'.format(
+                                 chunks, mm.ndim))
+            order = tuple(range(mm.ndim))[::-1]
+
+        # Blocks are made of whole chunks to avoid partially writing chunks
+        block = _fillShape(outShape, chunks, order, itemsize, max_memory)
+
+        # Calibrations in the order of getMemmap()
+        if self.numObjects == 1:
+            ii = index
+        else:
+            ii = index + 1
+        jj = 0  # counter to determine where the first scale value starts
+        for nn in self.dataShape[0:ii]:
+            jj += nn  # sum up all number of dimensions for previous datasets
+        scale = self.scale[jj:jj + self.dataShape[ii]][::-1]
+        unit = self.scaleUnit[jj:jj + self.dataShape[ii]][::-1]
+        origin = self.origin[jj:jj + self.dataShape[ii]][::-1]
+
+        # Remove the calibrations of singular dimensions as in getMemmap()
+        sh0 = (self.zSize2[ii], self.zSize[ii], self.ySize[ii], self.xSize[ii])[-self.dataShape[ii]:]
+        keep = [kk for kk, nn in enumerate(sh0) if nn > 1 and kk < len(scale)]
+        scale = [scale[kk] for kk in keep]
+        unit = [unit[kk] for kk in keep]
+        origin = [origin[kk] for kk in keep]
+
+        dims = []
+        for kk, aa in enumerate(axes):
+            sh = mm.shape[aa]
+            if aa < len(scale):
+                vec = np.linspace(0, scale[aa] * (sh - 1), sh) - origin[aa] * scale[aa]
+                dims.append((vec, 'dim{}'.format(kk + 1), unit[aa]))
+            else:
+                dims.append((np.arange(sh), 'dim{}'.format(kk + 1), 'pixels'))
+
+        if label is None:
+            label = Path(self.file_name).stem if self.file_name else 'data'
+
+        with emd.fileEMD(filename, readonly=False) as emd1:
+            grp = emd1.put_emdgroup(label, None, dims, overwrite=overwrite, shape=outShape, dtype=mm.dtype,
+                                    chunks=chunks, **kwargs)
+            if grp is None:
+                raise IOError('Can not write "{}" to {}'.format(label, filename))
+            dset = grp['data']
+
+            for start in itertools.product(*[range(0, nn, bb) for nn, bb in zip(outShape, block)]):
+                outSlices = tuple(slice(ss, min(ss + bb, nn)) for ss, bb, nn in zip(start, block, outShape))
+                inSlices = [None] * mm.ndim
+                for kk, aa in enumerate(axes):
+                    inSlices[aa] = outSlices[kk]
+                dset[outSlices] = np.transpose(np.asarray(mm[tuple(inSlices)]), axes)
+
+        return outShape
+
+
+class SeekableArray:
+    """A read-only array-like object for data stored contiguously in a seekable file object. Only the
+    part of the data needed for a slice is read from the file. Use this for file objects that can
+    not be memory mapped.
+
+    Indexing along the first axis reads the block of the file spanning the selected rows in one read.
+    All other indexing is then applied to this block in memory.
+
+    Attributes
+    ----------
+    shape : tuple
+        The shape of the data.
+
+    dtype : numpy.dtype
+        The data type of the data.
+
+    Examples
+    --------
+    Read one image of a 3D data set from an open file object
+    >> with open('filename.dm4', 'rb') as f0:
+    >>     with dm.fileDM(f0) as dm1:
+    >>         arr = dm1.getMemmap(0)
+    >>         im = arr[5]
+
+    """
+
+    def __init__(self, fid, offset, dtype, shape):
+        """ Provide access to the data in a seekable file object.
+
+        Parameters
+        ----------
+        fid : file object
+            A binary file object that supports seek() and read().
+
+        offset : int
+            The position of the first byte of data in the file.
+
+        dtype : numpy.dtype
+            The data type of the data.
+
+        shape : tuple
+            The shape of the data.
+
+        """
+        self.fid = fid
+        self.offset = int(offset)
+        self.dtype = np.dtype(dtype)
+        self.shape = tuple(int(ii) for ii in shape)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape, dtype=np.int64))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None):
+        out = self[...]
+        if dtype is not None:
+            out = out.astype(dtype, copy=False)
+        return out
+
+    def _read(self, first, num):
+        """ Read num rows along the first axis starting at row first.
+
+        """
+        rowShape = self.shape[1:]
+        rowItems = int(np.prod(rowShape, dtype=np.int64))
+        self.fid.seek(self.offset + first * rowItems * self.dtype.itemsize)
+        count = num * rowItems
+        buf = self.fid.read(count * self.dtype.itemsize)
+        if len(buf) != count * self.dtype.itemsize:
+            raise IOError('Not enough data in file. The file might be truncated.')
+        return np.frombuffer(buf, dtype=self.dtype, count=count).reshape((num,) + rowShape)
+
+    def __getitem__(self, key):
+        if len(self.shape) == 0:
+            return self._read(0, 1).reshape(())[key]
+        if not isinstance(key, tuple):
+            key = (key,)
+        # np.newaxis (None) in front of the first index adds axes but does not select rows. It is kept in
+        # the key applied to the block read from the file.
+        nNew = 0
+        while nNew < len(key) and key[nNew] is None:
+            nNew += 1
+        new, key = key[:nNew], key[nNew:]
+        if len(key) == 0 or key[0] is Ellipsis:
+            return self._read(0, self.shape[0])[new + key]
+        key0, rest = key[0], key[1:]
+
+        num = self.shape[0]
+        if isinstance(key0, (int, np.integer)):
+            row = int(key0)
+            if row < 0:
+                row += num
+            if row < 0 or row >= num:
+                raise IndexError('index {} is out of bounds for axis 0 with size {}'.format(key0, num))
+            return self._read(row, 1)[new + (0,) + rest]
+        elif isinstance(key0, slice):
+            rows = range(*key0.indices(num))
+        else:
+            rows = np.arange(num)[key0]  # index arrays or boolean masks
+            if rows.ndim != 1:
+                raise IndexError('Only one dimensional indices are supported for axis 0')
+
+        if len(rows) == 0:
+            return np.empty((0,) + self.shape[1:], dtype=self.dtype)[new + (slice(None),) + rest]
+        first = int(np.min(rows))
+        last = int(np.max(rows))
+        block = self._read(first, last - first + 1)
+        if isinstance(rows, range) and rows.step == 1:
+            return block[new + (slice(None),) + rest]
+        return block[new + (np.asarray(rows) - first,) + rest]
+
+
+class fileDMSeries:
+    """A series of DM files with the same image size and data type, such as the frames of a Gatan in-situ
+    acquisition. The series is accessed as a read-only 3D array with shape [frames, Y, X]. Frames are only
+    read from disk when they are indexed.
+
+    Only the first frame is parsed with fileDM. For every other frame the file size and the tag bytes
+    around the data are compared to the first frame. A frame is only parsed fully if these differ.
+
+    Attributes
+    ----------
+    files : list of pathlib.Path
+        The frame files in the order of the series.
+
+    shape : tuple
+        The shape of the series [frames, Y, X].
+
+    dtype : numpy.dtype
+        The data type of the frames.
+
+    times : ndarray or None
+        The time of each frame in seconds determined from the Hour_XX_Minute_XX_Second_XX_Frame_XXXX
+        file names written by Gatan in-situ acquisitions. Frames acquired in the same second are assumed
+        to be evenly spaced in time. None if the file names do not follow this pattern.
+
+    pixelSize, pixelUnit, pixelOrigin : list
+        The calibrations of a single frame.
+
+    metadata : dict
+        The metadata of the first frame. See fileDM.getMetadata().
+
+    Examples
+    --------
+    Load every 10th frame of an in-situ acquisition
+    >> import ncempy.io.dm as dm
+    >> series = dm.fileDMSeries('path/to/insitu/Hour_00')
+    >> frames = series[::10]
+    >> times = series.times[::10]
+
+    """
+
+    # Number of bytes compared before the data (encoded array type and size) and after the data
+    # (data type and dimension tags) to check that a frame has the same layout as the first frame.
+    _checkBefore = 24
+    _checkAfter = 128
+
+    def __init__(self, path, pattern='*.dm4', verbose=False):
+        """ Find the frames and determine the location of the data in each frame.
+
+        Parameters
+        ----------
+        path : str or pathlib.Path or list
+            A directory containing the frames or a list of frame files. Directories are searched recursively.
+
+        pattern : str, optional, default '*.dm4'
+            The file name pattern of the frames in the directory.
+
+        verbose : bool, optional, default False
+            Print information about frames that are parsed fully.
+
+        """
+        self._v = verbose
+
+        if isinstance(path, (str, Path)):
+            path = Path(path)
+            if not path.is_dir():
+                raise IOError('Directory not found: {}'.format(path))
+            files = [ff for ff in path.rglob(pattern) if ff.is_file()]
+            root = path
+        else:
+            files = [Path(ff) for ff in path]
+            root = None
+        if not files:
+            raise IOError('No frames found in {}'.format(path))
+
+        # Natural sort on all numbers in the path (i.e. Hour, Minute, Second and Frame)
+        def _sortKey(ff):
+            rel = str(ff.relative_to(root)) if root is not None else str(ff)
+            return [int(nn) for nn in re.findall(r'\d+', rel)], rel
+        if root is not None:
+            files.sort(key=_sortKey)
+        self.files = files
+
+        # Parse the first frame
+        with fileDM(files[0], tags='lazy') as dm0:
+            ii = 0 if dm0.numObjects == 1 else 1
+            dm0._checkIndex(ii)
+            self.dtype = np.dtype(dm0._DM2NPDataType(dm0.dataType[ii]))
+            frameShape = (int(dm0.ySize[ii]), int(dm0.xSize[ii]))
+            if dm0.zSize[ii] > 1 or dm0.zSize2[ii] > 1:
+                raise ValueError('Only series of 1D or 2D frames are supported: {}'.format(files[0]))
+            ds = dm0.getDataset(0)
+            self.pixelSize = ds['pixelSize']
+            self.pixelUnit = ds['pixelUnit']
+            self.pixelOrigin = ds['pixelOrigin']
+            self.metadata = dm0.getMetadata(0)
+            offset = int(dm0.dataOffset[ii])
+        self.shape = (len(files),) + frameShape
+        self._frameBytes = int(np.prod(frameShape)) * self.dtype.itemsize
+
+        self._fileSize = filestats(files[0]).st_size
+        with open(files[0], 'rb') as fid:
+            self._reference = self._checkBytes(fid, offset)
+
+        # Check the layout of the other frames
+        self.offsets = np.full(len(files), offset, dtype=np.int64)
+        for jj, ff in enumerate(files[1:], start=1):
+            if filestats(ff).st_size == self._fileSize:
+                with open(ff, 'rb') as fid:
+                    if self._checkBytes(fid, offset) == self._reference:
+                        continue
+            self.offsets[jj] = self._parseFrame(ff, frameShape)
+
+        self.times = self._frameTimes(files)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None):
+        out = self[:]
+        if dtype is not None:
+            out = out.astype(dtype, copy=False)
+        return out
+
+    def _checkBytes(self, fid, offset):
+        """Read the bytes around the data used to compare the layout of frames.
+
+        """
+        fid.seek(offset - self._checkBefore)
+        before = fid.read(self._checkBefore)
+        fid.seek(offset + self._frameBytes)
+        return before, fid.read(self._checkAfter)
+
+    def _parseFrame(self, file_path, frameShape):
+        """Parse a frame whose layout differs from the first frame and return the data offset.
+
+        """
+        if self._v:
+            print('Parsing frame: {}'.format(file_path))
+        with fileDM(file_path, tags='lazy') as dm1:
+            ii = 0 if dm1.numObjects == 1 else 1
+            dm1._checkIndex(ii)
+            if (np.dtype(dm1._DM2NPDataType(dm1.dataType[ii])) != self.dtype or
+                    (int(dm1.ySize[ii]), int(dm1.xSize[ii])) != frameShape or dm1.zSize[ii] > 1):
+                raise ValueError('Frame {} has a different shape or data type than the first frame'.format(file_path))
+            return int(dm1.dataOffset[ii])
+
+    @staticmethod
+    def _frameTimes(files):
+        """Determine the time of each frame from Gatan in-situ file names.
+
+        """
+        regex = re.compile(r'Hour_(\d+)_Minute_(\d+)_Second_(\d+)_Frame_(\d+)')
+        seconds = np.zeros(len(files))
+        for jj, ff in enumerate(files):
+            mm = regex.search(ff.name)
+            if mm is None:
+                return None
+            hh, mi, ss, _ = (int(vv) for vv in mm.groups())
+            seconds[jj] = hh * 3600 + mi * 60 + ss
+
+        # Spread the frames acquired in the same second evenly
+        times = seconds.copy()
+        for second in np.unique(seconds):
+            inSecond = np.nonzero(seconds == second)[0]
+            times[inSecond] += np.arange(len(inSecond)) / len(inSecond)
+        return times
+
+    def _readFrame(self, jj, out):
+        """Read frame jj into out.
+
+        """
+        with open(self.files[jj], 'rb') as fid:
+            fid.seek(int(self.offsets[jj]))
+            if fid.readinto(out) != self._frameBytes:
+                raise IOError('Not enough data in file. The file might be truncated: {}'.format(self.files[jj]))
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) == 0 or key[0] is Ellipsis:
+            # Read all frames and apply the full key
+            return self[:][key]
+        key0, rest = key[0], key[1:]
+
+        num = self.shape[0]
+        if isinstance(key0, (int, np.integer)):
+            frame = int(key0)
+            if frame < 0:
+                frame += num
+            if frame < 0 or frame >= num:
+                raise IndexError('index {} is out of bounds for axis 0 with size {}'.format(key0, num))
+            out = np.empty(self.shape[1:], dtype=self.dtype)
+            self._readFrame(frame, out)
+            return out[rest]
+
+        frames = np.arange(num)[key0]
+        if frames.ndim != 1:
+            raise IndexError('Only one dimensional indices are supported for axis 0')
+        out = np.empty((len(frames),) + self.shape[1:], dtype=self.dtype)
+        for jj, frame in enumerate(frames):
+            self._readFrame(int(frame), out[jj])
+        return out[(slice(None),) + rest]
+
 
 def dmReader(filename, dSetNum=0, verbose=False, on_memory=True):
     """A simple function to parse the file and read the requested dataset.
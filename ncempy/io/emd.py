@@ -17,12 +17,69 @@ Advanced users and developers:
 """
 
 from pathlib import Path
+import collections
 import datetime
+import itertools
+import math
+import multiprocessing
+from multiprocessing import shared_memory
+import os
+import queue
+import tempfile
+import threading
 
 import numpy as np
 import h5py
 
 
+# Target size of the HDF5 chunks chosen by the chunk presets
+_CHUNK_BYTES = 2 ** 20
+
+# The order in which the axes of a chunk are grown for each chunk preset. The axes at the start of the order
+# are kept whole so a chunk contains complete images (image-stack), diffraction patterns [scanY, scanX, kY, kX]
+# (4dstem-diffraction), real space images (4dstem-realspace) or spectra [scanY, scanX, E] (spectrum-image).
+# None means the last axis first.
+_CHUNK_PRESETS = {'image-stack': None, '4dstem-diffraction': (3, 2, 1, 0), '4dstem-realspace': (1, 0, 3, 2),
+                  'spectrum-image': None}
+
+# The access patterns of the chunk cache policies. See chunkCache().
+_ACCESS_PATTERNS = ('frame', 'pixel', 'random')
+
+# Read-only h5py.File handles shared by all lazy datasets of a file. Keyed by the resolved file path and the
+# device, inode, size and modification time of the file with values [h5py.File, number of users]. A file that
+# was replaced or changed since the handle was opened gets a new handle.
+_HANDLES = {}
+_HANDLES_LOCK = threading.Lock()
+
+
+def _acquireHandle(file_path):
+    """ Get the shared read-only handle of a file and register a user.
+
+    """
+    path = str(Path(file_path).resolve())
+    stats = os.stat(path)
+    key = (path, stats.st_dev, stats.st_ino, stats.st_size, stats.st_mtime_ns)
+    with _HANDLES_LOCK:
+        if key not in _HANDLES:
+            _HANDLES[key] = [h5py.File(path, 'r'), 0]
+        _HANDLES[key][1] += 1
+        return key, _HANDLES[key][0]
+
+
+def _releaseHandle(key):
+    """ Unregister a user of a shared handle. The file is closed when it has no users left.
+
+    """
+    with _HANDLES_LOCK:
+        entry = _HANDLES.get(key)
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del _HANDLES[key]
+            entry[0].close()
+
+
 class NoEmdDataSets(Exception):
     """Special exception indicating no EMD datasets are in an EMD file."""
     pass
@@ -71,7 +128,7 @@ class fileEMD:
     >>     data1, dims1 = emd1.get_emdgroup(0) # load the first full data array and dimension information
     """
 
-    def __init__(self, filename, readonly=True):
+    def __init__(self, filename, readonly=True, data_only=False, chunk_cache=None):
         """Init opening/creating the file.
 
         Parameters
@@ -80,6 +137,13 @@ class fileEMD:
             The EMD file to open.
         readonly : bool, default True
             Set to False to allow writing to the file.
+        data_only : bool, default False
+            Only search the /data group for EMD groups. This is faster for files with large
+            trees outside of /data.
+        chunk_cache : dict, optional
+            The HDF5 chunk cache of all datasets in the file as rdcc_nbytes, rdcc_nslots and rdcc_w0 (see
+            h5py.File() and chunkCache()). The cache of lazy datasets can also be set for an access pattern
+            with get_emdgroup().
 
         """
 
@@ -94,6 +158,7 @@ class fileEMD:
         self.user = None
         self.comments = None
         self.list_emds = []  # list of HDF5 groups with emd_data_type type 1
+        self._emd_root = '/data' if data_only else '/'  # the group searched for emd_data_type groups
 
         if hasattr(filename, 'read'):
             try:
@@ -114,15 +179,17 @@ class fileEMD:
             self.file_name = self.file_path.name
 
         # try opening the file
+        if chunk_cache is None:
+            chunk_cache = {}
         if readonly:
             try:
-                self.file_hdl = h5py.File(filename, 'r')
+                self.file_hdl = h5py.File(filename, 'r', **chunk_cache)
             except:
                 print('Error opening file for readonly: "{}"'.format(filename))
                 raise
         else:
             try:
-                self.file_hdl = h5py.File(filename, 'a')
+                self.file_hdl = h5py.File(filename, 'a', **chunk_cache)
             except:
                 print('Error opening file for read/write: "{}"'.format(filename))
                 raise
@@ -175,7 +242,10 @@ class fileEMD:
                 self.comments = self.file_hdl['comments']
 
             # find emd_data_type groups in the file
-            self.list_emds = self.find_emdgroups(self.file_hdl)
+            if data_only:
+                self.list_emds = self.find_emdgroups(self.data) if self.data is not None else []
+            else:
+                self.list_emds = self.find_emdgroups(self.file_hdl)
             
             if len(self.list_emds) == 0 and readonly is True:
                 message = 'No Berkeley EMD data sets found in file.'
@@ -194,8 +264,8 @@ class fileEMD:
 
         """
         # close the file
-        # if(not self.file_hdl.closed):
-        self.file_hdl.close()
+        if self.file_hdl is not None:
+            self.file_hdl.close()
 
     def __enter__(self):
         """Implement python's with statement
@@ -213,6 +283,10 @@ class fileEMD:
     def find_emdgroups(self, parent):
         """Find all emd_data_type groups within the group parent and return a list of references to their HDF5 groups.
 
+        The tree is walked once with h5py's visititems. Each object is visited once even if it is linked
+        several times by hard links. Groups reached through soft links are searched as well and listed with
+        the path of the link. External links are not followed.
+
         Parameters
         ----------
             parent: h5py.Group
@@ -228,25 +302,46 @@ class fileEMD:
 
         emds0 = []
 
-        # recursive function to run and retrieve groups with emd_group_type set to 1
-        def proc_group(group, emds):
-            # take a look at each item in the group
-            for item in group:
-                # check if group
-                if group.get(item, getclass=True) == h5py.Group:
-                    item = group.get(item)
-                    # check if emd_group_type
-                    if 'emd_group_type' in item.attrs and 'data' in item.keys():
-                        if item.attrs['emd_group_type'] == 1:
-                            emds.append(item)
-                    # process subgroups
-                    proc_group(item, emds)
+        def proc_item(name, item):
+            # check if emd_group_type
+            if isinstance(item, h5py.Group) and 'emd_group_type' in item.attrs and 'data' in item:
+                if item.attrs['emd_group_type'] == 1:
+                    emds0.append(item)
+
+        def proc_group(group, chain):
+            group.visititems(proc_item)
+
+            # visititems does not follow soft links. Search the groups they point to.
+            soft = []
+
+            def proc_link(name, info):
+                if info.type == h5py.h5l.TYPE_SOFT:
+                    soft.append(name.decode('utf-8'))
+
+            group.id.links.visit(proc_link, info=True)
+            for name in soft:
+                item = group.get(name)  # None for dangling links
+                if not isinstance(item, h5py.Group):
+                    continue
+                # Skip links pointing to a group above them
+                parts = name.split('/')
+                above = chain + [group['/'.join(parts[:ii])].id for ii in range(1, len(parts))]
+                if item.id not in above:
+                    proc_item(name, item)
+                    proc_group(item, above + [item.id])
 
         # run
-        proc_group(parent, emds0)
+        proc_group(parent, [parent.id])
 
         return emds0
 
+    def _forget_emdgroups(self, path):
+        """Remove the group at path and its subgroups from list_emds before they are deleted.
+
+        """
+        self.list_emds = [grp for grp in self.list_emds
+                          if grp.name != path and not grp.name.startswith(path + '/')]
+
     def get_emddims(self, group):
         """Get the emdtype dimensions saved in in group.
 
@@ -298,39 +393,47 @@ class fileEMD:
         dims = tuple(dims)
         return dims
 
-    def get_emdgroup(self, group):
+    def get_emdgroup(self, group, lazy=False, processes=None, access=None):
         """Get the emd data saved in the requested group.
 
         Note
         ____
-        The memmap keyword has been removed. Please use get_memmap().
+        The memmap keyword has been removed. Please use get_memmap() or lazy=True.
 
         Parameters
         ----------
             group: h5py._hl.group.Group or int
                 Reference to the HDF5 group to load. If int is used then the item corresponding to self.list_emds
                 is loaded
+            lazy: bool
+                Return an EmdDataset which only reads the data when it is sliced instead of loading all data.
+            processes: int or None
+                Read and decompress the data with this many processes. See EmdDataset.read_parallel().
+            access: str or None
+                Set the chunk cache of a lazy dataset for reading it with this access pattern. One of 'frame',
+                'pixel' or 'random'. See chunkCache().
 
         Returns
         -------
             : tuple or None
                 None or tuple containing:
-                    : np.ndarray
+                    : np.ndarray or EmdDataset
                         The data of the emdtype group.
                     : list
                         List of [0] dimension vectors, [1] labels and [2] units.
+
+        Example
+        -------
+            Read a single frame of a large dataset
+            >> with emd.fileEMD('filename.emd') as emd1:
+            >>     data, dims = emd1.get_emdgroup(0, lazy=True)
+            >>     frame = data[10]
         """
 
         # check input
-        if not isinstance(group, h5py.Group):
-            if isinstance(group, int):
-                try:
-                    group = self.list_emds[group]
-                except IndexError:
-                    print('group does not exist')
-                    return
-            else:
-                raise TypeError('group needs to refer to a valid HDF5 group!')
+        group = self._get_group(group)
+        if group is None:
+            return
 
         if 'emd_group_type' not in group.attrs:
             raise TypeError('group is not a emd_group_type group!')
@@ -339,7 +442,13 @@ class fileEMD:
 
         # retrieve data and dims
         try:
-            data = group['data'][:]
+            if lazy:
+                data = self._lazy_dataset(group, access)
+            elif processes is not None:
+                with self._lazy_dataset(group) as lazy_data:
+                    data = lazy_data.read_parallel(processes=processes)
+            else:
+                data = group['data'][:]
             dims = self.get_emddims(group)
 
             return data, dims
@@ -349,10 +458,10 @@ class fileEMD:
 
             return None
 
-    def get_memmap(self, group):
-        """ Opens a new fileEMD object and returns the requested EMD group. This prevents the file from being closed.
-        The original HDF5 file is left open. The file pointer is lost, but it will be closed once the EMD group
-        is deleted or removed. See also get_emdgroup().
+    def get_memmap(self, group, access=None):
+        """ Get lazy access to the data of the requested EMD group that stays valid after this file is closed.
+        The data is read through a read-only HDF5 file handle which is shared by all lazy datasets of the same
+        file. The shared handle is closed when the last of these datasets is deleted. See also get_emdgroup().
 
 
         Parameters
@@ -360,22 +469,43 @@ class fileEMD:
         group: h5py._hl.group.Group or int
                 Reference to the HDF5 group to load. If int is used then the item corresponding to self.list_emds
                 is loaded
+        access: str or None
+            Set the chunk cache for reading the data with this access pattern. See chunkCache().
 
+        Returns
+        -------
+            : tuple
+                The data as EmdDataset and the dims.
         """
-        f = h5py.File(self.file_hdl.filename, 'r')
-
         # check input
+        group = self._get_group(group)
+        if group is None:
+            return
+        return self._lazy_dataset(group, access), self.get_emddims(group)
+
+    def _get_group(self, group):
+        """Get the HDF5 group from a group or an index into list_emds.
+
+        """
         if not isinstance(group, h5py.Group):
             if isinstance(group, int):
                 try:
                     group = self.list_emds[group]
                 except IndexError:
                     print('group does not exist')
-                    return
+                    return None
             else:
                 raise TypeError('group needs to refer to a valid HDF5 group!')
-        data = f[group.name + '/data']
-        return data, self.get_emddims(group)
+        return group
+
+    def _lazy_dataset(self, group, access=None):
+        """Create an EmdDataset for the data of group. The shared read-only handle is used if the file can be
+        reopened by its path. Otherwise the open handle of this file is used.
+
+        """
+        if self.file_path is not None and Path(self.file_path).exists():
+            return EmdDataset(self.file_path, group.name + '/data', access)
+        return EmdDataset(group, 'data', access)
 
     def write_dim(self, label, dim, parent):
         """Auxiliary function to write a dim dataset to parent.
@@ -407,45 +537,71 @@ class fileEMD:
 
         return dset
 
-    def put_emdgroup(self, label, data, dims, parent=None, overwrite=False, **kwargs):
+    def put_emdgroup(self, label, data, dims, parent=None, overwrite=False, preset=None, chunk_bytes=_CHUNK_BYTES,
+                     **kwargs):
         """Put an emdtype dataset into the EMD file.
 
         Parameters
         ----------
             label: str
                 Label for the emdtype group containing the dataset.
-            data: np.ndarray
-                Numpy array containing the data.
+            data: np.ndarray or None
+                Numpy array containing the data. If None, an empty dataset is created which can be filled
+                later. The shape and dtype keyword arguments are required in this case.
             dims: tuple
                 Tuple containing the necessary dims as ((vec, name, units), (vec, name, units), ...)
             parent: h5py.Group or None
                 Parent for the emdtype group, if None it will be written to /data.
             overwrite: bool
                 Set to force overwriting entry in EMD file.
+            preset: str or None
+                A chunk layout preset used if no chunks are given. One of 'image-stack', '4dstem-diffraction',
+                '4dstem-realspace' or 'spectrum-image'. See chunkShape().
+            chunk_bytes: int
+                The target size of the chunks of the preset in bytes.
             **kwargs: various
-                Keyword arguments to be passed to h5py.create_dataset(), e.g. for compression.
+                Keyword arguments to be passed to h5py.create_dataset(), e.g. for compression. The compression
+                can also be one of the hdf5plugin filters listed in compressionOptions().
 
         Returns
         -------
             : h5py.Group or None
                 Group referencing this emdtype dataset or None if failed.
+
+        Example
+        -------
+            Write a 4D-STEM dataset for fast access to single diffraction patterns
+            >> with emd.fileEMD('filename.emd', readonly=False) as emd1:
+            >>     emd1.put_emdgroup('4dstem', data, dims, preset='4dstem-diffraction', compression='bitshuffle')
         """
 
         # check input
         if not isinstance(label, str):
             raise TypeError('label needs to be string!')
 
-        if not isinstance(data, np.ndarray):
+        if data is None:
+            if 'shape' not in kwargs or 'dtype' not in kwargs:
+                raise TypeError('shape and dtype are needed to create an empty dataset!')
+            shape = tuple(kwargs['shape'])
+        elif not isinstance(data, np.ndarray):
             raise TypeError('data needs to be a numpy.ndarray!')
+        else:
+            shape = data.shape
 
         try:
-            assert len(dims) == len(data.shape)
+            assert len(dims) == len(shape)
             for i in range(len(dims)):
                 assert len(dims[i]) == 3
-                assert dims[i][0].shape[0] == data.shape[i]
+                assert dims[i][0].shape[0] == shape[i]
         except:
             raise TypeError('Something wrong with the provided dims')
 
+        if preset is not None and kwargs.get('chunks') is None:
+            dtype = kwargs['dtype'] if data is None else data.dtype
+            kwargs['chunks'] = chunkShape(shape, dtype, preset, chunk_bytes)
+        if kwargs.get('compression') in ('bitshuffle', 'zstd', 'bitshuffle-zstd'):
+            kwargs.update(compressionOptions(kwargs.pop('compression')))
+
         # write stuff to HDF5
 
         # create group
@@ -454,6 +610,7 @@ class fileEMD:
                 if label in parent:
                     if overwrite:
                         print('overwriting "{}" in "{}"'.format(label, parent.name))
+                        self._forget_emdgroups(parent[label].name)
                         del parent[label]
                     else:
                         print('"{}" already exists in "{}"'.format(label, parent.name))
@@ -464,6 +621,7 @@ class fileEMD:
                 if label in self.data:
                     if overwrite:
                         print('overwriting "{}" in "{}"'.format(label, self.data.name))
+                        self._forget_emdgroups(self.data[label].name)
                         del self.data[label]
                     else:
                         print('"{}" already exists in "{}"'.format(label, self.data.name))
@@ -482,7 +640,8 @@ class fileEMD:
                 self.write_dim('dim{}'.format(i + 1), dims[i], grp)
 
             # update emds list
-            self.list_emds = self.find_emdgroups(self.file_hdl)
+            if self._emd_root == '/' or grp.name.startswith(self._emd_root + '/'):
+                self.list_emds.append(grp)
 
             return grp
 
@@ -491,6 +650,93 @@ class fileEMD:
 
             return None
 
+    def create_emdgroup_stream(self, label, frame_shape, dtype, dims_template, parent=None, overwrite=False,
+                               chunks=None, **kwargs):
+        """Create an emdtype dataset that grows along the first axis as frames are appended. See EmdGroupStream.
+
+        Parameters
+        ----------
+            label: str
+                Label for the emdtype group containing the dataset.
+            frame_shape: tuple
+                The shape of each frame. The dataset has shape [N, *frame_shape].
+            dtype: numpy.dtype
+                The data type of the dataset.
+            dims_template: tuple
+                The dims as ((step, name, units), (vec, name, units), ...). The first entry describes the growing
+                axis. Its values are step times the frame number unless values are given to append(). The other
+                entries are the dims of the frame axes as for put_emdgroup().
+            parent: h5py.Group or None
+                Parent for the emdtype group, if None it will be written to /data.
+            overwrite: bool
+                Set to force overwriting entry in EMD file.
+            chunks: tuple or None
+                The chunk shape. If None, chunks of whole frames of about 1 MB are used.
+            **kwargs: various
+                Keyword arguments to be passed to h5py.create_dataset(), e.g. for compression.
+
+        Returns
+        -------
+            : EmdGroupStream
+                The writer to append frames with.
+
+        Example
+        -------
+            Write frames as they are acquired
+            >> with emd.fileEMD('filename.emd', readonly=False) as emd1:
+            >>     dims = ((0.1, 'time', 's'), (yy, 'y', 'nm'), (xx, 'x', 'nm'))
+            >>     with emd1.create_emdgroup_stream('series', (512, 512), np.uint16, dims) as stream:
+            >>         for frame in acquire():
+            >>             stream.append(frame)
+        """
+        frame_shape = tuple(int(ss) for ss in frame_shape)
+        dtype = np.dtype(dtype)
+        if len(dims_template) != len(frame_shape) + 1:
+            raise TypeError('Something wrong with the provided dims')
+        step, name, units = dims_template[0]
+
+        if chunks is None:
+            preset = 'image-stack' if len(frame_shape) > 1 else 'spectrum-image'
+            chunks = chunkShape((np.iinfo(np.int32).max,) + frame_shape, dtype, preset)
+
+        # The dim vector of the first axis is replaced by a resizable dataset below
+        dims = ((np.zeros(0), name, units),) + tuple(dims_template[1:])
+        grp = self.put_emdgroup(label, None, dims, parent=parent, overwrite=overwrite, shape=(0,) + frame_shape,
+                                dtype=dtype, maxshape=(None,) + frame_shape, chunks=chunks, **kwargs)
+        if grp is None:
+            raise RuntimeError('Could not create "{}"'.format(label))
+        del grp['dim1']
+        dim = grp.create_dataset('dim1', shape=(0,), maxshape=(None,), dtype='f8', chunks=(max(1024, chunks[0]),))
+        dim.attrs['name'] = name
+        dim.attrs['units'] = units
+
+        return EmdGroupStream(grp, step)
+
+    def async_writer(self, max_blocks=2):
+        """Create a writer which writes blocks of data to the datasets of this file in a background thread.
+        See EmdAsyncWriter.
+
+        Parameters
+        ----------
+            max_blocks: int
+                The maximum number of blocks waiting to be written.
+
+        Returns
+        -------
+            : EmdAsyncWriter
+                The writer. Close it before closing this file.
+
+        Example
+        -------
+            Compute and write blocks at the same time
+            >> with emd.fileEMD('filename.emd', readonly=False) as emd1:
+            >>     grp = emd1.put_emdgroup('result', None, dims, shape=shape, dtype=np.float32)
+            >>     with emd1.async_writer() as writer:
+            >>         for ii in range(0, shape[0], 16):
+            >>             writer.write(grp['data'], np.s_[ii:ii + 16], compute(ii))
+        """
+        return EmdAsyncWriter(max_blocks)
+
     def put_comment(self, msg, timestamp=None):
         """Create a comment in the EMD file.
 
@@ -560,6 +806,907 @@ class fileEMD:
 
         return meta_data
 
+
+# State of the worker processes of EmdDataset.read_parallel()
+_worker = {}
+
+
+def _parallelInit(file_path, dataset_path, shm_name, shape, dtype):
+    """ Open the file and attach to the shared output array in a worker process.
+
+    """
+    import hdf5plugin  # register the compression filters in the worker
+    _worker['file'] = h5py.File(file_path, 'r')
+    _worker['dataset'] = _worker['file'][dataset_path]
+    _worker['shm'] = shared_memory.SharedMemory(name=shm_name)
+    _worker['out'] = np.ndarray(shape, dtype=dtype, buffer=_worker['shm'].buf)
+
+
+def _parallelRead(pieces):
+    """ Read pieces of the dataset into the shared output array in a worker process.
+
+    """
+    for source, dest in pieces:
+        _worker['dataset'].read_direct(_worker['out'], source, dest)
+    return len(pieces)
+
+
+class EmdDataset:
+    """Read-only lazy access to the data of an EMD group. Nothing is read until the dataset is sliced. Slices
+    are translated to HDF5 hyperslab reads so only the requested part of the data is read from disk. All
+    NumPy-style indices are supported including negative steps, unsorted or repeated integer arrays and
+    boolean masks.
+
+    Datasets of the same file share one read-only file handle. The handle is closed when the last dataset using
+    it is closed or deleted.
+
+    Attributes
+    ----------
+    dataset : h5py.Dataset
+        The underlying HDF5 dataset. Other attributes (e.g. chunks or attrs) are forwarded to it.
+    shape : tuple
+        The shape of the data.
+    dtype : numpy.dtype
+        The data type of the data.
+    chunk_cache : dict
+        The HDF5 chunk cache of the dataset as rdcc_nbytes, rdcc_nslots and rdcc_w0.
+
+    """
+
+    def __init__(self, file_path, dataset, access=None, cache=None, frame_axes=None):
+        """Open a dataset through the shared handle of file_path.
+
+        Parameters
+        ----------
+        file_path : str or pathlib.Path or h5py.Group or None
+            The HDF5 file or an open group the dataset path is relative to. If None, dataset needs to be an open
+            h5py.Dataset which is used directly.
+        dataset : str or h5py.Dataset
+            The path of the dataset in the file or the dataset itself.
+        access : str, optional
+            Set the chunk cache of the dataset for this access pattern. One of 'frame', 'pixel' or 'random'.
+            See chunkCache().
+        cache : dict, optional
+            Set the chunk cache of the dataset to these rdcc_nbytes, rdcc_nslots and rdcc_w0 values instead.
+            By default, the chunk cache of the file is used.
+        frame_axes : tuple, optional
+            The axes of a frame for the access pattern. Default is the last two axes.
+
+        Note
+        ----
+        HDF5 sets the chunk cache when a dataset is opened the first time. The access pattern or cache has no
+        effect if the dataset is already open elsewhere, e.g. when an open h5py.Dataset is passed.
+
+        """
+        self._key = None
+        if file_path is None:
+            self.dataset = dataset
+        elif isinstance(file_path, h5py.Group):
+            self.dataset = file_path[dataset]
+        else:
+            self._key, hdl = _acquireHandle(file_path)
+            try:
+                self.dataset = hdl[dataset]
+            except:
+                self.close()
+                raise
+        self.shape = self.dataset.shape
+        self.dtype = self.dataset.dtype
+
+        if cache is None and access is not None:
+            cache = chunkCache(self.shape, self.dataset.chunks, self.dtype, access, frame_axes)
+        if cache is not None:
+            hdl, name = self.dataset.file, self.dataset.name
+            self.dataset = None  # close the dataset so it is opened with the new cache
+            self.dataset = _openDataset(hdl, name, cache)
+        nslots, nbytes, w0 = self.dataset.id.get_access_plist().get_chunk_cache()
+        self.chunk_cache = {'rdcc_nbytes': nbytes, 'rdcc_nslots': nslots, 'rdcc_w0': w0}
+        self._cached = collections.OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+    def __del__(self):
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
+
+    def close(self):
+        """Release the shared file handle.
+
+        """
+        if self._key is not None:
+            _releaseHandle(self._key)
+            self._key = None
+
+    def __getattr__(self, name):
+        if name == 'dataset':
+            raise AttributeError(name)
+        return getattr(self.dataset, name)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape, dtype=np.int64))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None):
+        out = self[...]
+        if dtype is not None:
+            out = out.astype(dtype, copy=False)
+        return out
+
+    def _hyperslab(self, key):
+        """Split a NumPy index into an index h5py can read as a hyperslab and an index applied to the result
+        with NumPy afterwards.
+
+        """
+        if not isinstance(key, tuple):
+            key = (key,)
+
+        # expand the Ellipsis
+        nfixed = len([kk for kk in key if kk is not None and kk is not Ellipsis])
+        if nfixed > self.ndim:
+            raise IndexError('too many indices: array is {}-dimensional, but {} were indexed'.format(
+                             self.ndim, nfixed))
+        if any(kk is Ellipsis for kk in key):
+            ii = [jj for jj, kk in enumerate(key) if kk is Ellipsis][0]
+            key = key[:ii] + (slice(None),) * (self.ndim - nfixed) + tuple(kk for kk in key[ii + 1:]
+                                                                              if kk is not Ellipsis)
+        else:
+            key = key + (slice(None),) * (self.ndim - nfixed)
+
+        # convert boolean masks and lists to integer arrays
+        converted = []
+        axis = 0
+        for kk in key:
+            if kk is None:
+                converted.append(kk)
+                continue
+            if not isinstance(kk, (slice, int, np.integer)):
+                kk = np.asarray(kk)
+                if kk.size == 0:
+                    kk = kk.astype(np.intp)
+                elif kk.dtype == bool:
+                    if kk.ndim != 1:
+                        raise IndexError('Only one dimensional boolean indices are supported.')
+                    kk = np.nonzero(kk)[0]
+                kk = np.arange(self.shape[axis])[kk]  # check bounds and wrap negative indices
+            converted.append(kk)
+            axis += 1
+        fancy = any(isinstance(kk, np.ndarray) for kk in converted)
+
+        h5key = []
+        post = []
+        axis = 0
+        for kk in converted:
+            if kk is None:
+                post.append(None)
+                continue
+            size = self.shape[axis]
+            axis += 1
+            if isinstance(kk, (int, np.integer)):
+                kk = int(kk)
+                if not -size <= kk < size:
+                    raise IndexError('index {} is out of bounds for axis {} with size {}'.format(kk, axis - 1, size))
+                kk %= size
+                if fancy:
+                    # keep the axis so NumPy applies the same rules for mixed integer and array indices
+                    h5key.append(slice(kk, kk + 1))
+                    post.append(0)
+                else:
+                    h5key.append(kk)
+            elif isinstance(kk, slice):
+                start, stop, step = kk.indices(size)
+                num = len(range(start, stop, step))
+                if num == 0:
+                    h5key.append(slice(0, 0))
+                    post.append(slice(None))
+                elif step > 0:
+                    h5key.append(slice(start, start + (num - 1) * step + 1, step))
+                    post.append(slice(None))
+                else:
+                    last = start + (num - 1) * step
+                    h5key.append(slice(last, start + 1, -step))
+                    post.append(slice(None, None, -1))
+            else:
+                # read the sorted unique indices or the range they cover
+                unique, inverse = np.unique(kk, return_inverse=True)
+                if len(unique) == 0:
+                    h5key.append(slice(0, 0))
+                    post.append(inverse.reshape(kk.shape))
+                elif len(unique) == unique[-1] - unique[0] + 1 or \
+                        sum(isinstance(cc, np.ndarray) for cc in converted) > 1:
+                    h5key.append(slice(int(unique[0]), int(unique[-1]) + 1))
+                    post.append(kk - unique[0])
+                else:
+                    h5key.append(unique.tolist())
+                    post.append(inverse.reshape(kk.shape))
+        return tuple(h5key), tuple(post)
+
+    def cache_info(self):
+        """The number of chunk cache hits and misses of the reads of this dataset so far. HDF5 does not report
+        the hits of its chunk cache, so they are counted with a model of the cache which keeps the least
+        recently used chunks that fit into rdcc_nbytes. Each miss is a chunk which is read and decompressed.
+
+        Returns
+        -------
+            : dict
+                The hits, misses and the number of chunks currently in the cache (currsize) and that fit into
+                the cache (maxsize).
+        """
+        chunks = self.dataset.chunks
+        maxsize = 0
+        if chunks is not None:
+            maxsize = self.chunk_cache['rdcc_nbytes'] // (self.dtype.itemsize * int(np.prod(chunks)))
+        return {'hits': self._hits, 'misses': self._misses, 'maxsize': maxsize, 'currsize': len(self._cached)}
+
+    def _countChunks(self, h5key):
+        """Count the chunk cache hits and misses of reading a hyperslab.
+
+        """
+        chunks = self.dataset.chunks
+        if chunks is None:
+            return
+        cells = []
+        for kk, size, chunk in zip(h5key, self.shape, chunks):
+            if isinstance(kk, int):
+                cells.append((kk // chunk,))
+            else:
+                indices = np.arange(size)[kk] if isinstance(kk, slice) else np.asarray(kk)
+                cells.append(np.unique(indices // chunk).tolist())
+        maxsize = self.cache_info()['maxsize']
+        for cell in itertools.product(*cells):
+            if cell in self._cached:
+                self._hits += 1
+                self._cached.move_to_end(cell)
+            else:
+                self._misses += 1
+                if maxsize > 0:
+                    self._cached[cell] = None
+                    if len(self._cached) > maxsize:
+                        self._cached.popitem(last=False)
+
+    def __getitem__(self, key):
+        h5key, post = self._hyperslab(key)
+        self._countChunks(h5key)
+        out = self.dataset[h5key]
+        if all(isinstance(pp, slice) and pp == slice(None) for pp in post):
+            return out
+        return np.asarray(out)[post]
+
+    def _pieces(self, h5key):
+        """Split a hyperslab of ints, slices and sorted index lists into chunk-aligned pieces. Returns the
+        shape of the hyperslab and a list of (source, destination) slices.
+
+        """
+        chunks = self.dataset.chunks
+        if chunks is None:
+            # blocks of about 4 MB along the first axis of contiguous datasets
+            row = self.dtype.itemsize * int(np.prod(self.shape[1:], dtype=np.int64))
+            chunks = (max(1, 2 ** 22 // max(1, row)),) + self.shape[1:]
+
+        shape = []
+        ranges = []
+        for kk, size, chunk in zip(h5key, self.shape, chunks):
+            if isinstance(kk, int):
+                indices = np.array([kk])
+            elif isinstance(kk, slice):
+                indices = np.arange(size)[kk]
+            else:
+                indices = np.asarray(kk)
+            shape.append(len(indices))
+
+            # the selected indices in each chunk along this axis
+            axis_ranges = []
+            cells = indices // chunk
+            bounds = np.concatenate(([0], np.nonzero(np.diff(cells))[0] + 1, [len(indices)]))
+            for start, stop in zip(bounds[:-1], bounds[1:]):
+                if isinstance(kk, slice):
+                    step = kk.indices(size)[2]
+                    source = slice(int(indices[start]), int(indices[stop - 1]) + 1, step)
+                else:
+                    source = indices[start:stop].tolist() if stop - start > 1 else slice(int(indices[start]),
+                                                                                        int(indices[start]) + 1)
+                axis_ranges.append((source, slice(int(start), int(stop))))
+            ranges.append(axis_ranges)
+
+        pieces = [(tuple(rr[0] for rr in piece), tuple(rr[1] for rr in piece))
+                  for piece in itertools.product(*ranges)]
+        return tuple(shape), pieces
+
+    def read_parallel(self, key=Ellipsis, processes=None):
+        """Read a part of the dataset with several processes. The selection is split into pieces aligned to the
+        HDF5 chunks which are read and decompressed in a pool of worker processes. Each worker opens its own
+        read-only file handle and writes its pieces directly into an output array in shared memory. This is
+        much faster than reading in one process if decompression is the bottleneck.
+
+        Note
+        ----
+        The worker processes are started with the spawn method. Scripts calling this need the usual
+        if __name__ == '__main__' guard.
+
+        Parameters
+        ----------
+        key : index, optional
+            A NumPy-style index as for slicing. Default is the whole dataset.
+        processes : int, optional
+            The number of worker processes. Default is the number of CPUs. The data is read in this process if
+            there is only one process or one piece.
+
+        Returns
+        -------
+            : np.ndarray
+                The selected data.
+        """
+        h5key, post = self._hyperslab(key)
+
+        # read the slab of integer axes and apply the integer index afterwards
+        slab = []
+        post_ints = []
+        for kk in h5key:
+            if isinstance(kk, int):
+                slab.append(slice(kk, kk + 1))
+                post_ints.append(0)
+            else:
+                slab.append(kk)
+                post_ints.append(slice(None))
+        shape, pieces = self._pieces(tuple(slab))
+
+        if processes is None:
+            processes = os.cpu_count() or 1
+        processes = min(processes, len(pieces))
+        if self._key is None or processes <= 1 or int(np.prod(shape)) == 0:
+            out = self.dataset[tuple(slab)]
+        else:
+            shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * self.dtype.itemsize))
+            try:
+                # about four tasks per process to balance the load
+                ntasks = min(len(pieces), 4 * processes)
+                tasks = [pieces[ii::ntasks] for ii in range(ntasks)]
+                ctx = multiprocessing.get_context('spawn')  # fork is not safe with an initialized HDF5 library
+                with ctx.Pool(processes, initializer=_parallelInit,
+                              initargs=(self._key[0], self.dataset.name, shm.name, shape, self.dtype)) as pool:
+                    _ = pool.map(_parallelRead, tasks)
+                out = np.ndarray(shape, dtype=self.dtype, buffer=shm.buf).copy()
+            finally:
+                shm.close()
+                shm.unlink()
+
+        out = out[tuple(post_ints)]
+        if all(isinstance(pp, slice) and pp == slice(None) for pp in post):
+            return out
+        return out[post]
+
+
+class EmdGroupStream:
+    """Append frames to an emdtype dataset created by fileEMD.create_emdgroup_stream(). Frames are collected in
+    a buffer of one chunk along the first axis and written as whole chunks. The dataset and the first dim vector
+    grow together. Only one chunk of frames is held in memory.
+
+    Attributes
+    ----------
+    group : h5py.Group
+        The emdtype group.
+    dataset : h5py.Dataset
+        The data of the emdtype group.
+    shape : tuple
+        The shape of the dataset including the buffered frames.
+
+    """
+
+    def __init__(self, group, step=1.0):
+        """Start appending to an emdtype group with an empty, resizable dataset.
+
+        Parameters
+        ----------
+        group : h5py.Group
+            The emdtype group. The data and dim1 datasets need to be resizable along the first axis.
+        step : float
+            The value of dim1 is step times the frame number unless values are given to append().
+
+        """
+        self.group = group
+        self.dataset = group['data']
+        self._dim = group['dim1']
+        self._step = step
+        self._buffer = np.empty(self.dataset.chunks[:1] + self.dataset.shape[1:], dtype=self.dataset.dtype)
+        self._values = np.empty(len(self._buffer), dtype='f8')
+        self._buffered = 0
+
+    @property
+    def shape(self):
+        return (self.dataset.shape[0] + self._buffered,) + self.dataset.shape[1:]
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
+
+    def append(self, frames, values=None):
+        """Append frames to the dataset.
+
+        Parameters
+        ----------
+        frames : np.ndarray
+            A single frame or several frames stacked along the first axis.
+        values : float or np.ndarray, optional
+            The dim1 values of the frames (i.e. time stamps). Default is step times the frame number.
+
+        """
+        if self._buffer is None:
+            raise RuntimeError('The stream is closed.')
+        frames = np.asarray(frames)
+        frame_shape = self.dataset.shape[1:]
+        if frames.shape == frame_shape:
+            frames = frames[np.newaxis]
+        if frames.shape[1:] != frame_shape:
+            raise ValueError('frames need a shape of {} or [N, {}]'.format(frame_shape, frame_shape))
+        num = frames.shape[0]
+        if values is None:
+            values = (len(self) + np.arange(num)) * self._step
+        values = np.broadcast_to(np.asarray(values, dtype='f8').reshape(-1), (num,))
+
+        done = 0
+        while done < num:
+            # write whole chunks directly if the buffer is empty
+            size = len(self._buffer)
+            if self._buffered == 0 and num - done >= size:
+                whole = (num - done) // size * size
+                self._write(frames[done:done + whole], values[done:done + whole])
+                done += whole
+                continue
+            nn = min(size - self._buffered, num - done)
+            self._buffer[self._buffered:self._buffered + nn] = frames[done:done + nn]
+            self._values[self._buffered:self._buffered + nn] = values[done:done + nn]
+            self._buffered += nn
+            done += nn
+            if self._buffered == size:
+                self.flush()
+
+    def _write(self, frames, values):
+        """Grow the data and dim1 datasets and write frames at the end.
+
+        """
+        start = self.dataset.shape[0]
+        stop = start + frames.shape[0]
+        self.dataset.resize(stop, axis=0)
+        self._dim.resize(stop, axis=0)
+        self.dataset[start:stop] = frames
+        self._dim[start:stop] = values
+
+    def flush(self):
+        """Write the buffered frames to the file.
+
+        """
+        if self._buffered > 0:
+            self._write(self._buffer[:self._buffered], self._values[:self._buffered])
+            self._buffered = 0
+        self.dataset.file.flush()
+
+    def close(self):
+        """Write the buffered frames and release the buffer. The EMD file stays open.
+
+        """
+        if self._buffer is not None:
+            self.flush()
+            self._buffer = None
+            self._values = None
+
+
+class EmdAsyncWriter:
+    """Write blocks of data to HDF5 datasets or EmdGroupStreams in a background thread. Blocks are passed to the
+    thread through a queue of bounded size so computing the next block overlaps with writing the previous ones.
+    The memory used is bounded by the queue size. If the queue is full, write() waits for the thread.
+
+    An error in the thread is raised by the next call to write(), append(), flush() or close(). The remaining
+    blocks are not written after an error.
+
+    """
+
+    def __init__(self, max_blocks=2):
+        """Start the writer thread.
+
+        Parameters
+        ----------
+        max_blocks : int
+            The maximum number of blocks waiting to be written.
+
+        """
+        self._queue = queue.Queue(maxsize=max(1, max_blocks))
+        self._error = None
+        self._reported = False
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='EmdAsyncWriter', daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        if exception_type is None:
+            self.close()
+        else:
+            # do not hide the original exception
+            try:
+                self.close()
+            except Exception:
+                pass
+
+    def _run(self):
+        """Write the queued blocks until the stop signal.
+
+        """
+        while True:
+            task = self._queue.get()
+            try:
+                if task is None:
+                    return
+                if self._error is None:
+                    func, args, kwargs = task
+                    func(*args, **kwargs)
+            except Exception as err:
+                self._error = err
+            finally:
+                self._queue.task_done()
+
+    def _raise(self):
+        """Raise an error of the writer thread in the calling thread once.
+
+        """
+        if self._error is not None and not self._reported:
+            self._reported = True
+            raise RuntimeError('Writing in the background failed') from self._error
+
+    def submit(self, func, *args, **kwargs):
+        """Call func(*args, **kwargs) in the writer thread.
+
+        """
+        if self._closed:
+            raise RuntimeError('The writer is closed.')
+        if self._error is not None:
+            self._reported = True
+            raise RuntimeError('Writing in the background failed') from self._error
+        self._queue.put((func, args, kwargs))
+
+    def write(self, dataset, key, data, copy=True):
+        """Write dataset[key] = data in the writer thread.
+
+        Parameters
+        ----------
+        dataset : h5py.Dataset
+            The dataset to write to.
+        key : index
+            The part of the dataset to write (i.e. np.s_[10:20]).
+        data : np.ndarray
+            The data to write.
+        copy : bool
+            Copy the data so the caller can reuse its array immediately. Set to False if data is not changed
+            after this call.
+
+        """
+        data = np.array(data, copy=True) if copy else data
+        self.submit(dataset.__setitem__, key, data)
+
+    def append(self, stream, frames, values=None, copy=True):
+        """Append frames to an EmdGroupStream in the writer thread. See EmdGroupStream.append().
+
+        Close the stream with submit(stream.close) or after closing this writer.
+
+        """
+        frames = np.array(frames, copy=True) if copy else frames
+        self.submit(stream.append, frames, values)
+
+    def flush(self):
+        """Wait until all queued blocks are written.
+
+        """
+        if not self._closed:
+            self._queue.join()
+        self._raise()
+
+    def close(self):
+        """Write the remaining blocks and stop the writer thread.
+
+        """
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._thread.join()
+        self._raise()
+
+
+def compressionOptions(compression=None):
+    """ Get the keyword arguments for h5py.create_dataset() for a compression method. The bitshuffle and zstd
+    filters are provided by the hdf5plugin package and are much faster than gzip for most detector data.
+    Files written with these filters need hdf5plugin (or the filter plugins) to be read.
+
+    Parameters
+    ----------
+        compression : str or None
+            One of None (no compression), 'gzip', 'lzf', 'bitshuffle' (bitshuffle with lz4), 'zstd' or
+            'bitshuffle-zstd'.
+
+    Returns
+    -------
+        : dict
+            Keyword arguments for h5py.create_dataset().
+    """
+    if compression is None:
+        return {}
+    elif compression in ('gzip', 'lzf'):
+        return {'compression': compression}
+    elif compression in ('bitshuffle', 'zstd', 'bitshuffle-zstd'):
+        import hdf5plugin
+        if compression == 'bitshuffle':
+            return dict(hdf5plugin.Bitshuffle(cname='lz4'))
+        elif compression == 'zstd':
+            return dict(hdf5plugin.Zstd())
+        else:
+            return dict(hdf5plugin.Bitshuffle(cname='zstd'))
+    else:
+        raise ValueError('Unknown compression: {}'.format(compression))
+
+
+def chunkShape(shape, dtype, preset, chunk_bytes=_CHUNK_BYTES):
+    """ Choose an HDF5 chunk shape for a common access pattern. The chunk is grown one axis at a time
+    until it has about chunk_bytes bytes. The axes grown first are kept whole if possible.
+
+    Parameters
+    ----------
+        shape : tuple
+            The shape of the dataset.
+        dtype : numpy.dtype
+            The data type of the dataset.
+        preset : str
+            'image-stack' for whole images of a [..., Y, X] stack, '4dstem-diffraction' for whole diffraction
+            patterns of [scanY, scanX, kY, kX] data, '4dstem-realspace' for whole scan images of the same data
+            (i.e. for virtual imaging) or 'spectrum-image' for whole spectra of [..., E] data.
+        chunk_bytes : int
+            The target size of a chunk in bytes.
+
+    Returns
+    -------
+        : tuple
+            The chunk shape.
+    """
+    if preset not in _CHUNK_PRESETS:
+        raise ValueError('Unknown chunk preset: {}. Use one of {}'.format(preset, ', '.join(_CHUNK_PRESETS)))
+    shape = tuple(int(ss) for ss in shape)
+    order = _CHUNK_PRESETS[preset]
+    if order is None:
+        if (preset == 'image-stack' and len(shape) < 2) or len(shape) < 1:
+            raise ValueError('The {} preset does not support {}D data'.format(preset, len(shape)))
+        order = tuple(range(len(shape)))[::-1]
+    elif len(order) != len(shape):
+        raise ValueError('The {} preset requires {}D data'.format(preset, len(order)))
+
+    chunks = [1] * len(shape)
+    size = np.dtype(dtype).itemsize
+    for axis in order:
+        chunks[axis] = int(min(shape[axis], max(1, chunk_bytes // size)))
+        size *= chunks[axis]
+        if chunks[axis] < shape[axis]:
+            break
+    return tuple(max(1, cc) for cc in chunks)
+
+
+def _nextPrime(num):
+    """ The smallest prime number not smaller than num.
+
+    """
+    num = max(2, num)
+    while any(num % ii == 0 for ii in range(2, int(num ** 0.5) + 1)):
+        num += 1
+    return num
+
+
+def chunkCache(shape, chunks, dtype, access='frame', frame_axes=None, max_bytes=2 ** 28):
+    """ Determine an HDF5 chunk cache for reading a chunked dataset with an access pattern. The cache holds
+    all chunks needed by one access plus the chunks which are used again by the next row of accesses, so
+    each chunk is read and decompressed only once. A cache that is too small for strided access to compressed
+    data decompresses the same chunks again and again.
+
+    Parameters
+    ----------
+        shape : tuple
+            The shape of the dataset.
+        chunks : tuple or None
+            The chunk shape of the dataset. None for contiguous datasets.
+        dtype : numpy.dtype
+            The data type of the dataset.
+        access : str
+            'frame' reads one frame (i.e. image or diffraction pattern) after the other in C order, e.g.
+            data[ii, jj] for 4D-STEM. 'pixel' reads the value of one frame pixel in all frames after the other,
+            e.g. data[:, :, kk, ll] for virtual images. 'random' reads frames in no particular order.
+        frame_axes : tuple, optional
+            The axes of a frame. Default is the last two axes.
+        max_bytes : int, optional
+            The maximum size of the cache unless a single chunk is larger. Default is 256 MB.
+
+    Returns
+    -------
+        : dict
+            The rdcc_nbytes, rdcc_nslots and rdcc_w0 of the cache. These are also keyword arguments of
+            h5py.File() and fileEMD().
+
+    Example
+    -------
+        Read diffraction patterns of a 4D-STEM dataset
+        >> with emd.fileEMD('filename.emd') as emd1:
+        >>     data, dims = emd1.get_emdgroup(0, lazy=True, access='frame')
+        >>     patterns = [data[ii, 10] for ii in range(data.shape[0])]
+        >>     print(data.cache_info())
+    """
+    if access not in _ACCESS_PATTERNS:
+        raise ValueError('Unknown access pattern "{}". Use one of {}'.format(access, _ACCESS_PATTERNS))
+    if chunks is None:
+        # contiguous datasets do not use the chunk cache
+        return {'rdcc_nbytes': 2 ** 20, 'rdcc_nslots': 521, 'rdcc_w0': 0.75}
+    ndim = len(shape)
+    if frame_axes is None:
+        frame_axes = range(max(0, ndim - 2), ndim)
+    frame_axes = [aa % ndim for aa in frame_axes]
+    other_axes = [aa for aa in range(ndim) if aa not in frame_axes]
+    whole, steps = (other_axes, frame_axes) if access == 'pixel' else (frame_axes, other_axes)
+
+    nchunks = [-(-ss // cc) for ss, cc in zip(shape, chunks)]
+    chunk_bytes = np.dtype(dtype).itemsize * int(np.prod(chunks, dtype=np.int64))
+    num = int(np.prod([nchunks[aa] for aa in whole], dtype=np.int64))
+    if access != 'random':
+        # chunks which span several rows of accesses are used again by the next row
+        for inner, outer in zip(steps[::-1], steps[-2::-1]):
+            if chunks[outer] == 1 or num * nchunks[inner] * chunk_bytes > max_bytes:
+                break
+            num *= nchunks[inner]
+
+    nbytes = max(min(num * chunk_bytes, max_bytes), chunk_bytes, 2 ** 20)
+    # HDF5 recommends about 100 times more hash slots than chunks in the cache
+    nslots = _nextPrime(min(max(521, 100 * (nbytes // chunk_bytes)), 2 ** 24))
+    # Fully read chunks are not needed again by frame access and are evicted first. HDF5 does not evict
+    # partially read chunks at all with rdcc_w0 = 1 which could grow the cache without bounds otherwise.
+    return {'rdcc_nbytes': int(nbytes), 'rdcc_nslots': nslots, 'rdcc_w0': 1.0 if access == 'frame' else 0.75}
+
+
+def _openDataset(hdl, name, cache):
+    """ Open a dataset with a chunk cache.
+
+    """
+    dapl = h5py.h5p.create(h5py.h5p.DATASET_ACCESS)
+    dapl.set_chunk_cache(cache['rdcc_nslots'], cache['rdcc_nbytes'], cache['rdcc_w0'])
+    return h5py.Dataset(h5py.h5d.open(hdl.id, name.encode('utf-8'), dapl))
+
+
+def _blockShape(shape, unit, order, itemsize, limit):
+    """ Grow a block along the axes in order until it reaches limit bytes. The block is a multiple of unit
+    along each axis (or the full axis).
+
+    """
+    block = [min(uu, ss) for uu, ss in zip(unit, shape)]
+    for axis in order:
+        other = itemsize * int(np.prod(block, dtype=np.int64)) // block[axis]
+        block[axis] = min(shape[axis], max(1, limit // (other * block[axis])) * block[axis])
+        if block[axis] < shape[axis]:
+            break
+    return tuple(block)
+
+
+def _copyBlocks(source, dest, block):
+    """ Copy a dataset to another dataset of the same shape in blocks.
+
+    """
+    for start in itertools.product(*[range(0, nn, bb) for nn, bb in zip(source.shape, block)]):
+        slices = tuple(slice(ss, min(ss + bb, nn)) for ss, bb, nn in zip(start, block, source.shape))
+        dest[slices] = source[slices]
+
+
+def rechunk(src, dst, target_chunks, max_mem=2 ** 28, label=None, compression=None, overwrite=False,
+            tmp_dir=None, **kwargs):
+    """ Copy an EMD group with its dims to a dataset with a different chunk shape without loading all data
+    into memory. For example, 4D-STEM data written with whole diffraction patterns in each chunk can be
+    rechunked for fast virtual imaging with target_chunks='4dstem-realspace'.
+
+    The copy is done in blocks of at most max_mem bytes (but at least one chunk) which are made of whole
+    target chunks. If such a
+    block can also cover whole source chunks the data is copied in one pass. Otherwise each compressed source
+    chunk would need to be decompressed many times. The data is then copied in two passes through an
+    uncompressed temporary dataset which can be read in any order without decompression.
+
+    Parameters
+    ----------
+        src : h5py.Group
+            The EMD group to copy (i.e. fileEMD.list_emds[0]).
+        dst : fileEMD or str or pathlib.Path
+            An EMD file opened for writing or the name of the EMD file to write to. The file is created if it
+            does not exist.
+        target_chunks : tuple or str
+            The new chunk shape or a chunk preset. See chunkShape().
+        max_mem : int, optional
+            The maximum number of bytes of data in memory. Default is 256 MB.
+        label : str, optional
+            The name of the new EMD group. Default is the name of src.
+        compression : str, optional
+            The compression of the new dataset. See compressionOptions().
+        overwrite : bool, optional
+            Overwrite an existing EMD group with the same label.
+        tmp_dir : str or pathlib.Path, optional
+            The directory for the temporary file of a two pass copy. Default is the system temporary directory.
+        **kwargs : various
+            Keyword arguments passed to fileEMD.put_emdgroup().
+
+    Returns
+    -------
+        : int
+            The number of passes over the data.
+
+    Example
+    -------
+        Rechunk a 4D-STEM dataset for fast virtual imaging
+        >> with emd.fileEMD('diffraction.emd') as emd0:
+        >>     emd.rechunk(emd0.list_emds[0], 'realspace.emd', '4dstem-realspace')
+    """
+    if not isinstance(dst, fileEMD):
+        with fileEMD(dst, readonly=False) as emd1:
+            return rechunk(src, emd1, target_chunks, max_mem, label, compression, overwrite, tmp_dir, **kwargs)
+
+    source = src['data']
+    shape = source.shape
+    itemsize = source.dtype.itemsize
+    if isinstance(target_chunks, str):
+        target_chunks = chunkShape(shape, source.dtype, target_chunks)
+    target_chunks = tuple(int(cc) for cc in target_chunks)
+    if len(target_chunks) != len(shape):
+        raise ValueError('The chunk shape {} does not match the shape of the data {}'.format(target_chunks, shape))
+    source_chunks = source.chunks if source.chunks is not None else shape
+
+    if label is None:
+        label = src.name.split('/')[-1]
+    if compression is not None:
+        kwargs['compression'] = compression
+    grp = dst.put_emdgroup(label, None, dst.get_emddims(src), overwrite=overwrite, shape=shape,
+                           dtype=source.dtype, chunks=target_chunks, **kwargs)
+    if grp is None:
+        raise RuntimeError('Could not create "{}"'.format(label))
+    for key, value in src.attrs.items():
+        if key not in grp.attrs:
+            grp.attrs[key] = value
+    dest = grp['data']
+
+    # Grow whole target chunks along the axes with the largest source chunks first
+    order = sorted(range(len(shape)), key=lambda ii: (-source_chunks[ii] / target_chunks[ii], -ii))
+    unit = tuple(min(math.lcm(ss, tt), nn) for ss, tt, nn in zip(source_chunks, target_chunks, shape))
+    if itemsize * int(np.prod(unit, dtype=np.int64)) > max_mem:
+        unit = target_chunks
+    block = _blockShape(shape, unit, order, itemsize, max_mem)
+    aligned = all(bb == nn or bb % ss == 0 for bb, ss, nn in zip(block, source_chunks, shape))
+
+    # Partial reads of uncompressed chunks are cheap
+    if aligned or source.id.get_create_plist().get_nfilters() == 0:
+        _copyBlocks(source, dest, block)
+        return 1
+
+    # Two passes through an uncompressed contiguous temporary dataset
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as tmp:
+        with h5py.File(Path(tmp) / 'rechunk.h5', 'w') as ftmp:
+            temp = ftmp.create_dataset('data', shape=shape, dtype=source.dtype)
+            reverse = tuple(range(len(shape)))[::-1]
+            _copyBlocks(source, temp, _blockShape(shape, source_chunks, reverse, itemsize, max_mem))
+            _copyBlocks(temp, dest, _blockShape(shape, target_chunks, reverse, itemsize, max_mem))
+    return 2
+
+
 def defaultDims(data, pixel_size=None, pixel_unit=None):
     """ A helper function that can generate a properly setup dim tuple
     with default values to allow quick writing of EMD files without
@@ -649,7 +1796,7 @@ def emdReader(filename, dsetNum=0):
         return out
 
 
-def emdWriter(filename, data, pixel_size=None, pixel_unit=None, overwrite=False):
+def emdWriter(filename, data, pixel_size=None, pixel_unit=None, overwrite=False, **kwargs):
     """ Simple method to write data to a file formatted as an EMD v0.2. The only possible metadata to write is the pixel
     size for each dimension. Use the emd.fileEMD() class for more complex operations. The file must not already exist.
 
@@ -665,6 +1812,8 @@ def emdWriter(filename, data, pixel_size=None, pixel_unit=None, overwrite=False)
             A tuple of pixel units (i.e. nm), Must have the same length as the number of dimensions of data.
     overwrite : boolean
         If file exists, overwrite it.
+    **kwargs : various
+        Keyword arguments passed to fileEMD.put_emdgroup(), e.g. preset='image-stack' and compression='bitshuffle'.
     """
     if isinstance(filename, str):
         filename = Path(filename)
@@ -690,6 +1839,6 @@ def emdWriter(filename, data, pixel_size=None, pixel_unit=None, overwrite=False)
             # Setup the dims for the EMD file. Pixel size is set to 1 by default for each dimension
             dims0 = defaultDims(data, pixel_size=pixel_size, pixel_unit=pixel_unit)
             # Write the data to he emd file.
-            emd0.put_emdgroup('converted', data, dims0)
+            emd0.put_emdgroup('converted', data, dims0, **kwargs)
     else:
         raise FileExistsError
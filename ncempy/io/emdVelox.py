@@ -17,17 +17,22 @@ Advanced users and developers:
 """
 
 import json
+import copy
 import datetime
 from pathlib import Path
 import numpy as np
 import h5py
 
+from . import emd
+
 
 class fileEMDVelox:
     """ Class to represent Velox EMD files. It uses the h5py caching functionality
     to increase the default cache size from 1MB to 10MB. This significantly
     improves file reading for EMDVelox files which are written with Fortran-
-    style ordering and an inefficient choice of chunking.
+    style ordering and an inefficient choice of chunking. The cache can be set
+    with the chunk_cache keyword or for the access pattern of a dataset with
+    getDataset().
 
     Attributes
     ----------
@@ -37,7 +42,7 @@ class fileEMDVelox:
         The File handle from h5py.File.
     metaDataJSON : dict
         The full metadata for the most recently loaded data set. Note that you have to load a data set for this to be
-        populated or run parseMetaData(num).
+        populated or run parseMetaData(num). This is a copy of the cached metadata and can be modified.
     file_name : str
         The name of the file
     file_path : pathlib.Path
@@ -51,7 +56,7 @@ class fileEMDVelox:
     >>     im0, metadata0 = emd1.get_dataset(0)
     """
     
-    def __init__(self, filename):
+    def __init__(self, filename, chunk_cache=None):
         """ Init opening the file and finding all data groups. Currently only
         searches the /Data/Images group.
 
@@ -59,6 +64,10 @@ class fileEMDVelox:
         ----------
         filename : str or pathlib.Path
             The file path to load as a string or a pathlib.Path object.
+        chunk_cache : dict, optional
+            The HDF5 chunk cache of all datasets as rdcc_nbytes, rdcc_nslots
+            and rdcc_w0 (see h5py.File() and emd.chunkCache()). Default is a
+            10 MB cache.
 
         """
         
@@ -67,6 +76,7 @@ class fileEMDVelox:
         self.file_name = None
         self.file_path = None
         self.metaDataJSON = None
+        self._metadata = {}  # parsed JSON metadata by (group name, frame)
         self.list_data = None
         self.list_emds = None  # this will be identical to list_data
 
@@ -88,9 +98,12 @@ class fileEMDVelox:
             self.file_path = filename
             self.file_name = self.file_path.name
 
+        if chunk_cache is None:
+            chunk_cache = {'rdcc_nbytes': 10485760}  # rdcc_nbytes = 10*1024**2
+
         # try opening the file
         try:
-            self._file_hdl = h5py.File(filename, 'r', rdcc_nbytes=10485760)  # rdcc_nbytes = 10*1024**2
+            self._file_hdl = h5py.File(filename, 'r', **chunk_cache)
         except:
             print('Error opening file: "{}"'.format(filename))
             raise
@@ -149,14 +162,14 @@ class fileEMDVelox:
         
         self.list_emds = self.list_data  # make a copy to match the Berkeley EMD attribute
 
-    def get_dataset(self, group, memmap=False):
+    def get_dataset(self, group, memmap=False, access=None):
         """ Get the data from a group and the associated metadata.
 
         This is a convenience function and calls getDataset
         """
-        return self.getDataset(group, memmap=memmap)
+        return self.getDataset(group, memmap=memmap, access=access)
     
-    def getDataset(self, group, memmap=False):
+    def getDataset(self, group, memmap=False, access=None):
         """ Get the data from a group and the associated metadata.
 
         Parameters
@@ -169,6 +182,11 @@ class fileEMDVelox:
                 If False (default), then a numpy ndarray is returned. If True
                 the HDF5 data set object is returned and data is loaded from
                 disk as needed.
+            access: str, default = None
+                Return the data of a memmap as an emd.EmdDataset with a chunk
+                cache for this access pattern. One of 'frame' (one image after
+                the other), 'pixel' (one pixel of all images) or 'random'. The
+                EmdDataset also counts chunk cache hits and misses.
 
         Returns
         -------
@@ -186,24 +204,50 @@ class fileEMDVelox:
         if not isinstance(group, h5py.Group):
             raise TypeError('group needs to refer to a valid HDF5 group!')
 
-        if memmap:
+        if memmap and access is not None:
+            # the frames are along the last axis
+            data = emd.EmdDataset(group, 'Data', access=access, frame_axes=(0, 1))
+        elif memmap:
             data = group['Data']  # return the HDF5 dataset object
         else:
             data = np.squeeze(group['Data'][:])  # load the full data set
         metaData = self.parseMetaData(group)
         return data, metaData
     
-    def parseMetaData(self, group):
+    def parseMetaData(self, group, frame=0):
         """ Convenience function that calls _parseMetadata. 
         This function should not be directly used. Please use
         getMetadata instead."""
-        return self._parseMetadata(group)
+        return self._parseMetadata(group, frame)
+
+    def _metadataJSON(self, group, frame=0):
+        """ Load and parse the JSON metadata of one frame of a data group.
+        Only the column of this frame is read from the file. The parsed
+        metadata is cached so each frame is parsed only once. The returned
+        dictionary is the cached one and is not modified.
+
+        """
+        if frame < 0:
+            frame += group['Metadata'].shape[1]
+        key = (group.name, frame)
+        if key not in self._metadata:
+            metadata = group['Metadata']
+            if not 0 <= frame < metadata.shape[1]:
+                raise IndexError('Frame {} does not exist. The data set has {} frames.'.format(
+                                 frame, metadata.shape[1]))
+            tempMetaData = metadata[:, frame]
+            # Reduce to valid metadata
+            metaData = tempMetaData[tempMetaData > 0].tobytes()
+            # Interpret as UTF-8 encoded characters and load as JSON
+            self._metadata[key] = json.loads(metaData.decode('utf-8', 'ignore'))
+        return self._metadata[key]
     
-    def _parseMetadata(self, group):
+    def _parseMetadata(self, group, frame=0):
         """ Parse metadata in a data group. The EMDVelox data sets have
         extensive metadata stored as a JSON type string. This function 
         converts it to a dictionary. All converted metadata is stored in
-        the metadataJSON parameter.
+        the metadataJSON parameter. The JSON string of each group is parsed
+        only once and metadataJSON is a copy of the cached result.
         
         For historical reasons this also returns a dicitonary with some
         useful metadata.
@@ -216,6 +260,8 @@ class fileEMDVelox:
             The h5py group to load the metadata from which is easily retrived from the list_data attribute.
             If input is an int then the group corresponding to list_data attribute is used. The string 
             metadata is loaded and parsed by the json module into a dictionary.
+        frame : int, default = 0
+            The frame of a multi-frame data set to load the metadata of.
 
         Returns
         -------
@@ -230,12 +276,7 @@ class fileEMDVelox:
             raise IndexError('EMDVelox group #{} does not exist.'.format(group))
         
         md = {}
-        tempMetaData = group['Metadata'][:, 0]
-        # Reduce to valid metadata
-        validMetaDataIndex = np.where(tempMetaData > 0) 
-        metaData = tempMetaData[validMetaDataIndex].tobytes()
-        # Interpret as UTF-8 encoded characters and load as JSON
-        self.metaDataJSON = json.loads(metaData.decode('utf-8', 'ignore'))
+        self.metaDataJSON = copy.deepcopy(self._metadataJSON(group, frame))
         # Pull out basic meta data about the images
         md['pixelUnit'] = [self.metaDataJSON['BinaryResult']['PixelUnitX'],
                                self.metaDataJSON['BinaryResult']['PixelUnitY']]
@@ -263,7 +304,7 @@ class fileEMDVelox:
 
         return md
     
-    def getMetadata(self, group):
+    def getMetadata(self, group, frame=0):
         """ Reads important metadata from Velox EMD files.
 
         Parameters
@@ -272,8 +313,11 @@ class fileEMDVelox:
             The h5py group to load the metadata from which is easily retrived from the list_data attribute.
             If input is an int then the group corresponding to list_data attribute is used. The string 
             metadata is loaded and parsed by the json module into a dictionary.
+        frame : int, default = 0
+            The frame of a multi-frame data set to load the metadata of. Only the metadata of this
+            frame is loaded.
         """
-        self._parseMetadata(group)
+        self._parseMetadata(group, frame)
         keys_to_ignore = ('EnergyFilter', 'Vacuum', 'GasInjectionSystems', 'CustomProperties') 
         # note: CustomProperties handled separately below
         
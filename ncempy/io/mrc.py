@@ -18,6 +18,8 @@ from pathlib import Path
 
 import numpy as np
 
+from . import cache as header_cache
+
 
 class fileMRC:
     """ Read in the data in MRC format and other useful information like metadata. Follows the specification
@@ -73,7 +75,11 @@ class fileMRC:
     >>     single_slice = f1.getSlice(0)
     """
 
-    def __init__(self, filename, verbose=False):
+    # Attributes set by parseHeader which are saved in the header cache
+    _headerAttributes = ('mrcType', 'dataType', 'dataSize', 'gridSize', 'volumeSize', 'voxelSize', 'cellAngles',
+                         'axisOrientations', 'minMaxMean', 'extra', 'FEIinfo', 'dataOffset', 'dataOut')
+
+    def __init__(self, filename, verbose=False, cache=None):
         """
         Parameters
         -----------
@@ -81,10 +87,14 @@ class fileMRC:
                 String or pathlib.Path of file object pointing to the filesystem location of the file.
             verbose : bool
                 If True, debug information is printed.
+            cache : bool or None, optional
+                If True, the parsed header is loaded from and saved to the header cache.
+                None uses the global setting. See ncempy.io.cache.
 
         """
         # check filename type
         if hasattr(filename, 'read'):
+            cache = False  # only files opened by path can be cached
             self.fid = filename
             try:
                 self.file_path = Path(self.fid.name)
@@ -128,7 +138,18 @@ class fileMRC:
         # Add a top level variable to indicate verbose output for debugging
         self.v = verbose
 
-        self.parseHeader()
+        header = None
+        if header_cache.use_cache(cache):
+            header = header_cache.load(self.file_path, 'mrc')
+
+        if header is None:
+            self.parseHeader()
+            if header_cache.use_cache(cache):
+                header_cache.save(self.file_path, 'mrc',
+                                  {name: getattr(self, name) for name in self._headerAttributes})
+        else:
+            for name, value in header.items():
+                setattr(self, name, value)
 
     def __del__(self):
         """Close the file.
@@ -14,14 +14,60 @@ General users:
 Advanced users and developers:
     Access the file internals through the ser.fileSER() class.
 
+Multi-file series:
+    TIA splits long acquisitions into several files name_1.ser, name_2.ser, ...
+    with a shared name.emi file. Use ser.fileSERSeries() to access all data
+    elements of all files as one lazily loaded array.
+
 """
 
 import xml.etree.ElementTree as ET
 from pathlib import Path
 import os  # TODO: Remove os and use pathlib instead.
+import re
 
 import numpy as np
 
+from . import cache as header_cache
+
+
+# Packed structured dtypes for the fixed size parts of the file. The header and the offsets depend on the
+# SeriesVersion (0x0210 uses 32 bit offsets, 0x0220 uses 64 bit offsets).
+_HEADER_DTYPES = {version: np.dtype([('ByteOrder', '<i2'), ('SeriesID', '<i2'), ('SeriesVersion', '<i2'),
+                                     ('DataTypeID', '<i4'), ('TagTypeID', '<i4'), ('TotalNumberElements', '<i4'),
+                                     ('ValidNumberElements', '<i4'), ('OffsetArrayOffset', offset_dtype),
+                                     ('NumberDimensions', '<i4')])
+                  for version, offset_dtype in ((0x0210, '<i4'), (0x0220, '<i8'))}
+_OFFSET_DTYPES = {0x0210: np.dtype('<i4'), 0x0220: np.dtype('<i8')}
+
+# The fixed part of a dimension record followed by the description and another length and the units
+_DIMENSION_DTYPE = np.dtype([('DimensionSize', '<i4'), ('CalibrationOffset', '<f8'), ('CalibrationDelta', '<f8'),
+                             ('CalibrationElement', '<i4'), ('DescriptionLength', '<i4')])
+
+# The preamble of each data element (calibrations, data type and shape) keyed by DataTypeID
+_CALIBRATION_DTYPE = np.dtype([('CalibrationOffset', '<f8'), ('CalibrationDelta', '<f8'),
+                               ('CalibrationElement', '<i4')])
+_ELEMENT_DTYPES = {0x4120: np.dtype([('Calibration', _CALIBRATION_DTYPE, (1,)), ('DataType', '<i2'),
+                                     ('ArrayShape', '<i4', (1,))]),
+                   0x4122: np.dtype([('Calibration', _CALIBRATION_DTYPE, (2,)), ('DataType', '<i2'),
+                                     ('ArrayShape', '<i4', (2,))])}
+
+# Tags of each data element keyed by TagTypeID
+_TAG_DTYPES = {0x4152: np.dtype([('TagTypeID', '<i4'), ('Time', '<i4')]),
+               0x4142: np.dtype([('TagTypeID', '<i4'), ('Time', '<i4'), ('PositionX', '<f8'), ('PositionY', '<f8')])}
+
+
+def _recordDtype(element_dtype, dtype, element_shape, itemsize):
+    """ A structured dtype for a complete data element (preamble and data) stored with a stride of itemsize bytes.
+
+    """
+    return np.dtype({'names': list(element_dtype.names) + ['data'],
+                     'formats': [element_dtype.fields[name][0] for name in element_dtype.names] +
+                                [(dtype, element_shape)],
+                     'offsets': [element_dtype.fields[name][1] for name in element_dtype.names] +
+                                [element_dtype.itemsize],
+                     'itemsize': itemsize})
+
 
 class NotSERError(Exception):
     """Exception if a file is not in SER file format.
@@ -85,7 +131,7 @@ class fileSER:
                      10: '<c16'}
     '''dict : Information on data format.'''
 
-    def __init__(self, filename, verbose=False):
+    def __init__(self, filename, verbose=False, cache=None):
         """Init opening the file and reading in the header.
 
         Parameters
@@ -96,6 +142,10 @@ class fileSER:
             verbose : bool, optional
                 True to get extensive output while reading the file.
 
+            cache : bool or None, optional
+                If True, the parsed header and EMI metadata are loaded from and saved to the header
+                cache. None uses the global setting. See ncempy.io.cache.
+
         """
         # necessary declarations, if something fails
         self._file_hdl = None
@@ -103,8 +153,10 @@ class fileSER:
         self.file_name = None
         self.file_path = None
         self.head = None
+        self._element_nbytes = 0  # size of the last data element read by getDataset
 
         if hasattr(filename, 'read'):
+            cache = False  # only files opened by path can be cached
             self._file_hdl = filename
             try:
                 self.file_path = Path(filename.name)
@@ -132,11 +184,23 @@ class fileSER:
             except:
                 raise
 
-        # read header
-        self.head = self.readHeader(verbose)
+        header = None
+        if header_cache.use_cache(cache):
+            header = header_cache.load(self.file_path, 'ser', depends=(self._emiPath(),))
 
-        # read emi file if exists
-        self._read_emi()
+        if header is None:
+            # read header
+            self.head = self.readHeader(verbose)
+
+            # read emi file if exists
+            self._read_emi()
+
+            if header_cache.use_cache(cache):
+                header_cache.save(self.file_path, 'ser', {'head': self.head, 'emi': self._emi},
+                                  depends=(self._emiPath(),))
+        else:
+            self.head = header['head']
+            self._emi = header['emi']
 
     def __del__(self):
         """ Close the file stream in destructor.
@@ -180,11 +244,13 @@ class fileSER:
         # prepare empty dict to be populated while reading
         head = {}
 
-        # go back to beginning of file
+        # go back to beginning of file and read the header in one go
         self._file_hdl.seek(0, 0)
+        buf = self._file_hdl.read(_HEADER_DTYPES[0x0220].itemsize)
+        if len(buf) < _HEADER_DTYPES[0x0210].itemsize:
+            raise NotSERError('This is not a TIA Series Data File (SER)')
 
-        # read 3 int16
-        data = np.fromfile(self._file_hdl, dtype='<i2', count=3)
+        data = np.frombuffer(buf, dtype='<i2', count=3)
 
         # ByteOrder (only little Endian expected)
         if not data[0] in self._dictByteOrder:
@@ -206,128 +272,116 @@ class fileSER:
         head['SeriesVersion'] = data[2]
         if verbose:
             print('SeriesVersion:\t"{:#06x}",\t{}'.format(data[2], self._dictSeriesVersion[data[2]]))
-        # version dependent file format for below
-        if head['SeriesVersion'] == 0x0210:
-            offset_dtype = '<i4'
-        else:
-            # head['SeriesVersion']==0x220:
-            offset_dtype = '<i8'
 
-        # read 4 int32
-        data = np.fromfile(self._file_hdl, dtype='<i4', count=4)
+        # version dependent file format for below
+        header_dtype = _HEADER_DTYPES[int(head['SeriesVersion'])]
+        offset_dtype = _OFFSET_DTYPES[int(head['SeriesVersion'])]
+        data = np.frombuffer(buf, dtype=header_dtype, count=1)[0]
 
         # DataTypeID
-        if not data[0] in self._dictDataTypeID:
-            raise RuntimeError('Unknown DataTypeID: "{:#06x}"'.format(data[0]))
-        head['DataTypeID'] = data[0]
+        if not data['DataTypeID'] in self._dictDataTypeID:
+            raise RuntimeError('Unknown DataTypeID: "{:#06x}"'.format(data['DataTypeID']))
+        head['DataTypeID'] = data['DataTypeID']
         if verbose:
-            print('DataTypeID:\t"{:#06x}",\t{}'.format(data[0], self._dictDataTypeID[data[0]]))
+            print('DataTypeID:\t"{:#06x}",\t{}'.format(data['DataTypeID'], self._dictDataTypeID[data['DataTypeID']]))
 
         # TagTypeID
-        if not data[1] in self._dictTagTypeID:
-            raise RuntimeError('Unknown TagTypeID: "{:#06x}"'.format(data[1]))
-        head['TagTypeID'] = data[1]
+        if not data['TagTypeID'] in self._dictTagTypeID:
+            raise RuntimeError('Unknown TagTypeID: "{:#06x}"'.format(data['TagTypeID']))
+        head['TagTypeID'] = data['TagTypeID']
         if verbose:
-            print('TagTypeID:\t"{:#06x}",\t{}'.format(data[1], self._dictTagTypeID[data[1]]))
+            print('TagTypeID:\t"{:#06x}",\t{}'.format(data['TagTypeID'], self._dictTagTypeID[data['TagTypeID']]))
 
         # TotalNumberElements
-        if not data[2] >= 0:
-            raise RuntimeError('Negative total number of elements: {}'.format(data[2]))
-        head['TotalNumberElements'] = data[2]
+        if not data['TotalNumberElements'] >= 0:
+            raise RuntimeError('Negative total number of elements: {}'.format(data['TotalNumberElements']))
+        head['TotalNumberElements'] = data['TotalNumberElements']
         if verbose:
-            print('TotalNumberElements:\t{}'.format(data[2]))
+            print('TotalNumberElements:\t{}'.format(data['TotalNumberElements']))
 
         # ValidNumberElements
-        if not data[3] >= 0:
-            raise RuntimeError('Negative valid number of elements: {}'.format(data[3]))
-        head['ValidNumberElements'] = data[3]
+        if not data['ValidNumberElements'] >= 0:
+            raise RuntimeError('Negative valid number of elements: {}'.format(data['ValidNumberElements']))
+        head['ValidNumberElements'] = data['ValidNumberElements']
         if verbose:
-            print('ValidNumberElements:\t{}'.format(data[3]))
+            print('ValidNumberElements:\t{}'.format(data['ValidNumberElements']))
 
         # OffsetArrayOffset, sensitive to SeriesVersion
-        data = np.fromfile(self._file_hdl, dtype=offset_dtype, count=1)
-        head['OffsetArrayOffset'] = data[0]
+        head['OffsetArrayOffset'] = data['OffsetArrayOffset']
         if verbose:
-            print('OffsetArrayOffset:\t{}'.format(data[0]))
+            print('OffsetArrayOffset:\t{}'.format(data['OffsetArrayOffset']))
 
         # NumberDimensions
-        data = np.fromfile(self._file_hdl, dtype='<i4', count=1)
-        if not data[0] >= 0:
+        if not data['NumberDimensions'] >= 0:
             raise RuntimeError('Negative number of dimensions')
-        head['NumberDimensions'] = data[0]
+        head['NumberDimensions'] = data['NumberDimensions']
         if verbose:
-            print('NumberDimensions:\t{}'.format(data[0]))
+            print('NumberDimensions:\t{}'.format(data['NumberDimensions']))
+
+        # Dimensions array. The records have variable length due to the description and units strings. Read
+        # a block that usually holds all of them and extend it if needed.
+        self._file_hdl.seek(header_dtype.itemsize, 0)
+        buf = self._file_hdl.read(1024 * max(1, int(head['NumberDimensions'])))
+        pos = 0
+
+        def _extend(needed):
+            nonlocal buf
+            if pos + needed > len(buf):
+                buf += self._file_hdl.read(pos + needed - len(buf))
+                if pos + needed > len(buf):
+                    raise RuntimeError('Dimension array extends beyond the end of the file')
 
-        # Dimensions array
         dimensions = []
         for i in range(head['NumberDimensions']):
             if verbose:
                 print('reading Dimension {}'.format(i))
             this_dim = {}
 
-            # DimensionSize
-            data = np.fromfile(self._file_hdl, dtype='<i4', count=1)
-            this_dim['DimensionSize'] = data[0]
-            if verbose:
-                print('DimensionSize:\t{}'.format(data[0]))
-
-            data = np.fromfile(self._file_hdl, dtype='<f8', count=2)
-
-            # CalibrationOffset
-            this_dim['CalibrationOffset'] = data[0]
-            if verbose:
-                print('CalibrationOffset:\t{}'.format(data[0]))
-
-            # CalibrationDelta
-            this_dim['CalibrationDelta'] = data[1]
-            if verbose:
-                print('CalibrationDelta:\t{}'.format(data[1]))
-
-            data = np.fromfile(self._file_hdl, dtype='<i4', count=2)
+            _extend(_DIMENSION_DTYPE.itemsize)
+            data = np.frombuffer(buf, dtype=_DIMENSION_DTYPE, count=1, offset=pos)[0]
+            pos += _DIMENSION_DTYPE.itemsize
 
-            # CalibrationElement
-            this_dim['CalibrationElement'] = data[0]
-            if verbose:
-                print('CalibrationElement:\t{}'.format(data[0]))
-
-            # DescriptionLength
-            n = data[1]
+            for key in ('DimensionSize', 'CalibrationOffset', 'CalibrationDelta', 'CalibrationElement'):
+                this_dim[key] = data[key]
+                if verbose:
+                    print('{}:\t{}'.format(key, data[key]))
 
             # Description
-            data = np.fromfile(self._file_hdl, dtype='<i1', count=n)
-            data = ''.join(map(chr, data))
-            this_dim['Description'] = data
+            n = int(data['DescriptionLength'])
+            _extend(n + 4)
+            this_dim['Description'] = buf[pos:pos + n].decode('latin-1')
+            pos += n
             if verbose:
-                print('Description:\t{}'.format(data))
-
-            # UnitsLength
-            data = np.fromfile(self._file_hdl, dtype='<i4', count=1)
-            n = data[0]
+                print('Description:\t{}'.format(this_dim['Description']))
 
             # Units
-            data = np.fromfile(self._file_hdl, dtype='<i1', count=n)
-            data = ''.join(map(chr, data))
-            this_dim['Units'] = data
+            n = int(np.frombuffer(buf, dtype='<i4', count=1, offset=pos)[0])
+            pos += 4
+            _extend(n)
+            this_dim['Units'] = buf[pos:pos + n].decode('latin-1')
+            pos += n
             if verbose:
-                print('Units:\t{}'.format(data))
+                print('Units:\t{}'.format(this_dim['Units']))
 
             dimensions.append(this_dim)
 
         # save dimensions array as tuple of dicts in head dict
         head['Dimensions'] = tuple(dimensions)
 
-        # Offset array
+        # Offset array. The DataOffsetArray and TagOffsetArray are stored after each other.
         self._file_hdl.seek(head['OffsetArrayOffset'], 0)
+        count = int(head['ValidNumberElements'])
+        data = np.fromfile(self._file_hdl, dtype=offset_dtype, count=2 * count)
+        if len(data) != 2 * count:
+            raise RuntimeError('Offset arrays extend beyond the end of the file')
 
         # DataOffsetArray
-        data = np.fromfile(self._file_hdl, dtype=offset_dtype, count=head['ValidNumberElements'])
-        head['DataOffsetArray'] = data.tolist()
+        head['DataOffsetArray'] = data[:count].tolist()
         if verbose:
             print('reading in DataOffsetArray')
 
         # TagOffsetArray
-        data = np.fromfile(self._file_hdl, dtype=offset_dtype, count=head['ValidNumberElements'])
-        head['TagOffsetArray'] = data.tolist()
+        head['TagOffsetArray'] = data[count:].tolist()
         if verbose:
             print('reading in TagOffsetArray')
 
@@ -382,94 +436,244 @@ class fileSER:
         if verbose:
             print('Getting dataset {} of {}.'.format(index, self.head['ValidNumberElements']))
 
-        # go to dataset in file
+        # number of calibrations depends on DataTypeID
+        try:
+            element_dtype = _ELEMENT_DTYPES[int(self.head['DataTypeID'])]
+        except KeyError:
+            raise RuntimeError('Unknown DataTypeID')
+
+        # go to dataset in file and read the preamble and data in one go. The size of the previous
+        # element is used as a guess for the size of this element.
         self._file_hdl.seek(self.head['DataOffsetArray'][index], 0)
+        buf = bytearray(max(self._element_nbytes, element_dtype.itemsize))
+        nread = self._file_hdl.readinto(buf)
+        if nread < element_dtype.itemsize:
+            raise RuntimeError('Data element {} extends beyond the end of the file'.format(index))
+
+        pre = np.frombuffer(buf, dtype=element_dtype, count=1)[0]
 
         # read meta
         meta = {}
 
-        # number of calibrations depends on DataTypeID
-        if self.head['DataTypeID'] == 0x4120:
-            n = 1
-        elif self.head['DataTypeID'] == 0x4122:
-            n = 2
-        else:
-            raise RuntimeError('Unknown DataTypeID')
-
-        # read in the calibrations    
+        # read in the calibrations
         cals = []
-        for i in range(n):
+        for i, cal in enumerate(pre['Calibration']):
             if verbose:
                 print('Reading calibration {}'.format(i))
 
             this_cal = {}
+            for key in ('CalibrationOffset', 'CalibrationDelta', 'CalibrationElement'):
+                this_cal[key] = cal[key]
+                if verbose:
+                    print('{}:\t{}'.format(key, cal[key]))
 
-            data = np.fromfile(self._file_hdl, dtype='<f8', count=2)
+            cals.append(this_cal)
 
-            # CalibrationOffset
-            this_cal['CalibrationOffset'] = data[0]
-            if verbose:
-                print('CalibrationOffset:\t{}'.format(data[0]))
+        meta['Calibration'] = tuple(cals)
 
-            # CalibrationDelta
-            this_cal['CalibrationDelta'] = data[1]
-            if verbose:
-                print('CalibrationDelta:\t{}'.format(data[1]))
+        # DataType
+        meta['DataType'] = pre['DataType']
 
-            data = np.fromfile(self._file_hdl, dtype='<i4', count=1)
+        if not meta['DataType'] in self._dictDataType:
+            raise RuntimeError('Unknown DataType: "{}"'.format(meta['DataType']))
+        if verbose:
+            print('DataType:\t{},\t{}'.format(meta['DataType'], self._dictDataType[meta['DataType']]))
 
-            # CalibrationElement
-            this_cal['CalibrationElement'] = data[0]
-            if verbose:
-                print('CalibrationElement:\t{}'.format(data[0]))
+        # ArrayShape
+        meta['ArrayShape'] = pre['ArrayShape'].tolist()
+        if verbose:
+            print('ArrayShape:\t{}'.format(meta['ArrayShape']))
+
+        # read the rest of the data if the guess was too small
+        dtype = np.dtype(self._dictDataType[meta['DataType']])
+        count = int(np.prod(meta['ArrayShape']))
+        nbytes = element_dtype.itemsize + count * dtype.itemsize
+        if nread < nbytes:
+            if len(buf) < nbytes:
+                grown = bytearray(nbytes)
+                grown[:nread] = buf[:nread]
+                buf = grown
+            nread += self._file_hdl.readinto(memoryview(buf)[nread:nbytes])
+            if nread < nbytes:
+                raise RuntimeError('Data element {} extends beyond the end of the file'.format(index))
+        self._element_nbytes = nbytes
+
+        dataset = np.frombuffer(buf, dtype=dtype, count=count, offset=element_dtype.itemsize)
 
-            cals.append(this_cal)
+        if self.head['DataTypeID'] == 0x4122:
+            # 2D data element
+            dataset = dataset.reshape(meta['ArrayShape'][::-1])  # needs to be reversed for little endian data
 
-        meta['Calibration'] = tuple(cals)
+            dataset = np.flipud(dataset)
 
-        data = np.fromfile(self._file_hdl, dtype='<i2', count=1)
+        return dataset, meta
 
-        # DataType
-        meta['DataType'] = data[0]
+    def getMemmap(self):
+        """Get a read-only array with lazy access to all data elements in the file. Nothing is read until the
+        array is indexed. Spectra are returned with shape [scanJ, scanI, E] for spectrum images (or [N, E]) and
+        images with shape [N, Y, X]. Images are flipped as in getDataset().
 
-        if not data[0] in self._dictDataType:
-            raise RuntimeError('Unknown DataType: "{}"'.format(data[0]))
-        if verbose:
-            print('DataType:\t{},\t{}'.format(data[0], self._dictDataType[data[0]]))
+        If the data elements are stored with a uniform stride (as in nearly all files) a numpy.memmap of the
+        file with a structured dtype is used. The preamble of each element is skipped by a view. Otherwise a
+        SERGatherArray is returned which reads the requested elements one by one.
 
-        dataset = None  # in case something goes wrong
+        Returns
+        -------
+            : numpy.memmap or SERGatherArray
+                A read-only array with access to the data of all elements.
+        """
+        num = int(self.head['ValidNumberElements'])
+        if num == 0:
+            raise IndexError('No data elements found in file.')
+
+        # The first data element determines the layout
+        _, meta = self.getDataset(0)
+        element_dtype = _ELEMENT_DTYPES[int(self.head['DataTypeID'])]
+        dtype = np.dtype(self._dictDataType[meta['DataType']])
+        element_shape = tuple(meta['ArrayShape'][::-1])  # needs to be reversed for little endian data
+        nbytes = element_dtype.itemsize + int(np.prod(element_shape)) * dtype.itemsize
+
+        # Shape of the series
+        if self.head['DataTypeID'] == 0x4120 and self.head['NumberDimensions'] > 1:
+            scanI = int(self.head['Dimensions'][0]['DimensionSize'])
+            scanJ = int(self.head['Dimensions'][1]['DimensionSize'])
+            series_shape = (scanJ, scanI) if scanI * scanJ == num else (num,)
+        else:
+            series_shape = (num,)
 
-        if self.head['DataTypeID'] == 0x4120:
-            # 1D data element
+        offsets = np.asarray(self.head['DataOffsetArray'], dtype=np.int64)
+        stride = int(offsets[1] - offsets[0]) if num > 1 else nbytes
+        uniform = stride >= nbytes and np.all(np.diff(offsets) == stride)
 
-            data = np.fromfile(self._file_hdl, dtype='<i4', count=1)
-            # ArrayLength
-            data = data.tolist()
-            meta['ArrayShape'] = data
-            if verbose:
-                print('ArrayShape:\t{}'.format(data))
+        if not uniform or self.file_path is None or not hasattr(self._file_hdl, 'fileno'):
+            return SERGatherArray(self, series_shape, element_shape, dtype)
 
-            dataset = np.fromfile(self._file_hdl, dtype=self._dictDataType[meta['DataType']],
-                                  count=meta['ArrayShape'][0])
+        # Structured dtype with the preamble fields used for checking and the data
+        record_dtype = _recordDtype(element_dtype, dtype, element_shape, stride)
+        if offsets[0] + stride * num > os.fstat(self._file_hdl.fileno()).st_size:
+            return SERGatherArray(self, series_shape, element_shape, dtype)
+        mm = np.memmap(self.file_path, dtype=record_dtype, mode='r', offset=int(offsets[0]), shape=(num,))
 
-        elif self.head['DataTypeID'] == 0x4122:
-            # 2D data element
+        # All elements need the same data type and shape
+        if not (np.all(mm['DataType'] == meta['DataType']) and
+                np.all(mm['ArrayShape'] == np.asarray(meta['ArrayShape']))):
+            raise RuntimeError('Data elements with different data types or shapes are not supported.')
 
-            data = np.fromfile(self._file_hdl, dtype='<i4', count=2)
-            # ArrayShape
-            data = data.tolist()
-            meta['ArrayShape'] = data
-            if verbose:
-                print('ArrayShape:\t{}'.format(data))
+        data = mm['data']
+        if self.head['DataTypeID'] == 0x4122:
+            data = data[:, ::-1, :]  # flipud for each image
+        return data.reshape(series_shape + element_shape)
 
-            # dataset
-            dataset = np.fromfile(self._file_hdl, dtype=self._dictDataType[meta['DataType']],
-                                  count=meta['ArrayShape'][0] * meta['ArrayShape'][1])
-            dataset = dataset.reshape(meta['ArrayShape'][::-1])  # needs to be reversed for little endian data
+    def iter_datasets(self, batch=1, out=None, start=0, stop=None):
+        """ Iterate over the data elements in batches. The elements of each batch are copied into a
+        preallocated buffer which is reused for all batches. Contiguous elements with a uniform stride
+        are read with one read per batch.
 
-            dataset = np.flipud(dataset)
+        The meta data (calibrations, etc.) is only returned for the first batch and when the calibration
+        changes. A batch never contains elements with different calibrations. All elements need to have
+        the same data type and shape.
 
-        return dataset, meta
+        Parameters
+        ----------
+            batch: int, optional
+                The maximum number of elements per batch.
+            out: np.ndarray, optional
+                The buffer to store the batches in with shape [batch, ...] and the data type of the data.
+                A new buffer is allocated if None.
+            start: int, optional
+                The index of the first element.
+            stop: int, optional
+                The index after the last element. Default is all valid elements.
+
+        Yields
+        ------
+            : tuple, 2 elements in form (data, metadata)
+                data is a view of the first elements of the buffer with shape [n, ...]. It is overwritten
+                by the next batch. metadata is a dict as in getDataset() or None if the calibration is the
+                same as for the previous batch.
+
+        Examples
+        --------
+        Calculate the sum of each image with a constant amount of memory
+        >> with fileSER('filename_1.ser') as ser1:
+        >>     sums = [data.sum(axis=(1, 2)) for data, _ in ser1.iter_datasets(batch=64)]
+
+        """
+        num = int(self.head['ValidNumberElements'])
+        if stop is None:
+            stop = num
+        if not 0 <= start <= stop <= num:
+            raise IndexError('Element range [{}, {}) out of range [0, {}).'.format(start, stop, num))
+        if batch < 1:
+            raise ValueError('batch must be at least 1.')
+        if start == stop:
+            return
+
+        # The first data element determines the layout
+        _, meta = self.getDataset(start)
+        element_dtype = _ELEMENT_DTYPES[int(self.head['DataTypeID'])]
+        dtype = np.dtype(self._dictDataType[meta['DataType']])
+        element_shape = tuple(meta['ArrayShape'][::-1])  # needs to be reversed for little endian data
+        nbytes = element_dtype.itemsize + int(np.prod(element_shape)) * dtype.itemsize
+
+        if out is None:
+            out = np.empty((batch,) + element_shape, dtype=dtype)
+        elif out.shape[1:] != element_shape or out.dtype != dtype or out.shape[0] < batch:
+            raise ValueError('out needs a shape of {} and data type {}.'.format((batch,) + element_shape, dtype))
+
+        # Read whole batches at once if the elements are stored with a uniform stride
+        offsets = np.asarray(self.head['DataOffsetArray'][start:stop], dtype=np.int64)
+        stride = int(offsets[1] - offsets[0]) if len(offsets) > 1 else nbytes
+        uniform = stride >= nbytes and np.all(np.diff(offsets) == stride)
+        if not uniform:
+            stride = nbytes
+        record_dtype = _recordDtype(element_dtype, dtype, element_shape, stride)
+        scratch = bytearray(batch * stride)
+
+        calibration = None
+        ii = 0
+        while ii < len(offsets):
+            nn = min(batch, len(offsets) - ii)
+
+            # read the preambles and data of the batch into the scratch buffer
+            if uniform:
+                self._file_hdl.seek(offsets[ii], 0)
+                size = (nn - 1) * stride + nbytes
+                nread = self._file_hdl.readinto(memoryview(scratch)[:size])
+            else:
+                size = nn * nbytes
+                nread = 0
+                for kk in range(nn):
+                    self._file_hdl.seek(offsets[ii + kk], 0)
+                    nread += self._file_hdl.readinto(memoryview(scratch)[kk * nbytes:(kk + 1) * nbytes])
+            if nread < size:
+                raise RuntimeError('Data element extends beyond the end of the file')
+            records = np.ndarray((nn,), dtype=record_dtype, buffer=scratch)
+
+            if not (np.all(records['DataType'] == meta['DataType']) and
+                    np.all(records['ArrayShape'] == np.asarray(meta['ArrayShape']))):
+                raise RuntimeError('Data elements with different data types or shapes are not supported.')
+
+            # end the batch before the next change of the calibration. The first element always starts the
+            # batch (a NaN calibration differs from itself).
+            changed = np.nonzero(np.any(records['Calibration'][1:] != records['Calibration'][:1], axis=1))[0]
+            if len(changed) > 0:
+                nn = int(changed[0]) + 1
+
+            this_meta = None
+            if calibration is None or np.any(records['Calibration'][0] != calibration):
+                calibration = records['Calibration'][0].copy()
+                this_meta = {'Calibration': tuple({key: cal[key] for key in cal.dtype.names} for cal in calibration),
+                             'DataType': records['DataType'][0],
+                             'ArrayShape': records['ArrayShape'][0].tolist()}
+
+            data = records['data'][:nn]
+            if self.head['DataTypeID'] == 0x4122:
+                data = data[:, ::-1, :]  # flipud for each image
+            np.copyto(out[:nn], data)
+
+            yield out[:nn], this_meta
+            ii += nn
 
     def getMetadata(self):
         """Retrieve meta data on experimental parmaeters and settings from
@@ -566,6 +770,65 @@ class fileSER:
 
         return tag
 
+    def getTags(self):
+        """Read the tags of all data elements at once. This is much faster than reading each tag
+        with _getTag() for files with many elements (i.e. spectrum images).
+
+        Tags with an offset outside of the file or a TagTypeID different from the header are invalid
+        (bad TagOffsetArrays occur in some files). Their Time is 0 and their positions are NaN as in _getTag().
+
+        Returns
+        -------
+            tags : dict
+                The tags as arrays with one value per data element. The keys are 'Time', 'PositionX' and
+                'PositionY' and 'valid' which is a boolean mask of the valid tags. Positions are NaN for files
+                with time only tags.
+
+        """
+        num = int(self.head['ValidNumberElements'])
+        tag_dtype = _TAG_DTYPES[int(self.head['TagTypeID'])]
+        offsets = np.asarray(self.head['TagOffsetArray'], dtype=np.int64)
+
+        # Access the file as bytes without reading it
+        if self.file_path is not None and hasattr(self._file_hdl, 'fileno'):
+            buf = np.memmap(self.file_path, dtype=np.uint8, mode='r')
+        else:
+            self._file_hdl.seek(0, 0)
+            buf = np.frombuffer(self._file_hdl.read(), dtype=np.uint8)
+
+        inside = (offsets >= 0) & (offsets + tag_dtype.itemsize <= buf.size)
+        stride = int(offsets[1] - offsets[0]) if num > 1 else tag_dtype.itemsize
+        if num > 0 and np.all(inside) and stride >= tag_dtype.itemsize and np.all(np.diff(offsets) == stride):
+            # Regular offsets. View all tags with a strided structured dtype.
+            strided = np.dtype({'names': tag_dtype.names,
+                                'formats': [tag_dtype.fields[name][0] for name in tag_dtype.names],
+                                'offsets': [tag_dtype.fields[name][1] for name in tag_dtype.names],
+                                'itemsize': stride})
+            if int(offsets[0]) + stride * num <= buf.size:
+                records = np.ndarray((num,), dtype=strided, buffer=buf, offset=int(offsets[0]))
+            else:
+                # Data and tags are interleaved and the file ends less than one stride after the last tag
+                first = buf[int(offsets[0]):int(offsets[0]) + tag_dtype.itemsize].view(tag_dtype)
+                records = np.lib.stride_tricks.as_strided(first, shape=(num,), strides=(stride,), writeable=False)
+        else:
+            # Gather the bytes of all tags inside the file
+            records = np.zeros((num,), dtype=tag_dtype)
+            index = offsets[inside, None] + np.arange(tag_dtype.itemsize)
+            records[inside] = buf[index].view(tag_dtype)[:, 0]
+
+        valid = inside & (records['TagTypeID'] == self.head['TagTypeID'])
+
+        tags = {'Time': np.where(valid, records['Time'], 0)}
+        for name in ('PositionX', 'PositionY'):
+            if name in tag_dtype.names:
+                tags[name] = np.where(valid, records[name], np.nan)
+            else:
+                tags[name] = np.full(num, np.nan)
+        tags['valid'] = valid
+
+        del records, buf  # close the memmap
+        return tags
+
     def _createDim(self, size, offset, delta, element):
         """Create dimension labels for conversion to EMD
         from information in the SER file.
@@ -603,61 +866,110 @@ class fileSER:
 
         return dim
 
+    def _emiPath(self):
+        """ The path of the emi file belonging to this SER file."""
+        return self.file_path.parent / (self.file_path.stem[:-2] + '.emi')
+
     def _read_emi(self):
         """ Generate emi file string and test for file existence."""
 
-        emi_file_path = self.file_path.parent / (self.file_path.stem[:-2] + '.emi')
+        emi_file_path = self._emiPath()
         if not emi_file_path.exists():
             self._emi = None
         else:
             self._emi = read_emi(emi_file_path)
 
-    def writeEMD(self, filename):
+    def writeEMD(self, filename, chunks=None, compression=None, block_size=2 ** 26, progress=None, **kwargs):
         """ Write SER data to an EMD file.
 
+        The data elements are copied in blocks of rows (spectrum images and image maps) or elements (series)
+        with one write per block. Positions of mapped data are checked against the scan calibration and the
+        time stamps are written as an additional dataset or dim vector.
+
         Parameters
         ----------
             filename: str or pathlib.Path
-                Name of the EMD file.
+                Name of the EMD file. The file is created if it does not exist.
+            chunks: tuple or bool or None, optional
+                The HDF5 chunk shape. None chooses chunks of whole data elements of about 1 MB.
+                True lets h5py choose the chunks.
+            compression: str or None, optional
+                The compression method. See emd.compressionOptions() for available methods.
+            block_size: int, optional
+                The approximate number of bytes of data copied per write. Default is 64 MB.
+            progress: callable, optional
+                Called as progress(done, total) with the number of data elements written after each block.
+            **kwargs: various
+                Keyword arguments passed to h5py.create_dataset().
 
         """
-        # Todo: Update this to be much simpler. Can write this in a couple of lines now using the fileEMD class
         from ncempy.io import emd
 
         # create the EMD file and set version attributes
         try:
-            f = emd.fileEMD(filename)
+            f = emd.fileEMD(filename, readonly=False)
         except:
             raise IOError('Cannot write to file "{}"!'.format(filename))
 
-        # create EMD group    
-        grp = f.file_hdl['data'].create_group(os.path.basename(self._file_hdl.name))
-        grp.attrs['emd_group_type'] = 1
-
-        # use first dataset to layout memory
-        data, first_meta = self.getDataset(0)
-        first_tag = self._getTag(0)
+        with f:
+            # create EMD group
+            grp = f.file_hdl['data'].create_group(os.path.basename(self._file_hdl.name))
+            grp.attrs['emd_group_type'] = 1
+
+            # use first dataset to layout memory
+            data, first_meta = self.getDataset(0)
+            num = int(self.head['ValidNumberElements'])
+            tags = self.getTags()
+            mapping = self.head['TagTypeID'] == 0x4142 and tags['valid'][0]
+
+            # all data elements as [N, ...]
+            src = self.getMemmap()
+            element_shape = data.shape
+            if isinstance(src, np.ndarray):
+                src = src.reshape((num,) + element_shape)
+            else:
+                src = SERGatherArray(self, (num,), element_shape, src.dtype)
+
+            if self.head['DataTypeID'] == 0x4122:
+                # 2D datasets
+                self.head['ExperimentType'] = 'image'  # text indicator of the experiment type
+                element_dims = []
+                dim = self._createDim(first_meta['ArrayShape'][1],
+                                      first_meta['Calibration'][1]['CalibrationOffset'],
+                                      first_meta['Calibration'][1]['CalibrationDelta'],
+                                      first_meta['Calibration'][1]['CalibrationElement'])
+                element_dims.append((dim, 'y', '[m]'))
+                dim = self._createDim(first_meta['ArrayShape'][0],
+                                      first_meta['Calibration'][0]['CalibrationOffset'],
+                                      first_meta['Calibration'][0]['CalibrationDelta'],
+                                      first_meta['Calibration'][0]['CalibrationElement'])
+                element_dims.append((dim, 'x', '[m]'))
+            elif self.head['DataTypeID'] == 0x4120:
+                # 1D datasets; spectra
+                self.head['ExperimentType'] = 'spectrum'  # text indicator of the experiment type
+                dim = self._createDim(first_meta['ArrayShape'][0],
+                                      first_meta['Calibration'][0]['CalibrationOffset'],
+                                      first_meta['Calibration'][0]['CalibrationDelta'],
+                                      first_meta['Calibration'][0]['CalibrationElement'])
+                element_dims = [(dim, 'E', '[m_eV]')]
+            else:
+                raise RuntimeError('Unknown DataTypeID')
 
-        if self.head['DataTypeID'] == 0x4122:
-            # 2D datasets
-            self.head['ExperimentType'] = 'image'  # text indicator of the experiment type
-            if first_tag['TagTypeID'] == 0x4142:
+            if mapping:
                 # 2D mapping
-                dset = grp.create_dataset('data', (self.head['Dimensions'][1]['DimensionSize'],
-                                                   self.head['Dimensions'][0]['DimensionSize'],
-                                                   first_meta['ArrayShape'][1], first_meta['ArrayShape'][0]),
-                                          dtype=self._dictDataType[first_meta['DataType']])
-
-                # collect time
-                time = np.zeros((self.head['Dimensions'][0]['DimensionSize'],
-                                 self.head['Dimensions'][1]['DimensionSize']), dtype='i4')
+                scanI = int(self.head['Dimensions'][0]['DimensionSize'])
+                scanJ = int(self.head['Dimensions'][1]['DimensionSize'])
+                if scanI * scanJ != num:
+                    raise RuntimeError('The number of data elements ({}) does not match the scan size ({}, {})'.format(
+                                       num, scanJ, scanI))
+                series_shape = (scanJ, scanI)
 
                 # create mapping dims for checking
-                map_xdim = self._createDim(self.head['Dimensions'][0]['DimensionSize'],
+                map_xdim = self._createDim(scanI,
                                            self.head['Dimensions'][0]['CalibrationOffset'],
                                            self.head['Dimensions'][0]['CalibrationDelta'],
                                            self.head['Dimensions'][0]['CalibrationElement'])
-                map_ydim = self._createDim(self.head['Dimensions'][1]['DimensionSize'],
+                map_ydim = self._createDim(scanJ,
                                            self.head['Dimensions'][1]['CalibrationOffset'],
                                            self.head['Dimensions'][1]['CalibrationDelta'],
                                            self.head['Dimensions'][1]['CalibrationElement'])
@@ -665,275 +977,378 @@ class fileSER:
                 map_xdim += 0.5 * self.head['Dimensions'][0]['CalibrationDelta']
                 map_ydim -= 0.5 * self.head['Dimensions'][1]['CalibrationDelta']
 
-                for y in range(self.head['Dimensions'][0]['DimensionSize']):
-                    for x in range(self.head['Dimensions'][1]['DimensionSize']):
-                        index = int(x + y * self.head['Dimensions'][0]['DimensionSize'])
-                        print('converting dataset {} of {}, items ({}, {})'.format(index + 1,
-                                                                                   self.head['ValidNumberElements'],
-                                                                                   x, y))
+                # check all positions at once
+                positionX = tags['PositionX'].reshape(series_shape)
+                positionY = tags['PositionY'].reshape(series_shape)
+                if not (np.all(np.isclose(positionX, map_xdim[None, :], rtol=1e-8, atol=0)) and
+                        np.all(np.isclose(positionY, map_ydim[:, None], rtol=1e-8, atol=0))):
+                    raise RuntimeError('The positions of the data elements do not match the scan calibration')
+
+                # create dimension datasets
+                assert self.head['Dimensions'][1]['Description'] == 'Position'
+                assert self.head['Dimensions'][0]['Description'] == 'Position'
+                dims_time = [(map_ydim, self.head['Dimensions'][1]['Description'],
+                              '[{}]'.format(self.head['Dimensions'][1]['Units'])),
+                             (map_xdim, self.head['Dimensions'][0]['Description'],
+                              '[{}]'.format(self.head['Dimensions'][0]['Units']))]
+                dims = dims_time + element_dims
+            elif num == 1 and self.head['DataTypeID'] == 0x4122:
+                # 1 entry series to single image
+                series_shape = ()
+                dims = element_dims
+            else:
+                # simple series
+                series_shape = (num,)
+
+                # first SER dimension is number
+                assert self.head['Dimensions'][0]['Description'] == 'Number'
+                dim = self._createDim(self.head['Dimensions'][0]['DimensionSize'],
+                                      self.head['Dimensions'][0]['CalibrationOffset'],
+                                      self.head['Dimensions'][0]['CalibrationDelta'],
+                                      self.head['Dimensions'][0]['CalibrationElement'])
+                dims = [(dim[0:num], self.head['Dimensions'][0]['Description'],
+                         '[{}]'.format(self.head['Dimensions'][0]['Units']))] + element_dims
+
+            # chunks of whole data elements
+            element_bytes = int(np.prod(element_shape)) * src.dtype.itemsize
+            if chunks is None:
+                chunks = (1,) * len(series_shape) + element_shape
+                if series_shape:
+                    chunks = chunks[:len(series_shape) - 1] + \
+                             (int(min(series_shape[-1], max(1, 2 ** 20 // element_bytes))),) + element_shape
+            kwargs.update(emd.compressionOptions(compression))
+            dset = grp.create_dataset('data', series_shape + element_shape, dtype=src.dtype,
+                                      chunks=chunks if chunks else None, **kwargs)
+
+            # copy blocks of whole rows (mapping) or elements (series)
+            row_elements = series_shape[-1] if len(series_shape) == 2 else 1
+            rows = max(1, block_size // (element_bytes * row_elements))
+            if dset.chunks is not None and series_shape:
+                chunk_rows = dset.chunks[0]
+                rows = max(chunk_rows, rows // chunk_rows * chunk_rows)  # align to chunks
+            total_rows = series_shape[0] if series_shape else 1
+            for row in range(0, total_rows, rows):
+                last = min(row + rows, total_rows)
+                block = np.asarray(src[row * row_elements:last * row_elements])
+                if series_shape:
+                    dset[row:last] = block.reshape((last - row,) + series_shape[1:] + element_shape)
+                else:
+                    dset[...] = block[0]
+                if progress is not None:
+                    progress(last * row_elements, num)
 
-                        # retrieve dataset and put into buffer     
-                        data, meta = self.getDataset(index)
-                        dset[y, x, :, :] = data[:, :]
+            # write dimensions
+            for ii in range(len(dims)):
+                f.write_dim('dim{:d}'.format(ii + 1), dims[ii], grp)
 
-                        # get tag data per image
-                        tag = self._getTag(index)
-                        time[y, x] = tag['Time']
+            # time stamps
+            time = tags['Time'].astype('i4')
+            if mapping:
+                # write out time as additional dataset
+                _ = f.put_emdgroup('timestamp', time.reshape(series_shape), dims_time, parent=grp)
+            elif not series_shape:
+                dset.attrs['timestamp'] = time[0]
+            else:
+                # write out time as additional dim vector
+                f.write_dim('dim1_time', (time, 'timestamp', '[s]'), grp)
 
-                        assert (np.abs(tag['PositionX'] - map_xdim[x]) < np.abs(tag['PositionX'] * 1e-8))
-                        assert (np.abs(tag['PositionY'] - map_ydim[y]) < np.abs(tag['PositionY'] * 1e-8))
+            # put meta information from _emi to Microscope group, if available
+            if self._emi:
+                for key in self._emi:
+                    if not self._emi[key] is None:
+                        f.microscope.attrs[key] = self._emi[key]
 
-                        del data, meta, tag
+            # write comment into Comment group
+            f.put_comment('Converted SER file "{}" to EMD using the openNCEM tools.'.format(self._file_hdl.name))
 
-                # create dimension datasets
-                dims = []
-                dims_time = []
 
-                # Position Y
-                assert self.head['Dimensions'][1]['Description'] == 'Position'
-                dims.append((map_ydim, self.head['Dimensions'][1]['Description'],
-                             '[{}]'.format(self.head['Dimensions'][1]['Units'])))
-                dims_time.append((map_ydim, self.head['Dimensions'][1]['Description'],
-                                  '[{}]'.format(self.head['Dimensions'][1]['Units'])))
+class SERGatherArray:
+    """A read-only array-like object to access all data elements in a SER file with irregular offsets.
+    The requested elements are read one by one with fileSER.getDataset() when the array is indexed.
 
-                # Position X
-                assert self.head['Dimensions'][0]['Description'] == 'Position'
-                dims.append((map_xdim, self.head['Dimensions'][0]['Description'],
-                             '[{}]'.format(self.head['Dimensions'][0]['Units'])))
-                dims_time.append((map_xdim, self.head['Dimensions'][0]['Description'],
-                                  '[{}]'.format(self.head['Dimensions'][0]['Units'])))
+    Attributes
+    ----------
+    shape : tuple
+        The shape of the data. The series dimensions followed by the dimensions of each element.
 
-                dim = self._createDim(first_meta['ArrayShape'][1], first_meta['Calibration'][1]['CalibrationOffset'],
-                                      first_meta['Calibration'][1]['CalibrationDelta'],
-                                      first_meta['Calibration'][1]['CalibrationElement'])
-                dims.append((dim, 'y', '[m]'))
+    dtype : numpy.dtype
+        The data type of the data.
 
-                dim = self._createDim(first_meta['ArrayShape'][0], first_meta['Calibration'][0]['CalibrationOffset'],
-                                      first_meta['Calibration'][0]['CalibrationDelta'],
-                                      first_meta['Calibration'][0]['CalibrationElement'])
-                dims.append((dim, 'x', '[m]'))
+    """
 
-                # write dimensions
-                for ii in range(len(dims)):
-                    f.write_dim('dim{:d}'.format(ii + 1), dims[ii], grp)
+    def __init__(self, ser, series_shape, element_shape, dtype):
+        """ Provide access to the data elements of a SER file.
 
-                # write out time as additional dataset
-                _ = f.put_emdgroup('timestamp', time, dims_time, parent=grp)
-            else:
-                # 1 entry series to single image
-                if self.head['ValidNumberElements'] == 1:
-                    # get image
-                    data, meta = self.getDataset(0)
-                    tag = self._getTag(0)
+        Parameters
+        ----------
+        ser : fileSER
+            The open SER file.
 
-                    # create dimensions
-                    dims = []
+        series_shape : tuple
+            The shape of the series (i.e. [scanJ, scanI] or [N]).
 
-                    dim = self._createDim(first_meta['ArrayShape'][1],
-                                          first_meta['Calibration'][1]['CalibrationOffset'],
-                                          first_meta['Calibration'][1]['CalibrationDelta'],
-                                          first_meta['Calibration'][1]['CalibrationElement'])
-                    dims.append((dim, 'y', '[m]'))
+        element_shape : tuple
+            The shape of each data element.
 
-                    dim = self._createDim(first_meta['ArrayShape'][0],
-                                          first_meta['Calibration'][0]['CalibrationOffset'],
-                                          first_meta['Calibration'][0]['CalibrationDelta'],
-                                          first_meta['Calibration'][0]['CalibrationElement'])
-                    dims.append((dim, 'x', '[m]'))
+        dtype : numpy.dtype
+            The data type of the data.
 
-                    dset = grp.create_dataset('data', (first_meta['ArrayShape'][1],
-                                                       first_meta['ArrayShape'][0]),
-                                              dtype=self._dictDataType[first_meta['DataType']])
+        """
+        self._ser = ser
+        self._series_shape = tuple(series_shape)
+        self.shape = self._series_shape + tuple(element_shape)
+        self.dtype = np.dtype(dtype)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None):
+        out = self[...]
+        if dtype is not None:
+            out = out.astype(dtype, copy=False)
+        return out
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        nseries = len(self._series_shape)
+        if any(kk is Ellipsis for kk in key):
+            series_key, rest = (slice(None),) * nseries, key
+        else:
+            key = key + (slice(None),) * (nseries - len(key))
+            series_key, rest = key[:nseries], key[nseries:]
 
-                    dset[:, :] = data[:, :]
+        elements = np.arange(int(np.prod(self._series_shape))).reshape(self._series_shape)[series_key]
+        out = np.empty(elements.shape + self.shape[nseries:], dtype=self.dtype)
+        for ii, element in np.ndenumerate(elements):
+            out[ii] = self._ser.getDataset(int(element))[0]
 
-                    for i in range(len(dims)):
-                        f.write_dim('dim{:d}'.format(i + 1), dims[i], grp)
+        if rest is key:
+            return out[key]  # Ellipsis applies to the whole array
+        return out[(slice(None),) * elements.ndim + rest]
 
-                    dset.attrs['timestamp'] = tag['Time']
-                else:
-                    # simple series
-                    dset = grp.create_dataset('data', (self.head['ValidNumberElements'],
-                                                       first_meta['ArrayShape'][1], first_meta['ArrayShape'][0]),
-                                              dtype=self._dictDataType[first_meta['DataType']])
-
-                    # collect time
-                    time = np.zeros(self.head['ValidNumberElements'], dtype='i4')
-
-                    for i in range(self.head['ValidNumberElements']):
-                        print('converting dataset {} of {}'.format(i + 1, self.head['ValidNumberElements']))
-
-                        # retrieve dataset and put into buffer
-                        data, meta = self.getDataset(i)
-                        dset[i, :, :] = data[:, :]
-
-                        # get tag data per image
-                        tag = self._getTag(i)
-                        time[i] = tag['Time']
-
-                    # create dimension data sets
-                    dims = []
-
-                    # first SER dimension is number
-                    assert self.head['Dimensions'][0]['Description'] == 'Number'
-
-                    dim = self._createDim(self.head['Dimensions'][0]['DimensionSize'],
-                                          self.head['Dimensions'][0]['CalibrationOffset'],
-                                          self.head['Dimensions'][0]['CalibrationDelta'],
-                                          self.head['Dimensions'][0]['CalibrationElement'])
-                    dims.append((dim[0:self.head['ValidNumberElements']],
-                                 self.head['Dimensions'][0]['Description'],
-                                 '[{}]'.format(self.head['Dimensions'][0]['Units'])))
-
-                    dim = self._createDim(first_meta['ArrayShape'][1],
-                                          first_meta['Calibration'][1]['CalibrationOffset'],
-                                          first_meta['Calibration'][1]['CalibrationDelta'],
-                                          first_meta['Calibration'][1]['CalibrationElement'])
-                    dims.append((dim, 'y', '[m]'))
-
-                    dim = self._createDim(first_meta['ArrayShape'][0],
-                                          first_meta['Calibration'][0]['CalibrationOffset'],
-                                          first_meta['Calibration'][0]['CalibrationDelta'],
-                                          first_meta['Calibration'][0]['CalibrationElement'])
-                    dims.append((dim, 'x', '[m]'))
-
-                    # write dimensions
-                    for i in range(len(dims)):
-                        f.write_dim('dim{:d}'.format(i + 1), dims[i], grp)
-
-                    # write out time as additional dim vector
-                    f.write_dim('dim1_time', (time, 'timestamp', '[s]'), grp)
-
-        elif self.head['DataTypeID'] == 0x4120:
-            # 1D datasets; spectra
-            self.head['ExperimentType'] = 'spectrum'  # text indicator of the experiment type
-
-            if first_tag['TagTypeID'] == 0x4142:
-                # 2D mapping
-                dset = grp.create_dataset('data', (self.head['Dimensions'][1]['DimensionSize'],
-                                                   self.head['Dimensions'][0]['DimensionSize'],
-                                                   first_meta['ArrayShape'][0]),
-                                          dtype=self._dictDataType[first_meta['DataType']])
 
-                time = np.zeros((self.head['Dimensions'][0]['DimensionSize'],
-                                 self.head['Dimensions'][1]['DimensionSize']), dtype='i4')
+class fileSERSeries:
+    """All parts of a SER acquisition split by TIA into several files (name_1.ser, name_2.ser, ...). The data
+    elements of all parts are accessed as one read-only array with shape [N, E] for spectra or [N, Y, X] for
+    images. Only the headers are read when the series is opened. Indexing reads only the requested elements
+    from the files that contain them.
 
-                # create mapping dims for checking
-                map_xdim = self._createDim(self.head['Dimensions'][0]['DimensionSize'],
-                                           self.head['Dimensions'][0]['CalibrationOffset'],
-                                           self.head['Dimensions'][0]['CalibrationDelta'],
-                                           self.head['Dimensions'][0]['CalibrationElement'])
-                map_ydim = self._createDim(self.head['Dimensions'][1]['DimensionSize'],
-                                           self.head['Dimensions'][1]['CalibrationOffset'],
-                                           self.head['Dimensions'][1]['CalibrationDelta'],
-                                           self.head['Dimensions'][1]['CalibrationElement'])
-                # weird direction depend half pixel shifting
-                map_xdim += 0.5 * self.head['Dimensions'][0]['CalibrationDelta']
-                map_ydim -= 0.5 * self.head['Dimensions'][1]['CalibrationDelta']
+    Attributes
+    ----------
+    files : list of pathlib.Path
+        The SER files in the order of the series.
 
-                for y in range(self.head['Dimensions'][0]['DimensionSize']):
-                    for x in range(self.head['Dimensions'][1]['DimensionSize']):
-                        index = int(x + y * self.head['Dimensions'][0]['DimensionSize'])
-                        print('converting dataset {} of {}, items ({}, {})'.format(index + 1,
-                                                                                   self.head['ValidNumberElements'],
-                                                                                   x, y))
+    shape : tuple
+        The shape of the series. The number of elements followed by the shape of each element.
 
-                        # retrieve dataset and put into buffer
-                        data, meta = self.getDataset(index)
-                        dset[y, x, :] = np.copy(data[:])
+    dtype : numpy.dtype
+        The data type of the data.
 
-                        # get tag data per image
-                        tag = self._getTag(index)
-                        time[y, x] = tag['Time']
+    starts : ndarray
+        The global index of the first element of each file.
 
-                        assert (np.abs(tag['PositionX'] - map_xdim[x]) < np.abs(tag['PositionX'] * 1e-8))
-                        assert (np.abs(tag['PositionY'] - map_ydim[y]) < np.abs(tag['PositionY'] * 1e-8))
+    Examples
+    --------
+    Read every 10th image of all parts of an acquisition
+    >> import ncempy.io.ser as ser
+    >> with ser.fileSERSeries('path/to/name_1.ser') as series:
+    >>     images = series[::10]
 
-                        del data, meta, tag
+    """
 
-                # create dimension datasets
-                dims = []
-                dims_time = []
+    def __init__(self, filename, verbose=False, cache=None):
+        """ Find and open all parts of the series and build the global element index.
 
-                # Position Y
-                assert self.head['Dimensions'][1]['Description'] == 'Position'
-                dims.append((map_ydim, self.head['Dimensions'][1]['Description'],
-                             '[{}]'.format(self.head['Dimensions'][1]['Units'])))
-                dims_time.append((map_ydim, self.head['Dimensions'][1]['Description'],
-                                  '[{}]'.format(self.head['Dimensions'][1]['Units'])))
+        Parameters
+        ----------
+            filename : str or pathlib.Path or list
+                Any part of the series (i.e. name_1.ser) or a list of the SER files in order.
 
-                # Position X
-                assert self.head['Dimensions'][0]['Description'] == 'Position'
-                dims.append((map_xdim, self.head['Dimensions'][0]['Description'],
-                             '[{}]'.format(self.head['Dimensions'][0]['Units'])))
-                dims_time.append((map_xdim, self.head['Dimensions'][0]['Description'],
-                                  '[{}]'.format(self.head['Dimensions'][0]['Units'])))
+            verbose : bool, optional
+                True to get extensive output while reading the files.
 
-                dim = self._createDim(first_meta['ArrayShape'][0], first_meta['Calibration'][0]['CalibrationOffset'],
-                                      first_meta['Calibration'][0]['CalibrationDelta'],
-                                      first_meta['Calibration'][0]['CalibrationElement'])
-                dims.append((dim, 'E', '[m_eV]'))
+            cache : bool or None, optional
+                Use the header cache for all parts. See fileSER.
 
-                # write dimensions
-                for i in range(len(dims)):
-                    f.write_dim('dim{:d}'.format(i + 1), dims[i], grp)
+        """
+        self.parts = []
+        self._memmaps = []
 
-                # write out time as additional dataset
-                _ = f.put_emdgroup('timestamp', time, dims_time, parent=grp)
+        if isinstance(filename, (str, Path)):
+            self.files = self._findParts(Path(filename))
+        else:
+            self.files = [Path(ff) for ff in filename]
+        if not self.files:
+            raise IOError('No SER files found for {}'.format(filename))
 
-            else:
-                # simple series
-                dset = grp.create_dataset('data', (self.head['ValidNumberElements'], first_meta['ArrayShape'][0]),
-                                          dtype=self._dictDataType[first_meta['DataType']])
+        try:
+            for ff in self.files:
+                self.parts.append(fileSER(ff, verbose=verbose, cache=cache))
+
+            # All parts need the same type and shape of data elements
+            layout = None
+            for part in self.parts:
+                if part.head['ValidNumberElements'] == 0:
+                    continue
+                _, meta = part.getDataset(0)
+                this_layout = (int(part.head['DataTypeID']), np.dtype(part._dictDataType[meta['DataType']]),
+                               tuple(meta['ArrayShape'][::-1]))
+                if layout is None:
+                    layout = this_layout
+                elif this_layout != layout:
+                    raise ValueError('The data elements of {} differ from the first file.'.format(part.file_name))
+            if layout is None:
+                raise IndexError('No data elements found in files.')
+        except:
+            self.close()
+            raise
 
-                # collect time
-                time = np.zeros(self.head['ValidNumberElements'], dtype='i4')
+        _, self.dtype, element_shape = layout
+        counts = np.array([int(part.head['ValidNumberElements']) for part in self.parts], dtype=np.int64)
+        self.starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        self.shape = (int(counts.sum()),) + element_shape
+        self._memmaps = [None] * len(self.parts)
 
-                for i in range(self.head['ValidNumberElements']):
-                    print('converting dataset {} of {}'.format(i + 1, self.head['ValidNumberElements']))
+    @staticmethod
+    def _findParts(file_path):
+        """ Find all files of the series in the directory of file_path sorted by their number.
 
-                    # retrieve dataset and put into buffer
-                    data, meta = self.getDataset(i)
-                    dset[i, :] = data[:]
+        """
+        match = re.match(r'(.*)_(\d+)$', file_path.stem)
+        if match is None:
+            return [file_path]
+        base = match.group(1)
+        parts = []
+        for ff in file_path.parent.iterdir():
+            mm = re.match(r'(.*)_(\d+)$', ff.stem)
+            if ff.suffix.lower() == '.ser' and mm is not None and mm.group(1) == base:
+                parts.append((int(mm.group(2)), ff))
+        return [ff for _, ff in sorted(parts)]
 
-                    # get tag data per image
-                    tag = self._getTag(i)
-                    time[i] = tag['Time']
+    def __enter__(self):
+        return self
 
-                # create dimension datasets
-                dims = []
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
 
-                # first SER dimension is number
-                assert self.head['Dimensions'][0]['Description'] == 'Number'
-                dim = self._createDim(self.head['Dimensions'][0]['DimensionSize'],
-                                      self.head['Dimensions'][0]['CalibrationOffset'],
-                                      self.head['Dimensions'][0]['CalibrationDelta'],
-                                      self.head['Dimensions'][0]['CalibrationElement'])
-                dims.append((dim[0:self.head['ValidNumberElements']], self.head['Dimensions'][0]['Description'],
-                             '[{}]'.format(self.head['Dimensions'][0]['Units'])))
+    def close(self):
+        """ Close all files of the series.
 
-                dim = self._createDim(first_meta['ArrayShape'][0], first_meta['Calibration'][0]['CalibrationOffset'],
-                                      first_meta['Calibration'][0]['CalibrationDelta'],
-                                      first_meta['Calibration'][0]['CalibrationElement'])
-                dims.append((dim, 'E', '[m_eV]'))
+        """
+        self._memmaps = [None] * len(self.parts)
+        for part in self.parts:
+            if part._file_hdl is not None and not part._file_hdl.closed:
+                part._file_hdl.close()
 
-                # write dimensions
-                for i in range(len(dims)):
-                    f.write_dim('dim{:d}'.format(i + 1), dims[i], grp)
+    @property
+    def ndim(self):
+        return len(self.shape)
 
-                # write out time as additional dim vector
-                f.write_dim('dim1_time', (time, 'timestamp', '[s]'), grp)
-        else:
-            raise RuntimeError('Unknown DataTypeID')
+    def __len__(self):
+        return self.shape[0]
 
-            # put meta information from _emi to Microscope group, if available
-        if self._emi:
-            for key in self._emi:
-                if not self._emi[key] is None:
-                    f.microscope.attrs[key] = self._emi[key]
+    def __array__(self, dtype=None, copy=None):
+        out = self[...]
+        if dtype is not None:
+            out = out.astype(dtype, copy=False)
+        return out
+
+    def locate(self, index):
+        """ Find the file containing a data element.
+
+        Parameters
+        ----------
+            index : int
+                The global index of the data element.
 
-        # write comment into Comment group
-        f.put_comment('Converted SER file "{}" to EMD using the openNCEM tools.'.format(self._file_hdl.name))
+        Returns
+        -------
+            : tuple
+                The index of the file in parts and the index of the element in this file.
+
+        """
+        if index < 0:
+            index += self.shape[0]
+        if index < 0 or index >= self.shape[0]:
+            raise IndexError('index {} is out of bounds for axis 0 with size {}'.format(index, self.shape[0]))
+        part = int(np.searchsorted(self.starts, index, side='right')) - 1
+        return part, int(index - self.starts[part])
+
+    def getDataset(self, index):
+        """ Retrieve data and meta data of one data element. See fileSER.getDataset().
+
+        Parameters
+        ----------
+            index : int
+                The global index of the data element.
+
+        Returns
+        -------
+            dataset : tuple, 2 elements in form (data metadata)
+
+        """
+        part, local = self.locate(index)
+        return self.parts[part].getDataset(local)
+
+    def getMetadata(self):
+        """ Retrieve the global meta data of the series from the first file. See fileSER.getMetadata().
+
+        """
+        return self.parts[0].getMetadata()
+
+    def getTags(self):
+        """ Read the tags of all data elements of all files. See fileSER.getTags().
+
+        Returns
+        -------
+            : dict
+                The time, positions and validity of all tags of the series.
+
+        """
+        tags = [part.getTags() for part in self.parts]
+        return {key: np.concatenate([tt[key] for tt in tags]) for key in tags[0]}
+
+    def _memmap(self, part):
+        """ The lazy array of the data elements of one file with shape [n, ...].
+
+        """
+        if self._memmaps[part] is None:
+            ser = self.parts[part]
+            num = int(ser.head['ValidNumberElements'])
+            mm = ser.getMemmap()
+            if isinstance(mm, np.ndarray):
+                mm = mm.reshape((num,) + self.shape[1:])
+            else:
+                mm = SERGatherArray(ser, (num,), self.shape[1:], self.dtype)
+            self._memmaps[part] = mm
+        return self._memmaps[part]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) == 0 or key[0] is Ellipsis:
+            # Read all elements and apply the full key
+            return self[:][key]
+        key0, rest = key[0], key[1:]
+
+        if isinstance(key0, (int, np.integer)):
+            part, local = self.locate(int(key0))
+            return np.array(self._memmap(part)[local])[rest]
+
+        elements = np.arange(self.shape[0])[key0]
+        if elements.ndim != 1:
+            raise IndexError('Only one dimensional indices are supported for axis 0')
+        out = np.empty((len(elements),) + self.shape[1:], dtype=self.dtype)
+        parts = np.searchsorted(self.starts, elements, side='right') - 1
+        for part in np.unique(parts):
+            selected = np.nonzero(parts == part)[0]
+            out[selected] = self._memmap(int(part))[elements[selected] - self.starts[part]]
+        return out[(slice(None),) + rest]
 
 
 def read_emi(filename):
@@ -1080,10 +1495,7 @@ def serReader(filename):
                 spectraSize = data.shape[0]
 
                 # Read in all spectra
-                temp = np.zeros((numSpectra, spectraSize), dtype=npType)  # C-style ordering
-                for ii in range(0, numSpectra):
-                    data0, meta1 = f1.getDataset(ii)
-                    temp[ii, :] = data0
+                temp = np.array(f1.getMemmap(), dtype=npType).reshape((numSpectra, spectraSize))  # C-style ordering
 
                 if f1.head['NumberDimensions'] > 1:
                     # Spectrum map
@@ -1102,10 +1514,7 @@ def serReader(filename):
                            'scanCalibration': f1.head['Dimensions']}
             elif f1.head['DataTypeID'] == 0x4122:
                 # Images as 2D or 3D image series
-                temp = np.empty([f1.head['ValidNumberElements'], data.shape[0], data.shape[1]], dtype=npType)
-                for ii in range(0, f1.head['ValidNumberElements']):
-                    data0, metadata0 = f1.getDataset(ii)
-                    temp[ii, :, :] = data0  # get the next dataset
+                temp = np.array(f1.getMemmap(), dtype=npType)
 
                 temp = np.squeeze(temp)  # remove singular dimensions
 
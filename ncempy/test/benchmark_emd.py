@@ -0,0 +1,81 @@
+"""
+Benchmarks for the emd io module.
+
+These are not run by pytest. Run them with
+
+    python -m ncempy.test.benchmark_emd
+
+"""
+
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+import ncempy.io.emd
+
+
+def bench_chunk_presets(tmp_path):
+    """ Benchmark the write throughput, file size and partial read latency of the chunk presets and
+    compression filters for sparse 4D-STEM data. Reading a single diffraction pattern should be
+    faster with the 4dstem-diffraction preset than with the 4dstem-realspace preset.
+
+    """
+    dd = np.random.default_rng(0).poisson(0.5, (32, 32, 64, 64)).astype(np.uint16)
+    dims = ncempy.io.emd.defaultDims(dd)
+
+    print('chunk presets')
+    for preset in (None, '4dstem-diffraction', '4dstem-realspace'):
+        for compression in (None, 'gzip', 'bitshuffle', 'zstd'):
+            file_name = tmp_path / '{}_{}.emd'.format(preset, compression)
+            t0 = time.perf_counter()
+            with ncempy.io.emd.fileEMD(file_name, readonly=False) as emd0:
+                emd0.put_emdgroup('bench', dd, dims, preset=preset, compression=compression, chunk_bytes=2 ** 16)
+            write = time.perf_counter() - t0
+
+            with ncempy.io.emd.fileEMD(file_name) as emd0:
+                dset = emd0.list_emds[0]['data']
+                t0 = time.perf_counter()
+                for ii in range(8):
+                    _ = dset[ii, ii]  # diffraction patterns
+                pattern = (time.perf_counter() - t0) / 8
+                t0 = time.perf_counter()
+                _ = dset[:, :, 32, 32]  # virtual image of one detector pixel
+                image = time.perf_counter() - t0
+
+            print('{:>20} {:>10}: {:6.1f} MB, {:8.1f} MB/s write, {:7.3f} ms pattern, {:7.3f} ms image'.format(
+                  str(preset), str(compression), file_name.stat().st_size / 2 ** 20, dd.nbytes / write / 2 ** 20,
+                  pattern * 1e3, image * 1e3))
+
+
+def bench_chunk_cache(tmp_path):
+    """ Benchmark virtual images of compressed 4D-STEM data with a small chunk cache and with the
+    chunk cache for the pixel access pattern. The small cache decompresses each chunk again for every
+    detector pixel.
+
+    """
+    dd = np.random.default_rng(0).poisson(1, (16, 16, 64, 64)).astype(np.uint16)
+    with ncempy.io.emd.fileEMD(tmp_path / 'bench.emd', readonly=False) as emd0:
+        emd0.put_emdgroup('4dstem', dd, ncempy.io.emd.defaultDims(dd), chunks=(4, 4, 32, 32),
+                          compression='gzip')
+
+    print('chunk cache')
+    with ncempy.io.emd.fileEMD(tmp_path / 'bench.emd', chunk_cache={'rdcc_nbytes': 2 ** 18}) as emd0:
+        for access in (None, 'pixel'):
+            data, _ = emd0.get_emdgroup(0, lazy=True, access=access)
+            t0 = time.perf_counter()
+            for kk in range(0, 64, 4):
+                for ll in range(0, 64, 4):
+                    _ = data[:, :, kk, ll]
+            duration = time.perf_counter() - t0
+            info = data.cache_info()
+            print('{:>6}: {:7.1f} ms, {:6} hits, {:6} misses, {:5.1f} MB cache'.format(
+                  str(access), duration * 1e3, info['hits'], info['misses'], data.chunk_cache['rdcc_nbytes'] / 2 ** 20))
+            data.close()
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        bench_chunk_presets(Path(tmp_dir))
+        bench_chunk_cache(Path(tmp_dir))
@@ -0,0 +1,167 @@
+"""
+Tests for the header cache of the DM, SER and MRC readers.
+"""
+
+import pytest
+
+import os
+import shutil
+import time
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+import ncempy.io.cache
+import ncempy.io.dm
+import ncempy.io.ser
+import ncempy.io.mrc
+
+
+class Testcache:
+    """
+    Test the header cache
+    """
+
+    @pytest.fixture
+    def data_location(self):
+        # Get the location of the test data files
+        test_path = Path(__file__).resolve()
+        root_path = test_path.parents[1]
+        return root_path / Path('data')
+
+    @pytest.fixture
+    def cache_location(self):
+        tmp_dir = tempfile.mkdtemp()
+        ncempy.io.cache.set_cache_dir(tmp_dir)
+        yield Path(tmp_dir)
+        ncempy.io.cache.disable()
+        ncempy.io.cache.set_cache_dir(None)
+        shutil.rmtree(tmp_dir)
+
+    def test_dm(self, data_location, cache_location):
+        file_name = data_location / Path('dmTest_3D_int16_64,65,66.dm4')
+        with ncempy.io.dm.fileDM(file_name) as dm0:
+            data0 = dm0.getDataset(0)
+            tags0 = dm0.allTags
+
+        # cold and warm open
+        for ii in range(2):
+            with ncempy.io.dm.fileDM(file_name, cache=True) as dm1:
+                data1 = dm1.getDataset(0)
+                assert dm1.allTags.keys() == tags0.keys()
+            assert np.array_equal(data0['data'], data1['data'])
+            assert data0['pixelSize'] == data1['pixelSize']
+        assert len(list(cache_location.glob('*.idx'))) == 1
+
+    def test_ser_mrc(self, data_location, cache_location):
+        ncempy.io.cache.enable()
+
+        file_name = data_location / Path('16_STOimage_1.ser')
+        for ii in range(2):
+            with ncempy.io.ser.fileSER(file_name) as ser0:
+                assert ser0.head['ValidNumberElements'] == 1
+                assert ser0._emi['AcceleratingVoltage'] == 80000
+                dd, md = ser0.getDataset(0)
+                assert dd[0, 0] == 18024
+
+        file_name = data_location / Path('temp.mrc')
+        for ii in range(2):
+            with ncempy.io.mrc.fileMRC(file_name) as mrc0:
+                assert mrc0.dataSize.tolist() == [3, 128, 128]
+                assert mrc0.getDataset()['data'].shape == (3, 128, 128)
+
+        assert len(list(cache_location.glob('*.idx'))) == 2
+
+        ncempy.io.cache.clear()
+        assert len(list(cache_location.glob('*.idx'))) == 0
+
+    def test_invalidate(self, data_location, cache_location):
+        file_name = cache_location / Path('copy.dm3')
+        shutil.copy(data_location / Path('08_carbon.dm3'), file_name)
+
+        with ncempy.io.dm.fileDM(file_name, cache=True) as dm0:
+            offset0 = dm0.dataOffset
+        index_path = ncempy.io.cache._index_path(file_name, 'dm-full')
+        assert index_path.exists()
+
+        # A modified file must not use the old index
+        stats = os.stat(file_name)
+        os.utime(file_name, ns=(stats.st_atime_ns, stats.st_mtime_ns + 10**9))
+        assert ncempy.io.cache.load(file_name, 'dm-full') is None
+        with ncempy.io.dm.fileDM(file_name, cache=True) as dm0:
+            assert dm0.dataOffset == offset0
+        assert ncempy.io.cache.load(file_name, 'dm-full') is not None
+
+        ncempy.io.cache.invalidate(file_name)
+        assert not index_path.exists()
+
+    def test_invalidate_emi(self, data_location, cache_location):
+        """ The cached EMI metadata of a SER file must not be used after the EMI file changed."""
+        file_name = cache_location / Path('copy_1.ser')
+        emi_name = cache_location / Path('copy.emi')
+        shutil.copy(data_location / Path('16_STOimage_1.ser'), file_name)
+        shutil.copy(data_location / Path('16_STOimage.emi'), emi_name)
+
+        with ncempy.io.ser.fileSER(file_name, cache=True) as ser0:
+            assert ser0._emi['AcceleratingVoltage'] == 80000
+
+        # Replace the EMI file with one of the same size
+        emi_data = emi_name.read_bytes().replace(b'>80000.0<', b'>30000.0<')
+        emi_name.write_bytes(emi_data)
+        stats = os.stat(emi_name)
+        os.utime(emi_name, ns=(stats.st_atime_ns, stats.st_mtime_ns + 10**9))
+        with ncempy.io.ser.fileSER(file_name, cache=True) as ser0:
+            assert ser0._emi['AcceleratingVoltage'] == 30000
+
+        emi_name.unlink()
+        with ncempy.io.ser.fileSER(file_name, cache=True) as ser0:
+            assert ser0._emi is None
+
+    def test_index_format(self, data_location, cache_location):
+        """ Index files are JSON and restore numpy values with their types. Other files are not loaded."""
+        import json
+        import pickle
+        file_name = data_location / Path('temp.mrc')
+        with ncempy.io.mrc.fileMRC(file_name, cache=True) as mrc0:
+            header0 = {name: getattr(mrc0, name) for name in mrc0._headerAttributes}
+        index_path = ncempy.io.cache._index_path(file_name, 'mrc')
+        with open(index_path, 'r') as fid:
+            assert json.load(fid)['dict'][0] == ['version', ncempy.io.cache.CACHE_VERSION]
+
+        header1 = ncempy.io.cache.load(file_name, 'mrc')
+        assert header1.keys() == header0.keys()
+        assert header1['dataType'] is header0['dataType']
+        assert header1['dataSize'].dtype == header0['dataSize'].dtype
+        assert np.array_equal(header1['dataSize'], header0['dataSize'])
+        assert type(header1['mrcType']) is type(header0['mrcType'])
+
+        # A pickle in the cache directory is not unpickled and removed as a stale index
+        with open(index_path, 'wb') as fid:
+            pickle.dump({'version': ncempy.io.cache.CACHE_VERSION}, fid)
+        assert ncempy.io.cache.load(file_name, 'mrc') is None
+        assert not index_path.exists()
+
+        # Values that can not be stored are not cached
+        ncempy.io.cache.save(file_name, 'mrc', {'value': object()})
+        assert not index_path.exists()
+
+    def test_cold_vs_warm_performance(self, data_location, cache_location):
+        """ Benchmark opening a file with a cold and a warm cache. The warm open only needs to read the index.
+        The times are only printed since they depend on the machine."""
+        file_name = data_location / Path('08_carbon.dm3')
+
+        m0 = time.time()
+        for ii in range(10):
+            ncempy.io.cache.clear()
+            with ncempy.io.dm.fileDM(file_name, on_memory=False, cache=True) as _:
+                pass
+        delta0 = time.time() - m0
+
+        m1 = time.time()
+        for ii in range(10):
+            with ncempy.io.dm.fileDM(file_name, on_memory=False, cache=True) as _:
+                pass
+        delta1 = time.time() - m1
+
+        print('10 opens: cold cache {:.4f} s, warm cache {:.4f} s'.format(delta0, delta1))
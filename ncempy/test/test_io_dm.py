@@ -22,7 +22,7 @@ class Testdm3:
         root_path = test_path.parents[1]
         return root_path / Path('data')
 
-    def _read_dm3_data(self, file_path, on_memory=False):
+    def _read_dm3_data(self, file_path, on_memory=False, parser='struct'):
         """Creates a fileDM and reads its data metadata
 
         Parameters
@@ -32,9 +32,12 @@ class Testdm3:
 
             on_memory : bool
                 if True, the dm file will be opened in on memory mode.
+
+            parser : str
+                The tag parser passed to fileDM.
         """
 
-        with ncempy.io.dm.fileDM(file_path, on_memory=on_memory) as f:
+        with ncempy.io.dm.fileDM(file_path, on_memory=on_memory, parser=parser) as f:
             if on_memory:
                 assert f._on_memory
             f.parseHeader()
@@ -75,14 +78,19 @@ class Testdm3:
         """ Test speed improvement with on_memory option.
         Even with a local HDD, memory read should be x10 faster.
 
+        The numpy parser is used since it reads many small pieces of the header. The struct parser
+        is as fast for files as for memory.
+
         """
         m0 = time.time()
         for i in range(10):
-            _ = self._read_dm3_data(data_location / Path('dmTest_3D_int16_64,65,66.dm3'), on_memory=False)
+            _ = self._read_dm3_data(data_location / Path('dmTest_3D_int16_64,65,66.dm3'), on_memory=False,
+                                    parser='numpy')
             delta0 = time.time() - m0
             
             m1 = time.time()
-            _ = self._read_dm3_data(data_location / Path('dmTest_3D_int16_64,65,66.dm3'), on_memory=True)
+            _ = self._read_dm3_data(data_location / Path('dmTest_3D_int16_64,65,66.dm3'), on_memory=True,
+                                    parser='numpy')
 
             delta1 = time.time() - m1
 
@@ -121,7 +129,8 @@ class Testdm3:
         with ncempy.io.dm.fileDM(data_location / Path('dmTest_3D_int16_64,65,66.dm3'), on_memory=True) as f:
             m = f.getMemmap(0)
             assert isinstance(m, np.ndarray)
-            assert isinstance(m, np.memmap)
+            assert not isinstance(m, np.memmap)  # a view of the existing memory map
+            assert not m.flags.writeable
             assert m[0, 0, 0] == 0  # test while file open
 
         assert m[0, 0, 0] == 0  # test when file closed
@@ -142,6 +151,173 @@ class Testdm3:
             assert isinstance(m, np.memmap)
             assert int(m[0]) == 21281
 
+    def test_memmap_file_object(self, data_location):
+        import numpy as np
+        file_name = data_location / Path('dmTest_3D_int16_64,65,66.dm3')
+        with ncempy.io.dm.fileDM(file_name) as dm0:
+            data = dm0.getDataset(0)['data']
+
+        with open(file_name, 'rb') as f0:
+            with ncempy.io.dm.fileDM(f0) as dm1:
+                m = dm1.getMemmap(0)
+                assert isinstance(m, ncempy.io.dm.SeekableArray)
+                assert m.shape == data.shape
+                assert m.dtype == data.dtype
+                assert np.array_equal(m[3], data[3])
+                assert np.array_equal(m[2:10:3, 5, :], data[2:10:3, 5, :])
+                assert np.array_equal(m[-1, ..., 1], data[-1, ..., 1])
+                assert np.array_equal(m[[7, 1]], data[[7, 1]])
+                assert np.array_equal(m[..., 4], data[..., 4])
+                assert np.array_equal(m[None, 3], data[None, 3])
+                assert np.array_equal(m[np.newaxis, 2:6, None, 1], data[np.newaxis, 2:6, None, 1])
+                assert np.array_equal(m[None, [7, 1], :, [0, 2]], data[None, [7, 1], :, [0, 2]])
+                assert np.array_equal(m[None, None, ...], data[None, None, ...])
+                assert np.array_equal(np.asarray(m), data)
+
+    def test_getDatasets(self, data_location):
+        import numpy as np
+        for file_name in ('08_carbon.dm3', 'dmTest_3D_int16_64,65,66.dm4'):
+            for on_memory in (True, False):
+                with ncempy.io.dm.fileDM(data_location / Path(file_name), on_memory=on_memory) as dm0:
+                    datasets = dm0.getDatasets(copy=False)
+                    assert len(datasets) == dm0.numObjects - 1
+                    for ii, ds in enumerate(datasets):
+                        ds0 = dm0.getDataset(ii)
+                        assert np.array_equal(ds['data'], ds0['data'])
+                        assert ds['pixelSize'] == ds0['pixelSize']
+                        assert ds['pixelUnit'] == ds0['pixelUnit']
+                        assert ds['pixelOrigin'] == ds0['pixelOrigin']
+                        if on_memory:
+                            assert not ds['data'].flags.owndata  # a view of the memory map
+                    ds = dm0.getDatasets()[0]
+                    assert ds['data'].flags.writeable
+
+    def test_getDatasets_multiple(self, data_location):
+        """Read several datasets stored in a different order in the file than their dataset numbers."""
+        import numpy as np
+        file_name = data_location / Path('dmTest_3D_int16_64,65,66.dm4')
+        for on_memory in (True, False):
+            with ncempy.io.dm.fileDM(file_name, on_memory=on_memory) as dm0:
+                full = dm0.getDataset(0)['data']
+
+                # Add a block of 3 slices of the 3D data set and the thumbnail bytes as uint8 data sets
+                for offset, dataType, shape in ((dm0.dataOffset[1] + 10 * full[0].nbytes, 1, (3, 65, 64)),
+                                                (dm0.dataOffset[0], 6, (1, 192, 189 * 4))):
+                    dm0.numObjects += 1
+                    dm0.dataOffset.append(offset)
+                    dm0.dataType.append(dataType)
+                    dm0.zSize.append(shape[0])
+                    dm0.zSize2.append(1)
+                    dm0.ySize.append(shape[1])
+                    dm0.xSize.append(shape[2])
+                    ndim = 3 if shape[0] > 1 else 2
+                    dm0.dataShape.append(ndim)
+                    dm0.scale.extend([0.5 * dm0.numObjects] * ndim)
+                    dm0.scaleUnit.extend(['u{}'.format(dm0.numObjects)] * ndim)
+                    dm0.origin.extend([float(dm0.numObjects)] * ndim)
+
+                datasets = dm0.getDatasets()
+                assert len(datasets) == 3
+                assert np.array_equal(datasets[1]['data'], full[10:13])
+                assert datasets[2]['data'].shape == (192, 189 * 4)
+                for ii, ds in enumerate(datasets):
+                    ds0 = dm0.getDataset(ii)
+                    assert np.array_equal(ds['data'], ds0['data'])
+                    assert ds['pixelSize'] == ds0['pixelSize']
+                    assert ds['pixelUnit'] == ds0['pixelUnit']
+                    assert ds['pixelOrigin'] == ds0['pixelOrigin']
+                assert datasets[2]['pixelUnit'] == ['u4', 'u4']
+
+    def test_fileDMSeries(self, data_location, tmp_path):
+        import numpy as np
+        import shutil
+        file_name = data_location / Path('dmTest_float32_nonSquare_diffPixelSize.dm4')
+        with ncempy.io.dm.fileDM(file_name) as dm0:
+            data = dm0.getDataset(0)['data']
+            offset = dm0.dataOffset[1]
+
+        # Write a fake in-situ series with 2 seconds of 3 frames. Each frame has a different value.
+        for ii in range(6):
+            folder = tmp_path / 'Hour_00' / 'Minute_00' / 'Second_{:02d}'.format(ii // 3)
+            folder.mkdir(parents=True, exist_ok=True)
+            frame_name = folder / 'Hour_00_Minute_00_Second_{:02d}_Frame_{:04d}.dm4'.format(ii // 3, ii % 3)
+            shutil.copy(file_name, frame_name)
+            with open(frame_name, 'r+b') as fid:
+                fid.seek(offset)
+                fid.write((data + ii).astype(data.dtype).tobytes())
+
+        series = ncempy.io.dm.fileDMSeries(tmp_path)
+        assert series.shape == (6,) + data.shape
+        assert series.dtype == data.dtype
+        assert np.all(series.offsets == offset)
+        assert np.allclose(series.times, [0, 1 / 3, 2 / 3, 1, 4 / 3, 5 / 3])
+        assert np.array_equal(series[4], data + 4)
+        assert np.array_equal(series[1::2, 3, :], (data[None, 3, :] + np.array([1, 3, 5])[:, None]))
+        assert np.array_equal(series[..., 0], np.asarray(series)[:, :, 0])
+        assert series.pixelSize[0] != series.pixelSize[1]
+
+    def test_writeEMD(self, data_location, tmp_path):
+        """Convert a (fake) 4D dataset to EMD with different chunk layouts"""
+        import numpy as np
+        import ncempy.io.emd
+        file_name = data_location / Path('dmTest_3D_int16_64,65,66.dm4')
+        with ncempy.io.dm.fileDM(file_name) as dm0:
+            full = dm0.getDataset(0)['data']
+
+            # Treat the 3D data set as 4D
+            dm0.zSize[1] = 13
+            dm0.zSize2[1] = 5
+            dm0.dataShape[1] = 4
+            dm0.scale.append(2.0)
+            dm0.scaleUnit.append('nm')
+            dm0.origin.append(0.0)
+            expected = full[:65].reshape((5, 13) + full.shape[1:]).transpose((2, 3, 0, 1))
+
+            emd_name = tmp_path / 'converted.emd'
+            for layout in ('diffraction', 'realspace', (4, 4, 5, 13)):
+                shape = dm0.writeEMD(emd_name, layout=layout, label=str(layout), max_memory=16384)
+                assert shape == expected.shape
+
+            with pytest.raises(ValueError):
+                dm0.writeEMD(emd_name, layout='unknown')
+
+            # A [1, Z, Y, X] data set. The calibration of the singular dimension is skipped as in getMemmap()
+            dm0.zSize[1] = full.shape[0]
+            dm0.zSize2[1] = 1
+            assert dm0.writeEMD(emd_name, layout=(1,) + full.shape[1:], label='singular') == full.shape
+
+        with ncempy.io.emd.fileEMD(emd_name) as emd0:
+            diffraction = emd0.file_hdl['data/diffraction/data']
+            assert diffraction.chunks[2:] == (5, 13)
+            assert np.array_equal(diffraction[:], expected)
+            realspace = emd0.file_hdl['data/realspace/data']
+            assert realspace.chunks[:2] == expected.shape[:2]
+            assert np.array_equal(realspace[:], expected)
+            assert np.array_equal(emd0.file_hdl['data/(4, 4, 5, 13)/data'][:], expected)
+            assert emd0.file_hdl['data/diffraction/dim3'].attrs['units'] == 'nm'
+            assert np.array_equal(emd0.file_hdl['data/singular/data'][:], full)
+            assert [emd0.file_hdl['data/singular/dim{}'.format(ii)].attrs['units'] for ii in (1, 2, 3)] == \
+                ['um', 'nm', 'pm']
+            assert np.allclose(emd0.file_hdl['data/singular/dim1'][:2], (0, 4))
+
+    def test_getPreview(self, data_location):
+        import numpy as np
+        file_name = data_location / Path('dmTest_3D_int16_64,65,66.dm4')
+        for on_memory in (True, False):
+            with ncempy.io.dm.fileDM(file_name, on_memory=on_memory) as dm0:
+                thumb = dm0.getPreview(64)
+                assert thumb.dtype == np.uint8
+                assert thumb.shape == (64, 63, 3)
+                assert np.array_equal(dm0.getPreview(None), dm0.getThumbnail()[:, :, :3])
+
+                full = dm0.getDataset(0)['data']
+                frame = dm0.getPreview(32, use_thumbnail=False)
+                assert np.array_equal(frame, full[full.shape[0] // 2, ::3, ::3])
+
+        with ncempy.io.dm.fileDM(data_location / Path('08_carbon.dm3')) as dm0:
+            spectrum = dm0.getPreview(256, use_thumbnail=False)
+            assert spectrum.shape == (256,)
+
     def test_dmReader(self, data_location):
         """Test that the simplified dmReader function works and loads the data into memory. If test_on_memory
         fails then this will likely fail for the same reason."""
@@ -192,3 +368,116 @@ class Testdm3:
             _ = dm0.getMetadata(0, metadata_keys=['Dimensions',])
             assert _['Dimensions 1'] == 2048
 
+    def test_metadata_index(self, data_location):
+        """Compare the metadata from the tag index to a full scan of allTags"""
+        good_keys = ['Calibrations', 'Acquisition', 'DataBar', 'EELS', 'Meta Data', 'Microscope Info',
+                     '4Dcamera Parameters', 'Session Info', 'Dimensions']
+        for file_name in ('08_carbon.dm3', 'dmTest_3D_int16_64,65,66.dm4'):
+            with ncempy.io.dm.fileDM(data_location / Path(file_name)) as dm0:
+                md = dm0.getMetadata(0, metadata_keys=['Dimensions'])
+                expected = {}
+                for kk, ii in dm0.allTags.items():
+                    kk_split = kk.split('.')
+                    if kk.startswith('.ImageList.2.Image') and kk_split[4] in good_keys:
+                        if 'Session Info' in kk:
+                            if '.Items.' not in kk:
+                                expected[' '.join(kk_split[-2:])] = ii
+                        else:
+                            expected[' '.join(kk_split[4:])] = ii
+                tecnai = md.pop('Tecnai Microscope Info', None)
+                assert list(md.keys()) == list(expected.keys())
+                if file_name == '08_carbon.dm3':
+                    # 1288 bytes of UTF-16 characters
+                    assert len(tecnai) == 644
+                    assert tecnai.startswith('Microscope TitanCubed 300 kV D3128 UltraTwin;')
+                    assert tecnai.endswith('Total energy loss: 260.00[eV];;')
+
+    def test_struct_parser(self, data_location):
+        """Ensure the struct based parser finds the same tags and datasets as the numpy parser."""
+        for file_name in ('08_carbon.dm3', 'dmTest_3D_int16_64,65,66.dm4'):
+            with ncempy.io.dm.fileDM(data_location / Path(file_name), parser='numpy', on_memory=False) as dm0:
+                with ncempy.io.dm.fileDM(data_location / Path(file_name), parser='struct') as dm1:
+                    assert dm0.allTags.keys() == dm1.allTags.keys()
+                    assert dm0.xSize == dm1.xSize
+                    assert dm0.zSize == dm1.zSize
+                    assert dm0.dataOffset == dm1.dataOffset
+                    assert dm0.scale == dm1.scale
+                    assert dm0.scaleUnit == dm1.scaleUnit
+                    assert dm0.getMetadata(0).keys() == dm1.getMetadata(0).keys()
+
+        with pytest.raises(ValueError):
+            ncempy.io.dm.fileDM(data_location / Path('08_carbon.dm3'), parser='unknown')
+
+    def test_struct_parser_performance(self, data_location):
+        """ Benchmark the open time of the struct parser against the numpy parser.
+        The struct parser should be several times faster. The times are only printed since
+        they depend on the machine.
+
+        """
+        file_name = data_location / Path('dmTest_3D_int16_64,65,66.dm4')
+        m0 = time.time()
+        for ii in range(10):
+            with ncempy.io.dm.fileDM(file_name, on_memory=False, parser='numpy') as _:
+                pass
+        delta0 = time.time() - m0
+
+        m1 = time.time()
+        for ii in range(10):
+            with ncempy.io.dm.fileDM(file_name, on_memory=False, parser='struct') as _:
+                pass
+        delta1 = time.time() - m1
+
+        print('10 opens: numpy parser {:.4f} s, struct parser {:.4f} s'.format(delta0, delta1))
+
+    def test_lazy_tags(self, data_location):
+        """Test that lazy mode reads the data and decodes the skipped tags on demand."""
+        for file_name in ('08_carbon.dm3', 'dmTest_3D_int16_64,65,66.dm4'):
+            with ncempy.io.dm.fileDM(data_location / Path(file_name)) as dm0:
+                all_tags = dm0.allTags
+                data0 = dm0.getDataset(0)
+                md0 = dm0.getMetadata(0)
+
+            with ncempy.io.dm.fileDM(data_location / Path(file_name), tags='lazy') as dm1:
+                assert len(dm1._allTags) < len(all_tags)
+                data1 = dm1.getDataset(0)
+                assert (data0['data'] == data1['data']).all()
+                assert data0['pixelSize'] == data1['pixelSize']
+                assert md0.keys() == dm1.getMetadata(0).keys()
+                assert dm1.allTags.keys() == all_tags.keys()
+
+        with pytest.raises(ValueError):
+            ncempy.io.dm.fileDM(data_location / Path('08_carbon.dm3'), parser='numpy', tags='lazy')
+
+    def test_getSlices(self, data_location):
+        """Test reading blocks of slices from 3D data and 4D data."""
+        import numpy as np
+        file_name = data_location / Path('dmTest_3D_int16_64,65,66.dm4')
+        for on_memory in (True, False):
+            with ncempy.io.dm.fileDM(file_name, on_memory=on_memory) as dm0:
+                full = dm0.getDataset(0)['data']
+                assert np.array_equal(dm0.getSlices(0, (2, 10))['data'], full[2:10])
+                assert np.array_equal(dm0.getSlices(0, slice(1, 20, 3))['data'], full[1:20:3])
+                assert np.array_equal(dm0.getSlices(0, slice(10, 2, -2))['data'], full[10:2:-2])
+                assert np.array_equal(dm0.getSlices(0)['data'], full)
+                assert len(dm0.getSlices(0, 4)['pixelSize']) == 3
+                with pytest.raises(IndexError):
+                    dm0.getSlices(0, 100)
+
+                # Treat the 3D data set as 4D to test the offsets
+                dm0.zSize[1] = 13
+                dm0.zSize2[1] = 5
+                full4 = full[:65].reshape((5, 13) + full.shape[1:])
+                for z2 in range(5):
+                    for z in (0, 7, 12):
+                        assert np.array_equal(dm0.getSlice(0, z, z2)['data'], full4[z2, z])
+                assert np.array_equal(dm0.getSlices(0, (2, 5), (1, 4))['data'], full4[1:4, 2:5])
+                assert np.array_equal(dm0.getSlices(0, None, (1, 3))['data'], full4[1:3])
+                assert np.array_equal(dm0.getSlices(0, 3, None)['data'], full4[:, 3:4])
+                assert np.array_equal(dm0.getSlices(0, slice(9, 1, -3), slice(4, 0, -2))['data'],
+                                      full4[4:0:-2, 9:1:-3])
+
+        with ncempy.io.dm.fileDM(file_name, on_memory=True) as dm0:
+            view = dm0.getSlices(0, (0, 4), copy=False)['data']
+            assert not view.flags.owndata
+            assert view.shape == (4,) + full.shape[1:]
+            del view
@@ -8,6 +8,7 @@ from pathlib import Path
 import tempfile
 
 import numpy as np
+import h5py
 
 import ncempy.io.emd
 
@@ -199,3 +200,280 @@ class Testemd:
             md = f0.getMetadata(0)
         
         assert md['binning'] == 4
+
+    def test_chunk_presets(self, temp_file):
+        import h5py
+        assert ncempy.io.emd.chunkShape((100, 512, 512), np.uint16, 'image-stack') == (2, 512, 512)
+        assert ncempy.io.emd.chunkShape((4096, 4096), np.uint16, 'image-stack') == (128, 4096)
+        assert ncempy.io.emd.chunkShape((64, 64, 128, 128), np.float32, '4dstem-diffraction') == (1, 16, 128, 128)
+        assert ncempy.io.emd.chunkShape((64, 64, 128, 128), np.float32, '4dstem-realspace') == (64, 64, 1, 64)
+        assert ncempy.io.emd.chunkShape((100, 80, 2048), np.float32, 'spectrum-image') == (1, 80, 2048)
+        with pytest.raises(ValueError):
+            ncempy.io.emd.chunkShape((10, 10), np.uint16, '4dstem-diffraction')
+        with pytest.raises(ValueError):
+            ncempy.io.emd.chunkShape((10, 10), np.uint16, 'unknown')
+
+        dd = np.random.default_rng(0).poisson(0.5, (8, 8, 32, 32)).astype(np.uint16)
+        dims = ncempy.io.emd.defaultDims(dd)
+        with ncempy.io.emd.fileEMD(temp_file, readonly=False) as emd0:
+            emd0.put_emdgroup('diffraction', dd, dims, preset='4dstem-diffraction', compression='bitshuffle')
+            emd0.put_emdgroup('realspace', dd, dims, preset='4dstem-realspace', chunk_bytes=2 ** 12)
+            emd0.put_emdgroup('custom', dd, dims, preset='4dstem-realspace', chunks=(8, 8, 32, 32))
+        with h5py.File(temp_file, 'r') as f0:
+            assert f0['data/diffraction/data'].chunks == (8, 8, 32, 32)
+            assert f0['data/realspace/data'].chunks == (8, 8, 1, 32)
+            assert f0['data/custom/data'].chunks == (8, 8, 32, 32)
+            assert np.array_equal(f0['data/diffraction/data'][:], dd)
+            assert np.array_equal(f0['data/realspace/data'][:], dd)
+
+    def test_chunk_presets_size(self, tmp_path):
+        """ The 4dstem-diffraction preset with bitshuffle or zstd compression should at least halve the
+        file size of sparse 4D-STEM data. Timings are in benchmark_emd.py.
+
+        """
+        dd = np.random.default_rng(0).poisson(0.5, (32, 32, 64, 64)).astype(np.uint16)
+        dims = ncempy.io.emd.defaultDims(dd)
+
+        sizes = {}
+        for preset, compression in ((None, None), ('4dstem-diffraction', 'bitshuffle'),
+                                    ('4dstem-diffraction', 'zstd')):
+            file_name = tmp_path / '{}_{}.emd'.format(preset, compression)
+            with ncempy.io.emd.fileEMD(file_name, readonly=False) as emd0:
+                emd0.put_emdgroup('bench', dd, dims, preset=preset, compression=compression, chunk_bytes=2 ** 16)
+            sizes[compression] = file_name.stat().st_size
+
+        assert sizes['bitshuffle'] < sizes[None] / 2
+        assert sizes['zstd'] < sizes[None] / 2
+
+    def test_emdgroup_stream(self, temp_file):
+        frames = np.arange(23 * 6 * 5, dtype=np.uint16).reshape((23, 6, 5))
+        dims = ((0.5, 'time', 's'), (np.arange(6) * 0.1, 'y', 'nm'), (np.arange(5) * 0.2, 'x', 'nm'))
+        with ncempy.io.emd.fileEMD(temp_file, readonly=False) as emd0:
+            with emd0.create_emdgroup_stream('stream', (6, 5), np.uint16, dims, chunks=(4, 6, 5),
+                                             compression='gzip') as stream:
+                stream.append(frames[0])
+                stream.append(frames[1:3])
+                assert len(stream) == 3
+                assert stream.dataset.shape[0] == 0  # frames are buffered until a chunk is full
+                stream.append(frames[3:14])
+                assert stream.dataset.shape[0] == 12
+                for frame in frames[14:]:
+                    stream.append(frame)
+            assert emd0.list_emds[0].name == '/data/stream'
+            with pytest.raises(RuntimeError):
+                stream.append(frames[0])
+
+            values = np.array([10.0, 11.5, 12.0])
+            with emd0.create_emdgroup_stream('spectra', (7,), np.float32,
+                                             ((1, 'time', 's'), (np.arange(7), 'E', 'eV'))) as stream:
+                stream.append(np.ones((3, 7)), values=values)
+
+        with ncempy.io.emd.fileEMD(temp_file) as emd1:
+            data, dims1 = emd1.get_emdgroup(emd1.file_hdl['data/stream'])
+            assert np.array_equal(data, frames)
+            assert np.allclose(dims1[0][0], np.arange(23) * 0.5)
+            assert dims1[0][1] == 'time'
+            assert np.allclose(dims1[2][0], dims[2][0])
+            assert emd1.file_hdl['data/stream/data'].compression == 'gzip'
+            data, dims1 = emd1.get_emdgroup(emd1.file_hdl['data/spectra'])
+            assert data.shape == (3, 7)
+            assert np.array_equal(dims1[0][0], values)
+
+    def test_find_emdgroups(self, temp_file):
+        dd = np.zeros((3, 4))
+        dims = ncempy.io.emd.defaultDims(dd)
+        with ncempy.io.emd.fileEMD(temp_file, readonly=False) as emd0:
+            for label in ('b', 'a'):
+                grp = emd0.put_emdgroup(label, dd, dims)
+                emd0.put_emdgroup('inner', dd, dims, parent=grp)
+            assert [grp.name for grp in emd0.list_emds] == ['/data/b', '/data/b/inner', '/data/a', '/data/a/inner']
+
+            # Overwriting removes the old group and its subgroups from the list
+            emd0.put_emdgroup('b', dd, dims, overwrite=True)
+            assert [grp.name for grp in emd0.list_emds] == ['/data/a', '/data/a/inner', '/data/b']
+
+            # A group outside of /data
+            emd0.put_emdgroup('other', dd, dims, parent=emd0.user)
+
+        with ncempy.io.emd.fileEMD(temp_file) as emd1:
+            assert [grp.name for grp in emd1.list_emds] == ['/data/a', '/data/a/inner', '/data/b', '/user/other']
+        with ncempy.io.emd.fileEMD(temp_file, data_only=True) as emd1:
+            assert [grp.name for grp in emd1.list_emds] == ['/data/a', '/data/a/inner', '/data/b']
+
+        # Groups reached through soft links are listed with the link path. Dangling links and links to a
+        # parent group are skipped.
+        with h5py.File(temp_file, 'a') as f:
+            del f['data/a']
+            f['user/link'] = h5py.SoftLink('/data/b')
+            f['user/outer/inner_link'] = h5py.SoftLink('/data')
+            f['user/dangling'] = h5py.SoftLink('/nothing')
+            f['data/b/up'] = h5py.SoftLink('/data')
+        with ncempy.io.emd.fileEMD(temp_file) as emd1:
+            assert [grp.name for grp in emd1.list_emds] == ['/data/b', '/user/other', '/user/link', '/user/link/up/b',
+                                                            '/user/outer/inner_link/b']
+
+    def test_lazy(self, temp_file):
+        dd = np.arange(6 * 7 * 8).reshape((6, 7, 8))
+        ncempy.io.emd.emdWriter(temp_file, dd)
+        with ncempy.io.emd.fileEMD(temp_file) as emd0:
+            data, dims = emd0.get_emdgroup(0, lazy=True)
+            data2, _ = emd0.get_memmap(0)
+        assert isinstance(data, ncempy.io.emd.EmdDataset)
+        assert data.shape == dd.shape
+        assert len(dims) == 3
+        for key in (2, (slice(None, None, -2), 3), (..., [7, 0, 0]), ([4, 1], slice(None), [2, 3]),
+                    (0, slice(None), [5, 1]), (dd[:, 0, 0] > 20, None, -1), ([],)):
+            assert np.array_equal(data[key], dd[key])
+        assert np.array_equal(np.asarray(data2), dd)
+
+        # Both datasets share one file handle which is closed with the last dataset
+        key = data._key
+        assert key[0] == str(temp_file.resolve())
+        assert ncempy.io.emd._HANDLES[key][1] == 2
+        data.close()
+        del data2
+        assert key not in ncempy.io.emd._HANDLES
+
+        # A replaced file does not reuse the handle of the old file
+        with ncempy.io.emd.fileEMD(temp_file) as emd0:
+            data, _ = emd0.get_memmap(0)
+        ncempy.io.emd.emdWriter(temp_file, np.ones((4, 5)), overwrite=True)
+        with ncempy.io.emd.fileEMD(temp_file) as emd0:
+            data2, _ = emd0.get_memmap(0)
+            assert data2.shape == (4, 5)
+            assert np.array_equal(data2[:], emd0.get_emdgroup(0)[0])
+        assert data.shape == dd.shape
+        data.close()
+        data2.close()
+        assert len(ncempy.io.emd._HANDLES) == 0
+
+    def test_read_parallel(self, temp_file):
+        dd = np.random.default_rng(0).poisson(2, (8, 6, 16, 16)).astype(np.uint16)
+        with ncempy.io.emd.fileEMD(temp_file, readonly=False) as emd0:
+            emd0.put_emdgroup('4dstem', dd, ncempy.io.emd.defaultDims(dd), chunks=(2, 3, 16, 16),
+                              compression='zstd')
+
+        with ncempy.io.emd.fileEMD(temp_file) as emd1:
+            data, _ = emd1.get_emdgroup(0, lazy=True)
+            shape, pieces = data._pieces((slice(1, 8, 1), 2, slice(0, 16, 1), [1, 5]))
+            assert shape == (7, 1, 16, 2)
+            assert len(pieces) == 4  # chunks of the rows 1, 2-3, 4-5 and 6-7
+            key = (slice(None, None, -2), 4, [6, 1, 1])
+            assert np.array_equal(data.read_parallel(key, processes=2), dd[key])
+            full, _ = emd1.get_emdgroup(0, processes=2)
+            assert np.array_equal(full, dd)
+
+    def test_async_writer(self, temp_file):
+        dd = np.arange(10 * 4 * 3, dtype=np.float32).reshape((10, 4, 3))
+        with ncempy.io.emd.fileEMD(temp_file, readonly=False) as emd0:
+            grp = emd0.put_emdgroup('blocks', None, ncempy.io.emd.defaultDims(dd), shape=dd.shape, dtype=dd.dtype)
+            dims = ((1, 'frame', ''), (np.arange(4), 'y', ''), (np.arange(3), 'x', ''))
+            stream = emd0.create_emdgroup_stream('stream', (4, 3), np.float32, dims, chunks=(4, 4, 3))
+            with emd0.async_writer(max_blocks=1) as writer:
+                block = np.empty((2, 4, 3), dtype=np.float32)
+                for ii in range(0, 10, 2):
+                    block[:] = dd[ii:ii + 2]  # the block is reused
+                    writer.write(grp['data'], np.s_[ii:ii + 2], block)
+                    writer.append(stream, block)
+                writer.submit(stream.close)
+                writer.flush()
+                assert np.array_equal(grp['data'][:], dd)
+
+            # Errors in the writer thread are raised in the calling thread
+            writer = emd0.async_writer()
+            writer.write(grp['data'], np.s_[0:2], np.zeros((3, 4, 3)))
+            with pytest.raises(RuntimeError):
+                writer.close()
+            with pytest.raises(RuntimeError):
+                writer.write(grp['data'], np.s_[0:2], np.zeros((2, 4, 3)))
+
+        with ncempy.io.emd.fileEMD(temp_file) as emd1:
+            assert np.array_equal(emd1.file_hdl['data/stream/data'][:], dd)
+            assert np.array_equal(emd1.file_hdl['data/blocks/data'][:], dd)
+
+    def test_rechunk(self, tmp_path):
+        import h5py
+        dd = np.random.default_rng(0).poisson(2, (8, 8, 16, 16)).astype(np.uint16)
+        dims = ncempy.io.emd.defaultDims(dd)
+        with ncempy.io.emd.fileEMD(tmp_path / 'src.emd', readonly=False) as emd0:
+            emd0.put_emdgroup('4dstem', dd, dims, preset='4dstem-diffraction', compression='gzip')
+            emd0.list_emds[0].attrs['comment'] = 'test'
+
+        with ncempy.io.emd.fileEMD(tmp_path / 'src.emd') as emd0:
+            src = emd0.list_emds[0]
+            assert src['data'].chunks == (8, 8, 16, 16)
+            # The whole dataset fits into memory
+            assert ncempy.io.emd.rechunk(src, tmp_path / 'dst.emd', (8, 8, 1, 4), label='one') == 1
+            # Blocks of whole target chunks cover only part of a source chunk
+            assert ncempy.io.emd.rechunk(src, tmp_path / 'dst.emd', (8, 8, 1, 4), max_mem=2 ** 10,
+                                         label='two', compression='zstd', tmp_dir=tmp_path) == 2
+            with pytest.raises(ValueError):
+                ncempy.io.emd.rechunk(src, tmp_path / 'dst.emd', (8, 8, 1), label='bad')
+
+        assert sorted(pp.name for pp in tmp_path.iterdir()) == ['dst.emd', 'src.emd']
+        with h5py.File(tmp_path / 'dst.emd', 'r') as f0:
+            for label in ('one', 'two'):
+                grp = f0['data'][label]
+                assert grp['data'].chunks == (8, 8, 1, 4)
+                assert np.array_equal(grp['data'][:], dd)
+                assert np.array_equal(grp['dim3'][:], dims[2][0])
+                assert grp.attrs['comment'] == 'test'
+            assert f0['data/one/data'].compression is None
+
+    def test_chunk_cache(self, temp_file):
+        cache = ncempy.io.emd.chunkCache((32, 32, 128, 128), (4, 4, 64, 64), np.uint16, 'frame')
+        assert cache == {'rdcc_nbytes': 2 ** 22, 'rdcc_nslots': 3203, 'rdcc_w0': 1.0}  # one row of 8 chunks
+        cache = ncempy.io.emd.chunkCache((32, 32, 128, 128), (4, 4, 64, 64), np.uint16, 'pixel')
+        assert cache['rdcc_nbytes'] == 2 ** 24  # 64 chunks of one pixel times 2 chunks along the row
+        cache = ncempy.io.emd.chunkCache((100, 128, 128), (1, 128, 128), np.float32, 'random')
+        assert cache['rdcc_nbytes'] == 2 ** 20
+        cache = ncempy.io.emd.chunkCache((128, 128, 100), (128, 128, 1), np.uint16, 'pixel', frame_axes=(0, 1))
+        assert cache['rdcc_nbytes'] == 100 * 2 ** 15
+        with pytest.raises(ValueError):
+            ncempy.io.emd.chunkCache((10, 10), (5, 5), np.uint16, 'unknown')
+
+        dd = np.arange(8 * 8 * 16 * 16, dtype=np.uint16).reshape((8, 8, 16, 16))
+        with ncempy.io.emd.fileEMD(temp_file, readonly=False) as emd0:
+            emd0.put_emdgroup('4dstem', dd, ncempy.io.emd.defaultDims(dd), chunks=(2, 2, 16, 16),
+                              compression='gzip')
+
+        small = {'rdcc_nbytes': 2 ** 11, 'rdcc_nslots': 521, 'rdcc_w0': 0.75}
+        with ncempy.io.emd.fileEMD(temp_file, chunk_cache=small) as emd0:
+            for access, misses in ((None, 32), ('frame', 16)):  # the small cache holds one chunk
+                data, _ = emd0.get_emdgroup(0, lazy=True, access=access)
+                for ii in range(8):
+                    for jj in range(8):
+                        assert np.array_equal(data[ii, jj], dd[ii, jj])
+                info = data.cache_info()
+                assert info['misses'] == misses and info['hits'] == 64 - misses
+                data.close()
+            assert data.chunk_cache['rdcc_nbytes'] == 2 ** 20
+
+            data, _ = emd0.get_memmap(0, access='pixel')
+            assert np.array_equal(data[:, :, 3, [1, 5]], dd[:, :, 3, [1, 5]])
+            assert data.cache_info() == {'hits': 0, 'misses': 16, 'maxsize': 512, 'currsize': 16}
+            data.close()
+
+    def test_chunk_cache_misses(self, tmp_path):
+        """ Virtual images of compressed 4D-STEM data with a small chunk cache and with the chunk cache
+        for the pixel access pattern. The small cache decompresses each chunk again for every detector
+        pixel. Timings are in benchmark_emd.py.
+
+        """
+        dd = np.random.default_rng(0).poisson(1, (16, 16, 64, 64)).astype(np.uint16)
+        with ncempy.io.emd.fileEMD(tmp_path / 'bench.emd', readonly=False) as emd0:
+            emd0.put_emdgroup('4dstem', dd, ncempy.io.emd.defaultDims(dd), chunks=(4, 4, 32, 32),
+                              compression='gzip')
+
+        misses = {}
+        with ncempy.io.emd.fileEMD(tmp_path / 'bench.emd', chunk_cache={'rdcc_nbytes': 2 ** 18}) as emd0:
+            for access in (None, 'pixel'):
+                data, _ = emd0.get_emdgroup(0, lazy=True, access=access)
+                for kk in range(0, 64, 4):
+                    for ll in range(0, 64, 4):
+                        _ = data[:, :, kk, ll]
+                misses[access] = data.cache_info()['misses']
+                data.close()
+
+        assert misses['pixel'] == 64  # each chunk is decompressed once
+        assert misses[None] == 256 * 16
@@ -6,6 +6,8 @@ import pytest
 
 from pathlib import Path
 
+import numpy as np
+
 import ncempy.io.emdVelox
 
 
@@ -71,3 +73,71 @@ class TestEMDVelox:
         with ncempy.io.emdVelox.fileEMDVelox(file_path) as emd0:
             md = emd0.getMetadata(0)
         assert md['AccelerationVoltage'] == '300000'
+
+    def test_chunk_cache(self, data_location):
+        file_path = data_location / Path('STEM HAADF-DF4-DF2-BF Diffraction Micro.emd')
+        with ncempy.io.emdVelox.fileEMDVelox(file_path) as emd0:
+            dd, _ = emd0.get_dataset(0)
+            data, _ = emd0.get_dataset(0, memmap=True)
+            assert data.id.get_access_plist().get_chunk_cache()[1] == 10485760
+        with ncempy.io.emdVelox.fileEMDVelox(file_path, chunk_cache={'rdcc_nbytes': 2 ** 16}) as emd0:
+            data, _ = emd0.get_dataset(0, memmap=True, access='pixel')
+            assert data.chunk_cache['rdcc_nbytes'] == 2 ** 20
+            assert np.array_equal(data[:, :, 0], dd)
+            assert np.array_equal(data[10, 20:30], dd[10, 20:30, None])
+            assert data.cache_info()['misses'] == 1 and data.cache_info()['hits'] == 1
+            data.close()
+
+    def test_metadata_cache(self, data_location, tmp_path, monkeypatch):
+        import json
+        import h5py
+        calls = []
+        json_loads = json.loads
+
+        def loads(text):
+            calls.append(text)
+            return json_loads(text)
+
+        monkeypatch.setattr(ncempy.io.emdVelox.json, 'loads', loads)
+        with ncempy.io.emdVelox.fileEMDVelox(data_location / Path('STEM HAADF-DF4-DF2-BF Diffraction Micro.emd')) as emd0:
+            out = str(emd0)
+            assert str(emd0) == out
+            _ = emd0.get_dataset(1)
+            _ = emd0.getMetadata(2)
+            assert len(calls) == len(emd0.list_data) == 4
+
+        # A multi-frame data set with one metadata column per frame
+        frames = []
+        for ii in range(3):
+            md = {'BinaryResult': {'PixelUnitX': 'm', 'PixelUnitY': 'm', 'Detector': 'HAADF',
+                                   'PixelSize': {'width': str(1e-10 * (ii + 1)), 'height': '1e-10'}},
+                  'Acquisition': {'AcquisitionStartDatetime': {'DateTime': str(1600000000 + ii)}},
+                  'Stage': {'AlphaTilt': str(0.1 * ii)}, 'CustomProperties': {}}
+            frames.append(np.frombuffer(json.dumps(md).encode('utf-8'), dtype=np.uint8))
+        metadata = np.zeros((1000, 3), dtype=np.uint8)
+        for ii, frame in enumerate(frames):
+            metadata[:len(frame), ii] = frame
+        with h5py.File(tmp_path / 'frames.emd', 'w') as f0:
+            grp = f0.create_group('Data/Image/0123')
+            grp['Data'] = np.zeros((4, 5, 3), dtype=np.uint16)
+            grp['Metadata'] = metadata
+
+        calls.clear()
+        with ncempy.io.emdVelox.fileEMDVelox(tmp_path / 'frames.emd') as emd0:
+            assert emd0.getMetadata(0, frame=2)['AlphaTilt'] == '0.2'
+            assert len(calls) == 1
+            md = emd0.parseMetaData(0, frame=1)
+            assert round(md['pixelSize'][0], ndigits=4) == 0.2
+            md['Stage']['AlphaTilt'] = 'changed'
+            assert emd0.getMetadata(0, frame=-2)['AlphaTilt'] == '0.1'
+            # Changing the returned metadata does not change the cache
+            md = emd0.getMetadata(0, frame=2)
+            md['PixelSize']['width'] = 'changed'
+            emd0.metaDataJSON['Stage']['AlphaTilt'] = 'changed'
+            md = emd0.getMetadata(0, frame=2)
+            assert md['PixelSize']['width'] == str(1e-10 * 3)
+            assert md['AlphaTilt'] == '0.2'
+            assert emd0.getDataset(0)[1]['AcquisitionTime'].timestamp() == 1600000000
+            assert len(calls) == 3
+            with pytest.raises(IndexError):
+                emd0.getMetadata(0, frame=3)
@@ -6,9 +6,99 @@ import pytest
 
 from pathlib import Path
 
+import numpy as np
+
 import ncempy.io.ser
 
 
+def write_ser(file_name, data, scan_shape=None, tag_type=0x4142, version=0x0220, irregular=False,
+              calibrated=False, interleaved=False):
+    """Write a minimal SER file for testing.
+
+    Parameters
+    ----------
+        file_name : pathlib.Path
+            The file to write.
+        data : ndarray
+            Spectra as [N, L] (1D data elements) or images as [N, Y, X] (2D data elements).
+        scan_shape : tuple, optional
+            The shape of the series in C-order. Default is [N].
+        tag_type : int
+            0x4142 for time and position tags or 0x4152 for time only tags.
+        version : int
+            The SeriesVersion. 0x0210 uses 32 bit offsets and 0x0220 uses 64 bit offsets.
+        irregular : bool
+            Add padding after every other data element so the offsets do not have a uniform stride.
+        calibrated : bool
+            Write the scan positions that match the dimension calibration of a 2D scan_shape.
+        interleaved : bool
+            Write the offset arrays after the header and each tag directly after its data element as TIA does.
+            The file then ends with the last tag.
+
+    """
+    dtypes = {np.dtype('<u2'): 2, np.dtype('<i4'): 6, np.dtype('<f4'): 7, np.dtype('<f8'): 8}
+    offset_dtype = '<i4' if version == 0x0210 else '<i8'
+    num = data.shape[0]
+    if scan_shape is None:
+        scan_shape = (num,)
+
+    out = bytearray()
+    out += np.array([0x4949, 0x0197, version], '<i2').tobytes()
+    out += np.array([0x4122 if data.ndim == 3 else 0x4120, tag_type, num, num], '<i4').tobytes()
+    offset_position = len(out)
+    out += np.zeros(1, offset_dtype).tobytes()
+    out += np.array([len(scan_shape)], '<i4').tobytes()
+    for ii, size in enumerate(scan_shape[::-1]):
+        out += np.array([size], '<i4').tobytes() + np.array([0.5 * ii, 2.0 + ii], '<f8').tobytes()
+        out += np.array([0], '<i4').tobytes()
+        for text in (('Position', 'm') if tag_type == 0x4142 else ('Number', '')):
+            out += np.array([len(text)], '<i4').tobytes() + text.encode()
+
+    if interleaved:
+        offset_array = len(out)
+        out += bytes(2 * num * np.dtype(offset_dtype).itemsize)
+
+    def write_tag(ii):
+        tag_offsets.append(len(out))
+        out.extend(np.array([tag_type, 100 + ii], '<i4').tobytes())
+        if tag_type == 0x4142 and calibrated:
+            # pixel centers of the calibrated scan (see fileSER.writeEMD)
+            jj, kk = divmod(ii, scan_shape[1])
+            out.extend(np.array([2.0 * kk + 1.0, 3.0 * jj - 1.0], '<f8').tobytes())
+        elif tag_type == 0x4142:
+            out.extend(np.array([ii * 1.5, -ii * 2.5], '<f8').tobytes())
+
+    data_offsets = []
+    tag_offsets = []
+    for ii in range(num):
+        data_offsets.append(len(out))
+        for jj in range(data.ndim - 1):
+            out += np.array([0.1 * jj, 0.01 * (jj + 1)], '<f8').tobytes() + np.array([0], '<i4').tobytes()
+        out += np.array([dtypes[data.dtype]], '<i2').tobytes()
+        out += np.array(data.shape[1:][::-1], '<i4').tobytes()
+        if data.ndim == 3:
+            out += np.flipud(data[ii]).tobytes()
+        else:
+            out += data[ii].tobytes()
+        if irregular and ii % 2 == 0:
+            out += bytes(8)
+        if interleaved:
+            write_tag(ii)
+
+    if not interleaved:
+        for ii in range(num):
+            write_tag(ii)
+        offset_array = len(out)
+        out += bytes(2 * num * np.dtype(offset_dtype).itemsize)
+
+    offset_bytes = np.array(data_offsets, offset_dtype).tobytes() + np.array(tag_offsets, offset_dtype).tobytes()
+    out[offset_array:offset_array + len(offset_bytes)] = offset_bytes
+    out[offset_position:offset_position + np.dtype(offset_dtype).itemsize] = \
+        np.array([offset_array], offset_dtype).tobytes()
+    with open(file_name, 'wb') as fid:
+        fid.write(out)
+
+
 class Testser():
     """
     Test the SER io module.
@@ -32,6 +122,211 @@ class Testser():
             assert dd[0, 0] == 18024
             assert md['Calibration'][0]['CalibrationElement'] == 0
 
+    def test_read_ser_1d(self, tmp_path):
+        spectra = np.arange(12 * 50, dtype='<u2').reshape((12, 50))
+        write_ser(tmp_path / 'spectra_1.ser', spectra, scan_shape=(3, 4))
+        with ncempy.io.ser.fileSER(tmp_path / 'spectra_1.ser') as ser0:
+            assert ser0.head['NumberDimensions'] == 2
+            assert ser0.head['Dimensions'][1]['DimensionSize'] == 3
+            assert ser0.head['Dimensions'][0]['Description'] == 'Position'
+            assert ser0.head['Dimensions'][0]['Units'] == 'm'
+            for ii in (0, 7, 11):
+                dd, md = ser0.getDataset(ii)
+                assert np.array_equal(dd, spectra[ii])
+                assert md['ArrayShape'] == [50]
+                assert md['Calibration'][0]['CalibrationDelta'] == 0.01
+
+    def test_read_ser_version(self, tmp_path):
+        """Read 2D data with 32 bit offsets and time only tags"""
+        images = np.random.rand(5, 6, 7).astype('<f4')
+        write_ser(tmp_path / 'images_1.ser', images, tag_type=0x4152, version=0x0210)
+        with ncempy.io.ser.fileSER(tmp_path / 'images_1.ser') as ser0:
+            assert ser0.head['SeriesVersion'] == 0x0210
+            for ii in range(5):
+                dd, md = ser0.getDataset(ii)
+                assert np.array_equal(dd, images[ii])
+                assert md['ArrayShape'] == [7, 6]
+                dd[0, 0] = 0  # data must be writeable
+
+    def test_getMemmap(self, data_location, tmp_path):
+        spectra = np.arange(12 * 50, dtype='<u2').reshape((12, 50))
+        images = np.random.rand(5, 6, 7).astype('<f4')
+        for irregular in (False, True):
+            write_ser(tmp_path / 'spectra_1.ser', spectra, scan_shape=(3, 4), irregular=irregular)
+            write_ser(tmp_path / 'images_1.ser', images, irregular=irregular)
+            with ncempy.io.ser.fileSER(tmp_path / 'spectra_1.ser') as ser0:
+                mm = ser0.getMemmap()
+                assert isinstance(mm, ncempy.io.ser.SERGatherArray if irregular else np.memmap)
+                assert mm.shape == (3, 4, 50)
+                assert np.array_equal(mm[1, 2], spectra[6])
+                assert np.array_equal(mm[:, 1, 10:20], spectra.reshape((3, 4, 50))[:, 1, 10:20])
+                assert np.array_equal(np.asarray(mm), spectra.reshape((3, 4, 50)))
+            with ncempy.io.ser.fileSER(tmp_path / 'images_1.ser') as ser0:
+                mm = ser0.getMemmap()
+                assert mm.shape == images.shape
+                assert np.array_equal(mm[3], images[3])
+                assert np.array_equal(mm[1:4, 2], images[1:4, 2])
+                assert np.array_equal(mm[..., 0], images[..., 0])
+            dd = ncempy.io.ser.serReader(tmp_path / 'images_1.ser')
+            assert np.array_equal(dd['data'], images)
+
+        with ncempy.io.ser.fileSER(data_location / Path('16_STOimage_1.ser')) as ser0:
+            assert np.array_equal(ser0.getMemmap()[0], ser0.getDataset(0)[0])
+
+    def test_getTags(self, tmp_path):
+        spectra = np.zeros((12, 5), dtype='<u2')
+        for irregular in (False, True):
+            write_ser(tmp_path / 'spectra_1.ser', spectra, scan_shape=(3, 4), irregular=irregular)
+            with ncempy.io.ser.fileSER(tmp_path / 'spectra_1.ser') as ser0:
+                tags = ser0.getTags()
+                assert np.all(tags['valid'])
+                assert np.array_equal(tags['Time'], 100 + np.arange(12))
+                assert np.allclose(tags['PositionX'], np.arange(12) * 1.5)
+                for ii in (0, 5, 11):
+                    tag = ser0._getTag(ii)
+                    assert tag['PositionY'] == tags['PositionY'][ii]
+
+                # Bad tag offsets are invalid
+                ser0.head['TagOffsetArray'][3] = 10 ** 9
+                ser0.head['TagOffsetArray'][4] = ser0.head['DataOffsetArray'][0]
+                tags = ser0.getTags()
+                assert not tags['valid'][3] and not tags['valid'][4]
+                assert tags['Time'][3] == 0 and np.isnan(tags['PositionX'][4])
+                assert np.sum(tags['valid']) == 10
+
+        write_ser(tmp_path / 'images_1.ser', np.zeros((3, 4, 4), dtype='<f4'), tag_type=0x4152)
+        with ncempy.io.ser.fileSER(tmp_path / 'images_1.ser') as ser0:
+            tags = ser0.getTags()
+            assert np.array_equal(tags['Time'], [100, 101, 102])
+            assert np.all(np.isnan(tags['PositionX']))
+
+    def test_interleaved(self, tmp_path):
+        """Files written by TIA end with the tag of the last data element"""
+        import h5py
+        spectra = np.arange(12 * 5, dtype='<u2').reshape((12, 5))
+        write_ser(tmp_path / 'map_1.ser', spectra, scan_shape=(3, 4), calibrated=True, interleaved=True)
+        with ncempy.io.ser.fileSER(tmp_path / 'map_1.ser') as ser0:
+            tags = ser0.getTags()
+            assert np.all(tags['valid'])
+            assert np.array_equal(tags['Time'], 100 + np.arange(12))
+            assert np.allclose(tags['PositionX'], np.tile(np.arange(4) * 2.0 + 1.0, 3))
+            mm = ser0.getMemmap()
+            assert isinstance(mm, np.memmap)
+            assert np.array_equal(mm, spectra.reshape((3, 4, 5)))
+            ser0.writeEMD(tmp_path / 'map.emd')
+        with h5py.File(tmp_path / 'map.emd', 'r') as f0:
+            assert np.array_equal(f0['data/map_1.ser/data'][:], spectra.reshape((3, 4, 5)))
+
+        images = np.arange(6 * 4 * 3, dtype='<u2').reshape((6, 4, 3))
+        for number, (start, stop) in ((1, (0, 4)), (2, (4, 6))):
+            write_ser(tmp_path / 'series_{}.ser'.format(number), images[start:stop], tag_type=0x4152,
+                      interleaved=True)
+        with ncempy.io.ser.fileSERSeries(tmp_path / 'series_1.ser') as series:
+            assert np.array_equal(series.getTags()['Time'], 100 + np.array([0, 1, 2, 3, 0, 1]))
+            assert np.array_equal(np.asarray(series), images)
+
+    def test_iter_datasets(self, data_location, tmp_path):
+        images = np.arange(7 * 6 * 5, dtype='<f4').reshape((7, 6, 5))
+        for irregular in (False, True):
+            write_ser(tmp_path / 'images_1.ser', images, tag_type=0x4152, irregular=irregular)
+            with ncempy.io.ser.fileSER(tmp_path / 'images_1.ser') as ser0:
+                offset = ser0.head['DataOffsetArray'][4]
+            # Change the calibration of one element
+            with open(tmp_path / 'images_1.ser', 'r+b') as f0:
+                f0.seek(offset)
+                f0.write(np.array([9.0], '<f8').tobytes())
+
+            with ncempy.io.ser.fileSER(tmp_path / 'images_1.ser') as ser0:
+                out = np.empty((3, 6, 5), dtype='<f4')
+                batches = [(data.copy(), meta) for data, meta in ser0.iter_datasets(batch=3, out=out)]
+                assert [len(data) for data, _ in batches] == [3, 1, 1, 2]
+                assert [meta is None for _, meta in batches] == [False, True, False, False]
+                assert np.array_equal(np.concatenate([data for data, _ in batches]), images)
+                assert batches[0][1] == ser0.getDataset(0)[1]
+                assert batches[2][1]['Calibration'][0]['CalibrationOffset'] == 9.0
+                assert [len(data) for data, _ in ser0.iter_datasets(batch=2, start=1, stop=4)] == [2, 1]
+                with pytest.raises(ValueError):
+                    next(ser0.iter_datasets(batch=4, out=out))
+
+        # NaN calibrations differ from themselves. Each element is yielded in its own batch.
+        write_ser(tmp_path / 'images_1.ser', images, tag_type=0x4152)
+        with ncempy.io.ser.fileSER(tmp_path / 'images_1.ser') as ser0:
+            offsets = ser0.head['DataOffsetArray']
+        with open(tmp_path / 'images_1.ser', 'r+b') as f0:
+            for offset in offsets:
+                f0.seek(offset)
+                f0.write(np.array([np.nan], '<f8').tobytes())
+        with ncempy.io.ser.fileSER(tmp_path / 'images_1.ser') as ser0:
+            batches = [(data.copy(), meta) for data, meta in ser0.iter_datasets(batch=3)]
+            assert [len(data) for data, _ in batches] == [1] * 7
+            assert np.array_equal(np.concatenate([data for data, _ in batches]), images)
+            assert np.isnan(batches[6][1]['Calibration'][0]['CalibrationOffset'])
+
+        with ncempy.io.ser.fileSER(data_location / Path('16_STOimage_1.ser')) as ser0:
+            data, meta = next(ser0.iter_datasets())
+            assert np.array_equal(data[0], ser0.getDataset(0)[0])
+
+    def test_fileSERSeries(self, tmp_path):
+        images = np.arange(12 * 4 * 3, dtype='<u2').reshape((12, 4, 3))
+        # Parts are sorted by number and not alphabetically
+        for number, (start, stop) in ((1, (0, 5)), (2, (5, 6)), (10, (6, 12))):
+            write_ser(tmp_path / 'series_{}.ser'.format(number), images[start:stop], tag_type=0x4152,
+                      irregular=(number == 10))
+        write_ser(tmp_path / 'other_1.ser', images[:2], tag_type=0x4152)
+
+        with ncempy.io.ser.fileSERSeries(tmp_path / 'series_2.ser') as series:
+            assert [ff.name for ff in series.files] == ['series_1.ser', 'series_2.ser', 'series_10.ser']
+            assert series.shape == images.shape
+            assert series.dtype == images.dtype
+            assert series.locate(5) == (1, 0)
+            assert series.locate(-1) == (2, 5)
+            assert np.array_equal(series[7], images[7])
+            assert np.array_equal(series[3:9:2, 1], images[3:9:2, 1])
+            assert np.array_equal(series[[11, 0, 5]], images[[11, 0, 5]])
+            assert np.array_equal(series[..., 2], images[..., 2])
+            assert np.array_equal(np.asarray(series), images)
+            assert np.array_equal(series.getDataset(6)[0], images[6])
+            assert np.array_equal(series.getTags()['Time'], 100 + np.array([0, 1, 2, 3, 4, 0, 0, 1, 2, 3, 4, 5]))
+            with pytest.raises(IndexError):
+                series.locate(12)
+
+        write_ser(tmp_path / 'series_2.ser', np.zeros((2, 5, 3), dtype='<u2'), tag_type=0x4152)
+        with pytest.raises(ValueError):
+            ncempy.io.ser.fileSERSeries(tmp_path / 'series_1.ser')
+
+    def test_writeEMD(self, tmp_path):
+        import h5py
+        spectra = np.arange(12 * 5, dtype='<u2').reshape((12, 5))
+        write_ser(tmp_path / 'map_1.ser', spectra, scan_shape=(3, 4), calibrated=True)
+        calls = []
+        with ncempy.io.ser.fileSER(tmp_path / 'map_1.ser') as ser0:
+            ser0.writeEMD(tmp_path / 'map.emd', compression='gzip', block_size=40,
+                          progress=lambda done, total: calls.append((done, total)))
+        assert calls == [(4, 12), (8, 12), (12, 12)]
+        with h5py.File(tmp_path / 'map.emd', 'r') as f0:
+            grp = f0['data/map_1.ser']
+            assert grp['data'].compression == 'gzip'
+            assert grp['data'].chunks == (1, 4, 5)
+            assert np.array_equal(grp['data'][:], spectra.reshape((3, 4, 5)))
+            assert np.array_equal(grp['timestamp/data'][:], 100 + np.arange(12).reshape((3, 4)))
+            assert np.allclose(grp['dim2'][:], np.arange(4) * 2.0 + 1.0)
+
+        # Positions that do not match the scan calibration
+        write_ser(tmp_path / 'map_1.ser', spectra, scan_shape=(3, 4))
+        with ncempy.io.ser.fileSER(tmp_path / 'map_1.ser') as ser0:
+            with pytest.raises(RuntimeError):
+                ser0.writeEMD(tmp_path / 'bad.emd')
+
+        images = np.arange(5 * 6 * 7, dtype='<f4').reshape((5, 6, 7))
+        write_ser(tmp_path / 'images_1.ser', images, tag_type=0x4152, irregular=True)
+        with ncempy.io.ser.fileSER(tmp_path / 'images_1.ser') as ser0:
+            ser0.writeEMD(tmp_path / 'images.emd', chunks=(2, 6, 7))
+        with h5py.File(tmp_path / 'images.emd', 'r') as f0:
+            grp = f0['data/images_1.ser']
+            assert grp['data'].chunks == (2, 6, 7)
+            assert np.array_equal(grp['data'][:], images)
+            assert np.array_equal(grp['dim1_time'][:], 100 + np.arange(5))
+
     def test_read_ser_3d(self, data_location):
         with ncempy.io.ser.fileSER(data_location / Path('01_Si110_5images_1.ser')) as ser0:
             assert ser0